@@ -0,0 +1,159 @@
+import asyncio
+import threading
+import http_client
+
+
+class AsyncPageCrawler:
+    """Fetch 'auction history' pages concurrently on a background asyncio loop and hand them back in page order"""
+
+    def __init__(self, page_url, headers, max_in_flight=4, prefetch=None, parse=None, executor=None):
+        # page_url:      url to which '&currentpage=<n>' is appended
+        # max_in_flight: maximum number of simultaneous requests (request starts are paced by http_client.limiter)
+        # prefetch:      maximum number of fetched pages waiting to be parsed (bounds memory use)
+        # parse:         optional module-level function html_text -> parsed data, run on the executor's processes
+        #                as soon as a page is fetched (pages() then yields parsed data instead of html text)
+        self.page_url = page_url
+        self.headers = headers
+        self.max_in_flight = max_in_flight
+        self.parse = parse
+        self.executor = executor
+        self.prefetch = prefetch if prefetch else 4 * max_in_flight
+
+        self.first_page = 1
+        self.last_page = 0
+        self._results = {}
+        self._condition = threading.Condition()
+        self._thread = None
+        self._loop = None
+        self._task = None
+        self._window = None
+        self._last_page_moved = None
+        self._stopped = False
+        self._consumed = False
+        self._finished = False
+        self._error = None
+
+    def start(self, first_page, last_page):
+        """Start fetching pages first_page..last_page on a background thread"""
+        self.first_page = first_page
+        self.last_page = last_page
+        self._thread = threading.Thread(target=asyncio.run, args=(self._run(),), daemon=True)
+        self._thread.start()
+
+    def set_last_page(self, last_page):
+        """Update the last page to be fetched (e.g. as auctions finishing while crawling push the history down)"""
+        with self._condition:
+            self.last_page = last_page
+            self._condition.notify_all()
+        self._wake_up()
+
+    def stop(self):
+        """Cancel every pending request and wait for the background thread to finish"""
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+        if self._loop and self._task:
+            try:
+                self._loop.call_soon_threadsafe(self._task.cancel)
+            except RuntimeError:
+                # Event loop already closed
+                pass
+        if self._thread:
+            self._thread.join()
+
+    def pages(self):
+        """Yield (page_number, status_code, html_text | parsed_data, served) tuples in page order, as soon as each page
+        is available (served: time.monotonic() interval in which the server produced the page)"""
+        page_number = self.first_page
+        while True:
+            with self._condition:
+                while page_number not in self._results:
+                    if self._stopped or self._error or page_number > self.last_page:
+                        break
+                    if self._finished:
+                        break
+                    self._condition.wait()
+                if self._error:
+                    raise self._error
+                if page_number not in self._results:
+                    # Every page consumed: the fetch loop no longer waits for the last page to move
+                    self._consumed = True
+                    self._wake_up()
+                    return
+                status, text, served = self._results.pop(page_number)
+            self._release_window()
+            yield page_number, status, text, served
+            page_number += 1
+
+    def _wake_up(self):
+        # Wake the fetch loop up once every page has been requested
+        if self._loop and self._last_page_moved:
+            try:
+                self._loop.call_soon_threadsafe(self._last_page_moved.set)
+            except RuntimeError:
+                # Event loop already closed
+                pass
+
+    def _release_window(self):
+        # Free one slot of the prefetch window
+        try:
+            self._loop.call_soon_threadsafe(self._window.release)
+        except RuntimeError:
+            # Event loop already closed
+            pass
+
+    async def _run(self):
+        self._loop = asyncio.get_running_loop()
+        self._task = asyncio.current_task()
+        self._window = asyncio.Semaphore(self.prefetch)
+        self._last_page_moved = asyncio.Event()
+        in_flight = asyncio.Semaphore(self.max_in_flight)
+        pending = set()
+        try:
+            async with http_client.async_session(headers=self.headers, limit_per_host=self.max_in_flight) as session:
+                page_number = self.first_page
+                while not self._stopped and not self._consumed:
+                    if page_number > self.last_page:
+                        # Every page requested: wait until the last page is moved down or every page is consumed
+                        self._last_page_moved.clear()
+                        if page_number > self.last_page and not self._consumed and not self._stopped:
+                            await self._last_page_moved.wait()
+                        continue
+                    await self._window.acquire()
+                    await in_flight.acquire()
+                    task = asyncio.create_task(self._fetch(session, page_number, in_flight))
+                    pending.add(task)
+                    task.add_done_callback(pending.discard)
+                    page_number += 1
+                if pending:
+                    await asyncio.gather(*pending)
+        except asyncio.CancelledError:
+            for task in pending:
+                task.cancel()
+        except Exception as error:
+            with self._condition:
+                self._error = error
+        finally:
+            with self._condition:
+                self._finished = True
+                self._condition.notify_all()
+
+    async def _fetch(self, session, page_number, in_flight):
+        page_url = self.page_url + '&currentpage=' + str(page_number)
+        status = None
+        text = None
+        served = None
+        try:
+            status, text, request_start, request_end = await http_client.async_get_timed(session, page_url)
+            served = (request_start, request_end)
+        finally:
+            in_flight.release()
+        if self.parse and text is not None:
+            # Parse stage: runs on the process pool while other pages are being fetched
+            try:
+                text = await self._loop.run_in_executor(self.executor, self.parse, text)
+            except Exception:
+                text = None
+        with self._condition:
+            self._results[page_number] = (status, text, served)
+            self._condition.notify_all()
@@ -0,0 +1,91 @@
+import numpy as np
+import pandas as pd
+
+# Vocation codes of the auction frame and the canonical (base) vocation of each one: promoted and unpromoted
+# characters of a vocation share a base vocation code
+vocation_codes = ['N', 'K', 'P', 'D', 'S', 'EK', 'RP', 'ED', 'MS']
+base_vocation_codes = ['K', 'P', 'D', 'S', 'N']
+base_vocations = {'N': 'N', 'K': 'K', 'EK': 'K', 'P': 'P', 'RP': 'P', 'D': 'D', 'ED': 'D', 'S': 'S', 'MS': 'S'}
+# Other low-cardinality text columns held as categoricals (categories: the values found)
+categorical_columns = ['Sex', 'Type', 'Status']
+# Integer columns and their compact dtype (a column with values out of range keeps int64, one with missing values
+# gets the nullable dtype)
+integer_dtypes = {'Id': 'int64', 'Level': 'int16', 'Bid': 'int32', 'Page': 'int32', 'Axe Fighting': 'int16',
+                  'Club Fighting': 'int16', 'Distance Fighting': 'int16', 'Fishing': 'int16', 'Fist Fighting': 'int16',
+                  'Magic Level': 'int16', 'Shielding': 'int16', 'Sword Fighting': 'int16', 'Experience': 'int64',
+                  'Gold': 'int64', 'Achievement Points': 'int32'}
+# World data file and the world attributes joined to every auction (world data column: auction frame column)
+worlds_filename = 'tibia_game_worlds.pkl'
+world_attributes = {'Location': 'WorldLocation', 'Type': 'WorldType', 'BattlEye': 'WorldBattlEye'}
+
+
+def compact_auctions(dataframe, worlds=None):
+    """Auction frame with compact dtypes, the canonical vocation code (BaseVocation) and the world attributes"""
+    # Vocation, World, Sex, Type, Status:  categoricals (World categories follow the world data rows, so
+    #                                      World.cat.codes index the world data)
+    # BaseVocation, World<attribute>:      categoricals derived from the codes above (no string is compared)
+    # Id, Level, skills, Bid, ...:         the integer dtypes of integer_dtypes
+    # The input dataframe is left unchanged; the scraper and the stores keep working on Id strings
+    if worlds is None:
+        worlds = pd.read_pickle(worlds_filename)
+    dataframe = dataframe.copy(deep=False)
+
+    if 'Vocation' in dataframe.columns:
+        vocation = categorical(dataframe['Vocation'], vocation_codes)
+        dataframe['Vocation'] = vocation
+        base_codes = np.array([base_vocation_codes.index(base_vocations[code]) if code in base_vocations else -1
+                               for code in vocation.cat.categories], dtype=np.int8)
+        dataframe['BaseVocation'] = derived_categorical(vocation, base_codes, base_vocation_codes)
+
+    if 'World' in dataframe.columns:
+        world = categorical(dataframe['World'], list(worlds['Name']))
+        dataframe['World'] = world
+        world_data = worlds.set_index('Name').reindex(world.cat.categories)
+        for attribute, column in world_attributes.items():
+            attribute_values = pd.Categorical(world_data[attribute])
+            dataframe[column] = derived_categorical(world, attribute_values.codes, attribute_values.categories)
+
+    for column in categorical_columns:
+        if column in dataframe.columns:
+            dataframe[column] = categorical(dataframe[column])
+
+    for column, dtype in integer_dtypes.items():
+        if column in dataframe.columns:
+            dataframe[column] = compact_integers(dataframe[column], dtype)
+    return dataframe
+
+
+def categorical(series, categories=()):
+    """Series as a categorical: the given categories first, then any other value found (sorted)"""
+    categories = list(categories)
+    known = set(categories)
+    extra = sorted({value for value in pd.unique(series) if pd.notna(value) and value not in known})
+    return pd.Series(pd.Categorical(series, categories=categories + extra), index=series.index, name=series.name)
+
+
+def derived_categorical(source, codes_by_category, categories):
+    """Categorical whose code is looked up from the code of a source categorical (codes_by_category[source code])"""
+    source_codes = source.cat.codes.to_numpy()
+    codes_by_category = np.asarray(codes_by_category)
+    codes = np.where(source_codes >= 0, codes_by_category[source_codes] if len(codes_by_category) else -1, -1)
+    return pd.Series(pd.Categorical.from_codes(codes, categories=categories), index=source.index)
+
+
+def compact_integers(series, dtype):
+    """Numeric series in the given integer dtype (int64 if values are out of its range, nullable if values are missing)"""
+    values = pd.to_numeric(series)
+    if len(values) and values.notna().any():
+        limits = np.iinfo(dtype)
+        if values.min() < limits.min or values.max() > limits.max:
+            dtype = 'int64'
+    if values.isna().any():
+        return values.astype(dtype.capitalize())
+    return values.astype(dtype)
+
+
+def vocation_filter(dataframe, vocation):
+    """Auctions of a vocation, promoted or not (vocation: any code of it, e.g. 'EK' or 'K')"""
+    base_vocation = base_vocations[vocation]
+    if 'BaseVocation' in dataframe.columns:
+        return dataframe[dataframe['BaseVocation'].eq(base_vocation)]
+    return dataframe[dataframe['Vocation'].isin([code for code, base in base_vocations.items() if base == base_vocation])]
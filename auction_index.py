@@ -0,0 +1,31 @@
+class AuctionIndex:
+    """Hash index mapping auction Id to its row position in an auction dataframe"""
+
+    def __init__(self, dataframe=None):
+        # positions: {'<auction_id>': <row_position:int>} (first occurrence of each Id)
+        # row_count: number of rows of the indexed dataframe
+        self.positions = {}
+        self.row_count = 0
+        if dataframe is not None:
+            self.extend(dataframe['Id'])
+
+    def extend(self, auction_ids):
+        """Register rows appended at the end of the indexed dataframe"""
+        auction_ids = list(auction_ids)
+        for position, auction_id in enumerate(auction_ids, start=self.row_count):
+            self.positions.setdefault(auction_id, position)
+        self.row_count += len(auction_ids)
+
+    def append(self, auction_id):
+        """Register a single row appended at the end of the indexed dataframe"""
+        self.extend([auction_id])
+
+    def get(self, auction_id):
+        """Row position of an auction (None if the auction is not registered)"""
+        return self.positions.get(auction_id)
+
+    def __contains__(self, auction_id):
+        return auction_id in self.positions
+
+    def __len__(self):
+        return len(self.positions)
@@ -0,0 +1,201 @@
+import os
+import json
+import datetime
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from bestiary_matrix import BestiaryMatrix
+from file_storage import atomic_write
+
+# Default store directory and legacy monolithic pickle (migrated into the store on first use)
+store_dirname = 'auction_store'
+legacy_filename = 'last_full_scrape.pkl'
+manifest_filename = 'manifest.json'
+
+# Auction dataframe columns: Name               [str]
+#                            Level              [int]
+#                            Vocation           [str]       'E', 'EK', 'P', 'RP', 'D', 'ED', 'S', 'MS', 'N'
+#                            World              [str]
+#                            Sex                [str]       'M': male | 'F': female
+#                            Bid                [int]
+#                            Type               [str]       'W': auction was won | 'M': auction without bids
+#                            Start              [datetime]  year, month, day, hour, minute
+#                            End                [datetime]  year, month, day, hour, minute
+#                            Status             [str]       website text: 'finished', 'currently processed', 'cancelled', 'will be transferred...'
+#                            Id                 [str]       auction identification (unique)
+#                            Link               [str]       url to specific auction
+#                            Page               [int]       'auction history' page number at which the auction was found
+#                            Axe Fighting       [int]
+#                            Club Fighting      [int]
+#                            Distance Fighting  [int]
+#                            Fishing            [int]
+#                            Fist Fighting      [int]
+#                            Magic Level        [int]
+#                            Shielding          [int]
+#                            Sword Fighting     [int]
+#                            Creation Date      [datetime]  year, month, day, hour, minute
+#                            Experience         [int]
+#                            Gold               [int]
+#                            Achievement Points [int]
+#                            Bestiary           [dict]      {'<creature_name_1:str>':<number_of_kills:int>, '<creature_name_2:str>':<number_of_kills:int> ...}
+dataframe_columns = ['Name', 'Level', 'Vocation', 'World', 'Sex', 'Bid', 'Type', 'Start', 'End', 'Status', 'Id',
+                     'Link', 'Page', 'Axe Fighting', 'Club Fighting', 'Distance Fighting', 'Fishing',
+                     'Fist Fighting', 'Magic Level', 'Shielding', 'Sword Fighting', 'Creation Date',
+                     'Experience', 'Gold', 'Achievement Points', 'Bestiary']
+
+
+class AuctionStore:
+    """Append-only auction store: Parquet files partitioned by auction End date, Status patches, bestiary matrices"""
+
+    def __init__(self, path=store_dirname):
+        # Layout:  <path>/manifest.json
+        #          <path>/end=<YYYY-MM-DD>/part-<n>.parquet   auctions, partitioned by End date
+        #          <path>/status/patch-<n>.parquet             Status updates (Id, Status), applied in order
+        #          <path>/bestiary/part-<n>.npz                sparse auction x creature kill matrix of each append
+        self.path = path
+        self.manifest = self.read_manifest()
+
+    def exists(self):
+        """Check whether the store has been initialized"""
+        return os.path.isfile(os.path.join(self.path, manifest_filename))
+
+    def read_manifest(self):
+        manifest_path = os.path.join(self.path, manifest_filename)
+        if os.path.isfile(manifest_path):
+            with open(manifest_path, 'r') as manifest_file:
+                return json.load(manifest_file)
+        return {'partitions': {}, 'patches': [], 'bestiary': [], 'rows': 0, 'next_part': 0}
+
+    def write_manifest(self):
+        os.makedirs(self.path, exist_ok=True)
+        with atomic_write(os.path.join(self.path, manifest_filename)) as manifest_file:
+            json.dump(self.manifest, manifest_file, indent=1, sort_keys=True)
+
+    def partition_dates(self, start=None, end=None):
+        """Stored partition dates (YYYY-MM-DD), optionally limited to an End date range (inclusive)"""
+        start = partition_key(start) if start is not None else None
+        end = partition_key(end) if end is not None else None
+        return [date for date in sorted(self.manifest['partitions'])
+                if (start is None or date >= start) and (end is None or date <= end)]
+
+    def append(self, dataframe):
+        """Write new auctions as new files in their End date partitions (bestiary data in a separate sparse matrix)"""
+        if dataframe.empty:
+            return
+        part_name = f"part-{self.manifest['next_part']:06d}"
+        if 'Bestiary' in dataframe.columns:
+            bestiary = BestiaryMatrix.from_dicts(dataframe['Id'], dataframe['Bestiary'])
+            os.makedirs(os.path.join(self.path, 'bestiary'), exist_ok=True)
+            bestiary.save(os.path.join(self.path, 'bestiary', part_name + '.npz'))
+            self.manifest.setdefault('bestiary', []).append(part_name + '.npz')
+            dataframe = dataframe.drop('Bestiary', axis=1)
+        end_dates = dataframe['End'].apply(partition_key)
+        for date, partition_df in dataframe.groupby(end_dates, sort=True):
+            partition_dir = os.path.join(self.path, 'end=' + date)
+            os.makedirs(partition_dir, exist_ok=True)
+            partition_table = pa.Table.from_pandas(partition_df, preserve_index=False)
+            pq.write_table(partition_table, os.path.join(partition_dir, part_name + '.parquet'))
+            self.manifest['partitions'].setdefault(date, []).append(part_name + '.parquet')
+        self.manifest['rows'] += len(dataframe)
+        self.manifest['next_part'] += 1
+        self.write_manifest()
+
+    def patch_status(self, status_df):
+        """Record Status updates of stored auctions (dataframe with 'Id' and 'Status' columns)"""
+        if status_df.empty:
+            return
+        patch_name = f"patch-{len(self.manifest['patches']):06d}.parquet"
+        os.makedirs(os.path.join(self.path, 'status'), exist_ok=True)
+        patch_table = pa.Table.from_pandas(status_df[['Id', 'Status']].astype(str), preserve_index=False)
+        pq.write_table(patch_table, os.path.join(self.path, 'status', patch_name))
+        self.manifest['patches'].append(patch_name)
+        self.write_manifest()
+
+    def status_patches(self):
+        """Latest patched Status of every updated auction: {'<auction_id>': '<status>'}"""
+        patched_status = {}
+        for patch_name in self.manifest['patches']:
+            patch_df = pq.read_table(os.path.join(self.path, 'status', patch_name)).to_pandas()
+            patched_status.update(zip(patch_df['Id'], patch_df['Status']))
+        return patched_status
+
+    def load_bestiary(self, auction_ids=None):
+        """Bestiary matrix of every stored auction (or of the given auctions only)"""
+        bestiary = BestiaryMatrix.concat([BestiaryMatrix.load(os.path.join(self.path, 'bestiary', part_name))
+                                          for part_name in self.manifest.get('bestiary', [])])
+        return bestiary.select(auction_ids) if auction_ids is not None else bestiary
+
+    def load(self, start=None, end=None, columns=None):
+        """Load stored auctions, optionally limited to an End date range (inclusive) and to a list of columns"""
+        # Bestiary is only loaded when explicitly requested (rebuilt as dictionaries from the bestiary matrix)
+        with_bestiary = columns is not None and 'Bestiary' in columns
+        read_columns = None
+        if columns is not None:
+            read_columns = [column for column in columns if column != 'Bestiary']
+            if ('Status' in read_columns or with_bestiary) and 'Id' not in read_columns:
+                read_columns.append('Id')
+
+        partition_dfs = []
+        for date in self.partition_dates(start, end):
+            for part_name in self.manifest['partitions'][date]:
+                part_path = os.path.join(self.path, 'end=' + date, part_name)
+                partition_dfs.append(pq.read_table(part_path, columns=read_columns).to_pandas())
+        if not partition_dfs:
+            return pd.DataFrame(columns=columns)
+        dataframe = pd.concat(partition_dfs, ignore_index=True)
+
+        # Apply Status updates
+        if 'Status' in dataframe.columns and self.manifest['patches']:
+            patched_status = self.status_patches()
+            dataframe['Status'] = [patched_status.get(auction_id, status)
+                                   for auction_id, status in zip(dataframe['Id'], dataframe['Status'])]
+
+        if with_bestiary:
+            bestiary = self.load_bestiary(dataframe['Id'])
+            bestiary_dicts = dict(zip(bestiary.auction_ids, bestiary.to_dicts()))
+            dataframe['Bestiary'] = [bestiary_dicts.get(auction_id, {}) for auction_id in dataframe['Id']]
+
+        if columns is not None:
+            dataframe = dataframe[list(columns)]
+        return dataframe
+
+
+def partition_key(date):
+    """Partition name (YYYY-MM-DD) of a datetime, date or string"""
+    if isinstance(date, str):
+        return date[:10]
+    if isinstance(date, datetime.datetime):
+        date = date.date()
+    return date.isoformat()
+
+
+def legacy_path(path=store_dirname):
+    """Legacy monolithic pickle of a store (kept in the directory holding the store directory)"""
+    return os.path.join(os.path.dirname(os.path.abspath(path)), legacy_filename)
+
+
+def load_bestiary(auction_ids=None, path=store_dirname):
+    """Load the bestiary matrix from the store (falls back to the Bestiary column of the legacy pickle)"""
+    store = AuctionStore(path)
+    if store.exists():
+        return store.load_bestiary(auction_ids)
+
+    dataframe = pd.read_pickle(legacy_path(path))
+    bestiary = BestiaryMatrix.from_dicts(dataframe['Id'], dataframe['Bestiary'])
+    return bestiary.select(auction_ids) if auction_ids is not None else bestiary
+
+
+def load_auctions(start=None, end=None, columns=None, path=store_dirname):
+    """Load auctions from the store (falls back to the legacy monolithic pickle if the store does not exist yet)"""
+    store = AuctionStore(path)
+    if store.exists():
+        return store.load(start=start, end=end, columns=columns)
+
+    dataframe = pd.read_pickle(legacy_path(path))
+    if start is not None:
+        dataframe = dataframe[dataframe['End'].apply(partition_key) >= partition_key(start)]
+    if end is not None:
+        dataframe = dataframe[dataframe['End'].apply(partition_key) <= partition_key(end)]
+    if columns is not None:
+        dataframe = dataframe[list(columns)]
+    return dataframe.reset_index(drop=True)
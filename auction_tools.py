@@ -1,11 +1,17 @@
 from bazaar_scraper import *
+from requests_html import HTML
+import http_client
 
 def update_auction_status (auction_id, wait=0):
 
     char_url = root_url + '&page=details&auctionid=' + auction_id
     print(f'Parsing auction #{auction_id} ', end='', flush=True)
 
-    req = requests.get(char_url, headers=request_headers)
+    try:
+        req = http_client.get(char_url, headers=request_headers)
+    except requests.RequestException:
+        print(f'FAILED! Connection error.', end='\n', flush=True)
+        return None
     if req.status_code == 200:
 
         print(f'successful request: collecting data... ', end='', flush=True)
@@ -0,0 +1,208 @@
+import os
+import math
+import json
+import sqlite3
+import argparse
+import datetime
+import contextlib
+import numpy as np
+import pandas as pd
+from file_storage import busy_timeout
+
+# Default database file
+database_filename = 'bazaar.sqlite'
+# Values bound per lookup statement (SQLite limit: 999 parameters)
+lookup_chunk = 900
+
+# Tables: columns (the key column 'Id' first), datetime columns (stored as ISO text, sortable), JSON columns,
+# boolean columns (True or None) and indexed columns
+tables = {'auctions': dict(columns=['Id', 'Name', 'Level', 'Vocation', 'World', 'Sex', 'Bid', 'Type', 'Start', 'End',
+                                    'Status', 'Link', 'Page', 'Axe Fighting', 'Club Fighting', 'Distance Fighting',
+                                    'Fishing', 'Fist Fighting', 'Magic Level', 'Shielding', 'Sword Fighting',
+                                    'Creation Date', 'Experience', 'Gold', 'Achievement Points', 'Bestiary'],
+                           dates=['Start', 'End', 'Creation Date'], json=['Bestiary'], booleans=[],
+                           indexes=['End', 'World', 'Vocation']),
+          'status': dict(columns=['Id', 'Name', 'End', 'Day0', 'Day1', 'Day2', 'Day3', 'Day4', 'Day5', 'Day6', 'Day7',
+                                  'Final'],
+                         dates=['End'], json=[], booleans=[], indexes=['End', 'Final']),
+          'followup': dict(columns=['Id', 'Name', 'World', 'Sex', 'Vocation', 'Level', 'AccessDate', 'NewName',
+                                    'NewWorld', 'NewSex', 'NewVocation', 'NewLevel', 'LastLogin', 'AccountStatus',
+                                    'NewId', 'Scheduled', 'Deleted'],
+                           dates=['AccessDate', 'LastLogin', 'Scheduled'], json=[], booleans=['Deleted'],
+                           indexes=['Name', 'NewName'])}
+
+
+class BazaarDatabase:
+    """Embedded SQLite database holding the auctions, the auction status record and the character follow-up"""
+
+    def __init__(self, path=database_filename):
+        # One table per dataset, keyed by auction Id, with indexes on the columns used for lookups and joins.
+        # Writes are upserts, each call in a single transaction (or in an enclosing transaction())
+        self.path = path
+        self.connection = sqlite3.connect(path, timeout=busy_timeout, isolation_level=None)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.transaction_depth = 0
+        with self.transaction():
+            for table, spec in tables.items():
+                column_definitions = ', '.join(quote(column) + (' TEXT PRIMARY KEY' if column == 'Id' else '')
+                                               for column in spec['columns'])
+                self.connection.execute(f'CREATE TABLE IF NOT EXISTS {table} ({column_definitions})')
+                for column in spec['indexes']:
+                    self.connection.execute(f'CREATE INDEX IF NOT EXISTS {table}_{column.replace(" ", "_")} '
+                                            f'ON {table} ({quote(column)})')
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """Write transaction (nested calls join the outermost one)"""
+        if self.transaction_depth:
+            self.transaction_depth += 1
+            try:
+                yield self.connection
+            finally:
+                self.transaction_depth -= 1
+            return
+        self.connection.execute('BEGIN IMMEDIATE')
+        self.transaction_depth = 1
+        try:
+            yield self.connection
+        except BaseException:
+            self.connection.execute('ROLLBACK')
+            raise
+        finally:
+            self.transaction_depth = 0
+        self.connection.execute('COMMIT')
+
+    def count(self, table):
+        return self.connection.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+
+    def upsert(self, table, dataframe, keep_existing=False):
+        """Insert new rows and update stored ones (keep_existing: missing values never overwrite stored values)"""
+        columns = [column for column in tables[table]['columns'] if column in dataframe.columns]
+        if dataframe.empty:
+            return 0
+        updated_columns = [quote(column) for column in columns if column != 'Id']
+        if keep_existing:
+            assignments = ', '.join(f'{column} = COALESCE(excluded.{column}, {table}.{column})' for column in updated_columns)
+        else:
+            assignments = ', '.join(f'{column} = excluded.{column}' for column in updated_columns)
+        statement = (f'INSERT INTO {table} ({", ".join(quote(column) for column in columns)}) '
+                     f'VALUES ({", ".join("?" * len(columns))}) ON CONFLICT (Id) DO '
+                     + (f'UPDATE SET {assignments}' if assignments else 'NOTHING'))
+        rows = sql_rows(dataframe[columns])
+        with self.transaction():
+            self.connection.executemany(statement, rows)
+        return len(rows)
+
+    def update(self, table, dataframe):
+        """Update the given columns of stored rows (rows whose Id is not stored are ignored)"""
+        columns = [column for column in tables[table]['columns'] if column in dataframe.columns and column != 'Id']
+        if dataframe.empty or not columns:
+            return
+        statement = f'UPDATE {table} SET {", ".join(quote(column) + " = ?" for column in columns)} WHERE Id = ?'
+        with self.transaction():
+            self.connection.executemany(statement, sql_rows(dataframe[columns + ['Id']]))
+
+    def load(self, table, columns=None, where=None, parameters=()):
+        """Rows of a table (optionally a list of columns and an SQL condition on indexed columns) as a dataframe"""
+        columns = list(columns) if columns is not None else tables[table]['columns']
+        query = f'SELECT {", ".join(quote(column) for column in columns)} FROM {table}'
+        if where:
+            query += ' WHERE ' + where
+        dataframe = pd.read_sql_query(query, self.connection, params=[sql_value(value) for value in parameters])
+        return from_sql(table, dataframe)
+
+    def lookup(self, table, column, values, columns=None):
+        """Rows whose column (an indexed one) matches any of the values"""
+        values = list(dict.fromkeys(values))
+        dataframes = [self.load(table, columns, where=f'{quote(column)} IN ({", ".join("?" * len(chunk))})',
+                                parameters=chunk)
+                      for chunk in (values[start:start + lookup_chunk] for start in range(0, len(values), lookup_chunk))]
+        if not dataframes:
+            return self.load(table, columns, where='0')
+        return pd.concat(dataframes, ignore_index=True)
+
+    def close(self):
+        self.connection.close()
+
+
+def quote(column):
+    return '"' + column + '"'
+
+
+def sql_value(value):
+    """Python/numpy/pandas value as an SQLite value (datetimes as ISO text, dictionaries as JSON)"""
+    if value is None or value is pd.NaT:
+        return None
+    if isinstance(value, np.generic):
+        value = pd.Timestamp(value) if isinstance(value, np.datetime64) else value.item()
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    if isinstance(value, bool):
+        return int(value)
+    if isinstance(value, datetime.datetime):
+        return value.isoformat(sep=' ')
+    if isinstance(value, datetime.date):
+        return value.isoformat()
+    if isinstance(value, (dict, list)):
+        return json.dumps(value)
+    return value
+
+
+def sql_rows(dataframe):
+    return [tuple(sql_value(value) for value in row) for row in dataframe.astype(object).itertuples(index=False, name=None)]
+
+
+def from_sql(table, dataframe):
+    """Convert the columns read from a table back to their dataframe types"""
+    spec = tables[table]
+    for column in dataframe.columns:
+        if column in spec['dates']:
+            dates = pd.to_datetime(dataframe[column], format='ISO8601')
+            # Missing dates are None (as in the pickled dataframes) unless every date is present
+            dataframe[column] = dates if dates.notna().all() else dates.astype(object).where(dates.notna(), None)
+        elif column in spec['json']:
+            dataframe[column] = pd.Series([json.loads(text) if isinstance(text, str) else {} for text in dataframe[column]],
+                                          index=dataframe.index, dtype=object)
+        elif column in spec['booleans']:
+            dataframe[column] = pd.Series([True if pd.notna(value) and value else None for value in dataframe[column]],
+                                          index=dataframe.index, dtype=object)
+    return dataframe
+
+
+def add_database_arguments(parser):
+    """Add the --database command line option to an argparse parser"""
+    parser.add_argument('--database', nargs='?', const=database_filename, default=None, metavar='DATABASE_FILE',
+                        help='read and write auctions, status record and follow-up through an embedded SQLite database')
+
+
+def import_datasets(database, store_path, status_filename, followup_filename):
+    """Copy the auction store (or legacy pickle), the status record and the follow-up pickles into the database"""
+    from auction_store import load_auctions, legacy_path
+
+    with database.transaction():
+        if os.path.isdir(store_path) or os.path.isfile(legacy_path(store_path)):
+            auctions = load_auctions(columns=tables['auctions']['columns'], path=store_path)
+            print(f"\tauctions: {database.upsert('auctions', auctions.drop_duplicates(subset='Id', keep='last')):,} rows")
+        if os.path.isfile(status_filename):
+            status_dataframe = pd.read_pickle(status_filename)
+            print(f"\tstatus:   {database.upsert('status', status_dataframe.drop_duplicates(subset='Id', keep='last')):,} rows")
+        if os.path.isfile(followup_filename):
+            followup_dataframe = pd.read_pickle(followup_filename)
+            print(f"\tfollowup: {database.upsert('followup', followup_dataframe.drop_duplicates(subset='Id', keep='last')):,} rows")
+
+
+if __name__ == "__main__":
+
+    # Command line options
+    parser = argparse.ArgumentParser(description='Import the pickled datasets into the embedded database')
+    parser.add_argument('--database', default=database_filename, help='database file')
+    parser.add_argument('--store', default='auction_store', help='auction store directory')
+    parser.add_argument('--status-record', default='auction_status_record.pkl', help='auction status record pickle')
+    parser.add_argument('--followup', default='character_followup.pkl', help='character follow-up pickle')
+    args = parser.parse_args()
+
+    bazaar_database = BazaarDatabase(args.database)
+    print(f"\nImporting datasets into {args.database}:")
+    import_datasets(bazaar_database, args.store, args.status_record, args.followup)
+    bazaar_database.close()
+    print("\nDone!")
@@ -2,17 +2,21 @@ import os
 import pandas as pd
 import datetime
 import requests
-from requests_html import HTML
 import math
-import concurrent.futures
-from bazaar_scraper import str_to_datetime
+from auction_store import load_auctions, dataframe_columns
+from bazaar_database import BazaarDatabase, add_database_arguments
 import time
 import timeit
 import logging
+import argparse
+import http_client
+from fetch_pipeline import FetchParsePipeline, close_parse_pool
+from character_parser import parse_character_page, parse_tibiaring_alias, convert_character_dates
+from html_archive import add_archive_arguments
+from run_metrics import metrics, progress, add_metrics_arguments
 
 home_dir = 'D:\\Programming\\Python\\TibiaAuctions'
 
-scraped_auctions_filename = 'last_full_scrape.pkl'
 scraped_info_filename = 'scraped_followup.pkl'
 followup_filename = 'character_followup.pkl'
 logging_file = 'followup_log.txt'
@@ -20,11 +24,16 @@ logging_file = 'followup_log.txt'
 name_range = 50000
 recent_check_threshold = 10
 batch_size = 100
-batch_wait = 3
+# Simultaneous character page requests (request starts are paced by the shared rate limiter)
+character_fetchers = 16
 
-info_scraping_time_estimate = 0.2  # estimated time to scrape a single character when running threading, in seconds
+info_scraping_time_estimate = 0.2  # estimated time to scrape a single character through the fetch/parse pipeline, in seconds
 incorp_time_estimate = 0.04  # estimated time to incorporate an auction to follow-up dataframe, in seconds
 
+# Character pages on Tibia.com
+character_url_root = http_client.tibia_url + '/community/?subtopic=characters&name='
+character_headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/70.0.3538.77 Safari/537.36'}
+
 followup_columns = ('Id', 'Name', 'World', 'Sex', 'Vocation', 'Level', 'AccessDate', 'NewName', 'NewWorld', 'NewSex',
                     'NewVocation', 'NewLevel', 'LastLogin', 'AccountStatus', 'NewId', 'Scheduled', 'Deleted')
 today = datetime.datetime.now()
@@ -96,7 +105,7 @@ def findex(list, value):
 
 def get_tibiaring_alias(url_name):
     # Standard TibiaRing url and headers
-    tibiaring_root = 'http://www.tibiaring.com/char.php?c='
+    tibiaring_root = http_client.tibiaring_url + '/char.php?c='
     tibiaring_headers = {"Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8",
                          "Accept-Language": "pt-BR,pt;q=0.8,en-US;q=0.5,en;q=0.3",
                          "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:81.0) Gecko/20100101 Firefox/81.0"}
@@ -105,90 +114,102 @@ def get_tibiaring_alias(url_name):
     char_url = tibiaring_root + url_name
 
     # Access TibiaRing page for character
-    req = requests.get(char_url, headers=tibiaring_headers)
+    try:
+        req = http_client.get(char_url, headers=tibiaring_headers)
+    except requests.RequestException:
+        return None
 
     # Failed request
     if req.status_code != 200:
         return None
 
-    # Empty page
-    text = req.text
-    if len(text) == 0:
-        return -1
+    # Successful access: return new character name (-1 for an empty page)
+    return parse_tibiaring_alias(req.text)
+
 
-    # Successful access: return new character name
-    html = HTML(html=text)
-    character_box = html.find(".CSC")[0]
-    new_name = character_box.text
-    return new_name
+def character_url_name(char_name):
+    return char_name.replace(' ', '+').replace('ö', '%F6')
 
 
-def get_character_info(char_name, headers=None):
-    url_root = 'https://www.tibia.com/community/?subtopic=characters&name='
-    default_headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/70.0.3538.77 Safari/537.36'}
+def get_character_info(char_name, headers=None, fetched_page=None):
+    url_root = character_url_root
 
-    url_name = char_name.replace(' ', '+').replace('ö', '%F6')
+    url_name = character_url_name(char_name)
     char_url = url_root + url_name
     if not headers:
-        headers = default_headers
+        headers = character_headers
+
+    if fetched_page is not None:
+        # Character page already fetched and parsed by the pipeline: (status_code, info)
+        status_code, info = fetched_page
+        if status_code is None:
+            show_check(char_name, 'connection error')
+            return 0
+        if status_code != 200:
+            show_check(char_name, f'error {status_code}')
+            return status_code
 
-    # First access to character page on Tibia.com
-    req = requests.get(char_url, headers=headers)
-    if req.status_code != 200:
-        print(f'Checking: {char_name:<25} --- Tibia.com ERROR {req.status_code}: {req.reason}.')
-        return req.status_code
-    tx = req.text
-    html = HTML(html=tx)
+    else:
+        # First access to character page on Tibia.com
+        try:
+            req = http_client.get(char_url, headers=headers)
+        except requests.RequestException:
+            show_check(char_name, 'connection error')
+            return 0
+        if req.status_code != 200:
+            show_check(char_name, f'error {req.status_code}')
+            return req.status_code
+        info = parse_character_page(req.text)
 
     # Check if character name is valid
-    character_information_table = html.find('table')[0].text
-    if character_information_table.find('Character Information') < 0:
+    if info is None:
         new_name = get_tibiaring_alias(url_name)
         if not new_name:
-            print(f'Checking: {char_name:<25} --- checking TibiaRing for alias... not found.')
+            show_check(char_name, 'not found')
             return None
         elif new_name == -1:
-            print(f'Checking: {char_name:<25} --- checking TibiaRing for alias... DELETED.')
+            show_check(char_name, 'deleted')
             return 'DELETED'
-        new_char_url = url_root + new_name.replace(' ', '+').replace('ö', '%F6')
-        req = requests.get(new_char_url, headers=headers)
+        new_char_url = url_root + character_url_name(new_name)
+        try:
+            req = http_client.get(new_char_url, headers=headers)
+        except requests.RequestException:
+            show_check(char_name, 'connection error')
+            return 0
         if req.status_code != 200:
-            print(f'Checking: {char_name:<25} --- checking TibiaRing for alias... Tibia.com ERROR {req.status_code}: {req.reason}.')
+            show_check(char_name, f'error {req.status_code}')
             return req.status_code
-        tx = req.text
-        html = HTML(html=tx)
-        character_information_table = html.find('table')[0].text
-        if character_information_table.find('Character Information') < 0:
-            print(f'Checking: {char_name:<25} --- DELETED. ')
+        info = parse_character_page(req.text)
+        if info is None:
+            show_check(char_name, 'deleted')
             return 'DELETED'
-    info = character_information_table.replace('\xa0', ' ').split('\n')
-
-    # Collect character info
-    name = info[info.index('Name:') + 1].split(' (traded)')[0]
-
-    # Check if character is scheduled to be deleted
-    if name.find(', will be deleted') >= 0:
-        name_del = name
-        name = name_del.split(',')[0]
-        del_date = str_to_datetime(name_del.split('at ')[-1])
+        show_check(char_name, 'renamed')
     else:
-        del_date = None
-
-    # Process collected information
-    sex = info[info.index('Sex:') + 1][0].upper()
-    world = info[info.index('World:') + 1]
-    vocation = ''.join(list(map(lambda s: s[0], info[info.index('Vocation:') + 1].split())))
-    level = int(info[info.index('Level:') + 1])
-    last_login = info[info.index('Last Login:') + 1]
-    if last_login.find('never') >= 0:
-        login = None
-    else:
-        login = str_to_datetime(last_login)
-    status = ''.join(list(map(lambda s: s[0], info[info.index('Account Status:') + 1].split())))
+        show_check(char_name, 'succeeded')
 
     access = datetime.datetime.now()
-    print(f'Checking: {char_name:<25} --- succeeded!')
-    return [name, world, sex, vocation, level, login, status, del_date, access]
+    convert_character_dates([info])
+    return info + [access]
+
+
+def show_check(char_name, result):
+    """Count a character check by result and redraw the status line (at most once per second)"""
+    metrics.inc('characters_checked_total', result=result)
+    if progress.due():
+        progress.update(f"{datetime.datetime.now():%H:%M:%S} [Checked: {metrics.total('characters_checked_total'):>7,} | "
+                        f"Not found: {metrics.total('characters_checked_total', result='not found'):>5,} | "
+                        f"Deleted: {metrics.total('characters_checked_total', result='deleted'):>5,}] "
+                        f"{char_name:<25} ({http_client.limiter.rate(character_url_root):.1f} requests/s)")
+
+
+def collect_character_info(char_names, character_pipeline):
+    """Character info of a batch of names, through the fetch/parse pipeline (same outputs as get_character_info)"""
+    char_urls = [character_url_root + character_url_name(char_name) for char_name in char_names]
+    fetched_pages = [(status_code, info) for _, status_code, info in character_pipeline.map(char_urls)]
+    # Login and deletion dates of the whole batch, converted in a single pass
+    convert_character_dates([info for _, info in fetched_pages])
+    return [get_character_info(char_name, fetched_page=fetched_page)
+            for char_name, fetched_page in zip(char_names, fetched_pages)]
 
 
 def incorporate_auction(auction, followup_df):
@@ -201,12 +222,14 @@ def incorporate_auction(auction, followup_df):
     auction_vocation = auction.Vocation
     auction_level = auction.Level
 
-    print(f'Parsing character {auction_name} (#{auction_id}): ', end='', flush=True)
+    if progress.due():
+        progress.update(f'Incorporating auction #{auction_id}: {auction_name:<25} '
+                        f"({metrics.total('auctions_incorporated_total'):,} done)")
 
     # Check if auction has already been registered
     id_match = findex(list(followup_df.Id), auction_id)
     if isinstance(id_match, int):
-        print('\n\t\t\t\tFound matching ID. Returning unmodified follow-up dataframe.')
+        metrics.inc('auctions_incorporated_total', result='registered')
         return followup_df
 
     else:
@@ -216,20 +239,20 @@ def incorporate_auction(auction, followup_df):
             name_match = findex(list(followup_df.NewName), auction_name)
 
         if isinstance(name_match, int):
-            print('\n\t\t\t\tFound matching name! ', end='', flush=True)
-            corresponding_id = followup_df.iloc[name_match].Id
             # Case: auctioned character's name matches registered name
-            if skip_reason:=skip_check(name_match, followup_df):
-                print(f'\n\t\t\t\tSpurious name coincidence (#{corresponding_id}): matches permanently closed entry ({skip_reason}).', end='\n', flush=True)
+            if skip_check(name_match, followup_df):
+                # Spurious name coincidence: matches permanently closed entry
+                metrics.inc('auctions_incorporated_total', result='name coincidence')
             else:
-                print(f'\n\t\t\t\tUpdating entry #{corresponding_id}: closing permanently as "resold".', end='', flush=True)
+                # Registered entry closed permanently as "resold"
+                metrics.inc('auctions_incorporated_total', result='resold')
                 followup_df = update_row(followup_df, name_match, NewId=auction_id, NewName=auction_name, NewWorld=auction_world,
                                          NewSex=auction_sex, NewVocation=auction_vocation, NewLevel=auction_level)
 
-        print('\n\t\t\t\tAppending new row... ', end='', flush=True)
-        output_followup = followup_df.append({'Id': auction_id, 'Name': auction_name, 'World': auction_world, 'Sex': auction_sex,
-                                              'Vocation': auction_vocation, 'Level': auction_level}, ignore_index=True)
-        print('done!', end='\n', flush=True)
+        metrics.inc('auctions_incorporated_total', result='new')
+        new_entry = pd.DataFrame([{'Id': auction_id, 'Name': auction_name, 'World': auction_world, 'Sex': auction_sex,
+                                   'Vocation': auction_vocation, 'Level': auction_level}])
+        output_followup = pd.concat([followup_df, new_entry], ignore_index=True)
 
     return output_followup
 
@@ -243,20 +266,20 @@ def update_followup(followup_df, scraped_char_dict):
     for character_name in scraped_char_dict.keys():
 
         character_data = scraped_char_dict[character_name]
-        print(f'Updating character {character_name}: ', end='', flush=True)
+        if progress.due():
+            progress.update(f'Updating character {character_name:<25} '
+                            f"({metrics.total('followup_updates_total'):,} done)")
 
         # Check if character info was successfully collected
         if isinstance(character_data, list):
-            print(f'\n\tInfo successfully collected!', end='', flush=True)
             scraped_data = character_data + [None]
         elif isinstance(character_data, int):
-            print(f'\n\tRequest failed --- error code: {character_data}.')
+            # Request failed
             scraped_data = None
         elif character_data is None:
-            print(f'\n\tCharacter not found --- presumed deleted.', end='', flush=True)
+            # Character not found: presumed deleted
             scraped_data = 8*[None] + [datetime.datetime.now(), True]
         elif character_data == 'DELETED':
-            print(f'\n\tCharacter deleted.', end='', flush=True)
             scraped_data = 8*[None] + [datetime.datetime.now(), True]
         else:
             print(f'\n\t*** UNEXPECTED DATA*** : {character_data}')
@@ -264,9 +287,9 @@ def update_followup(followup_df, scraped_char_dict):
 
         # Update follow-up dataframe with collected character info
         if not scraped_data:
+            metrics.inc('followup_updates_total', result='failed')
             failed_requests.append(character_name)
         else:
-            print('\n\tUpdating character info... ', end='', flush=True)
             char, world, sex, vocation, level, login, status, deletion, access, deleted = scraped_data
 
             # Look for name match: first in column 'Name' (last match) then in column 'NewName' (first match)
@@ -278,12 +301,12 @@ def update_followup(followup_df, scraped_char_dict):
                 match_type = 'NewName' if isinstance(name_match, int) else None
 
             if match_type:
-                print(f'found matching "{match_type}": updating... ', end='', flush=True)
+                metrics.inc('followup_updates_total', result=match_type)
                 followup_df = update_row(followup_df, name_match, NewName=char, NewWorld=world, NewSex=sex,
                                          NewVocation=vocation, NewLevel=level, LastLogin=login, AccountStatus=status,
                                          AccessDate=access, Scheduled=deletion, Deleted=deleted)
-                print('done!')
             else:
+                metrics.inc('followup_updates_total', result='unmatched')
                 print(f'\n\t\t\t\tUnexpected error: character name not found in follow-up dataframe.')
 
     return followup_df, failed_requests
@@ -309,6 +332,14 @@ def names_to_check(followup_df, new_auctions_df):
     return all_names - excluded_names | set(new_names)
 
 
+def save_followup(followup_df, database=None):
+    """Write the follow-up dataframe to its pickle (upserted into the database with --database)"""
+    if database is not None:
+        database.upsert('followup', followup_df)
+    else:
+        followup_df.to_pickle(followup_filename)
+
+
 def filter_new_auctions(followup_df, auctions_df):
     if followup_df.empty:
         return auctions_df
@@ -321,22 +352,41 @@ if __name__ == "__main__":
 
     followup_start = timeit.default_timer()
 
+    # Command line options
+    parser = argparse.ArgumentParser(description='Tibia character follow-up')
+    add_archive_arguments(parser)
+    add_metrics_arguments(parser)
+    add_database_arguments(parser)
+    args = parser.parse_args()
+    metrics.export_path = args.metrics
+
     # initialize logging
     logging.basicConfig(filename=logging_file, level=logging.INFO, filemode='a')
 
     # Import scraped auctions and sort them by end date
     print('\nLoading scraped auctions...', end='', flush=True)
     os.chdir(home_dir)
-    adf = pd.read_pickle(scraped_auctions_filename)
-    nb = adf.drop('Bestiary', axis=1)
-    won_auctions = nb[nb.Type.eq("W")]
-    sa = won_auctions[won_auctions.Status.eq('finished')]
+    if args.from_archive or args.archive:
+        http_client.use_archive(args.from_archive or args.archive, from_archive=args.from_archive is not None)
+    database = BazaarDatabase(args.database) if args.database else None
+    if database is not None:
+        # Only the finished auctions without a follow-up entry (primary key lookups)
+        sa = database.load('auctions', columns=[column for column in dataframe_columns if column != 'Bestiary'],
+                           where="Type = 'W' AND Status = 'finished' AND Id NOT IN (SELECT Id FROM followup)")
+    else:
+        nb = load_auctions(columns=[column for column in dataframe_columns if column != 'Bestiary'])
+        won_auctions = nb[nb.Type.eq("W")]
+        sa = won_auctions[won_auctions.Status.eq('finished')]
     sbe = sa.sort_values(by='End').reset_index(drop=True)
     print(f' done: {len(sbe):,} auctions loaded!', end='\n', flush=True)
 
     # Load tracked characters
     print('\nLoading recorded follow-up...', end='', flush=True)
-    if os.path.isfile(followup_filename):
+    if database is not None:
+        character_followup = database.load('followup')
+        print(f' done: {len(character_followup):,} entries loaded!', end='\n', flush=True)
+
+    elif os.path.isfile(followup_filename):
         character_followup = pd.read_pickle(followup_filename)
         print(f' done: {len(character_followup):,} entries loaded!', end='\n', flush=True)
 
@@ -359,7 +409,7 @@ if __name__ == "__main__":
     last_index = min(first_index + batch_size, character_count)
     run_count = math.ceil(character_count / batch_size)
     run_index = 0
-    estimated_time = character_count*info_scraping_time_estimate + run_count*batch_wait + incorporated_auction_count*incorp_time_estimate
+    estimated_time = character_count*info_scraping_time_estimate + incorporated_auction_count*incorp_time_estimate
 
     # Display run summary
     print(f'\nRun summary:\n'
@@ -373,9 +423,10 @@ if __name__ == "__main__":
     incorp_start = timeit.default_timer()
     for _,auction in new_auctions.iterrows():
         character_followup = incorporate_auction(auction, character_followup)
+    progress.finish()
     incorp_end = timeit.default_timer()
     incorp_elapsed = (incorp_end - incorp_start)/60
-    character_followup.to_pickle(followup_filename)
+    save_followup(character_followup, database)
     print(f'\n\nFinished incorporating {incorporated_auction_count:,} auctions in {incorp_elapsed:,.2f} minutes.\n')
 
     # Run batch character info scraping
@@ -387,6 +438,10 @@ if __name__ == "__main__":
     total_deleted_count = 0
     total_collected_count = 0
 
+    # Character pages are fetched asynchronously and parsed on a process pool; results are aggregated here
+    character_pipeline = FetchParsePipeline(parse_character_page, headers=character_headers,
+                                            fetchers=character_fetchers).start()
+
     while first_index < character_count:
 
         batch_start = timeit.default_timer()
@@ -395,9 +450,9 @@ if __name__ == "__main__":
 
         selected_names = searched_character_names[first_index:last_index]
 
-        # Collect current character info
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            nth_run_collection = list(executor.map(get_character_info, selected_names))
+        # Collect current character info (TibiaRing alias lookups run here, for characters not found on Tibia.com)
+        nth_run_collection = collect_character_info(selected_names, character_pipeline)
+        progress.finish()
 
         # Aggregate scraped info
         batch_end = timeit.default_timer()
@@ -417,19 +472,23 @@ if __name__ == "__main__":
         total_deleted_count += nth_deleted_count
         total_collected_count += nth_collected_count
 
-        # Display report and wait before next batch scraping iteration
-        print(f'\n\nFinished run #{run_index} in {batch_time:.1f} seconds (sleeping for {batch_wait} seconds)')
+        # Display report (request pacing is handled by the shared rate limiter)
+        print(f'\n\nFinished run #{run_index} in {batch_time:.1f} seconds')
         print(f'\tTotal elapsed time: {total_time/60:.1f} minutes.')
+        print(f'\tRequest rate: {http_client.limiter.rate(character_url_root):.2f} requests/s.')
         print(f'\tError 403: {nth_403_count:>5,}\n'
               f'\tDeleted:   {nth_deleted_count:>5,}\n'
               f'\tNot found: {nth_None_count:>5,}\n'
               f'\tCollected: {nth_collected_count:>5,}')
-        time.sleep(batch_wait)
 
         # Update indices for next batch scrape iteration
         first_index = last_index
         last_index = min(first_index + batch_size, character_count)
 
+    character_pipeline.close()
+    close_parse_pool()
+    http_client.close()
+
     # Done scraping: display report
     scrape_end = timeit.default_timer()
     scrape_elapsed = (scrape_end - scrape_start)/60
@@ -439,19 +498,17 @@ if __name__ == "__main__":
           f'\tDeleted:   {total_deleted_count:>8,}\n'
           f'\tNot found: {total_None_count:>8,}\n'
           f'\tCollected: {total_collected_count:>8,}\n\n')
-    time.sleep(batch_wait/2)
 
     # Store scraped data in dataframe and export to .PKL file
     print(f"\nWriting collected info to file '{scraped_info_filename}'... ", end='', flush=True)
-    scraped_df = pd.DataFrame()
     scraped_columns = ['OriginalName', 'Name', 'World', 'Sex', 'Vocation', 'Level', 'LastLogin', 'AccountStatus', 'Scheduled', 'AccessDate']
+    scraped_rows = []
     for char in character_info_dict.keys():
         info = character_info_dict[char]
         if not isinstance(info, list):
             info = [None] * 9
-        char_info_dict = {key: value for key, value in zip(scraped_columns, [char] + info)}
-        scraped_df = scraped_df.append(pd.DataFrame(char_info_dict, index=[0]))
-    scraped_df = scraped_df.reset_index(drop=True)
+        scraped_rows.append(dict(zip(scraped_columns, [char] + info)))
+    scraped_df = pd.DataFrame(scraped_rows, columns=scraped_columns)
     scraped_df.to_pickle(scraped_info_filename)
     print('done!\n')
 
@@ -459,6 +516,7 @@ if __name__ == "__main__":
     print(f'\nUpdating info for {len(character_info_dict):,} characters...')
     update_start = timeit.default_timer()
     character_followup, failed_updates = update_followup(character_followup, character_info_dict)
+    progress.finish()
     update_end = timeit.default_timer()
     update_elapsed = (update_end - update_start)/60
     print(f'\nFinished updating {len(character_info_dict):,} characters on follow-up dataframe in {update_elapsed:,.2f} minutes!')
@@ -472,7 +530,7 @@ if __name__ == "__main__":
 
     # Write dataframe to files
     character_followup.to_pickle(followup_today)
-    character_followup.to_pickle(followup_filename)
+    save_followup(character_followup, database)
     print(f'\n\nFinished follow-up! DataFrame written to {followup_filename} & {followup_today}')
 
     followup_end = timeit.default_timer()
@@ -495,5 +553,6 @@ if __name__ == "__main__":
         fail_reg.write('\n\n\nList of characters that could not be updated:')
         for char in failed_updates:
             fail_reg.write(f'\n{char}')
+    metrics.export()
     print(f'\n\nReport written to file {failed_today}.')
 
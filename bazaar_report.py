@@ -8,6 +8,9 @@ from scipy import stats
 import os
 import datetime
 import timeit
+from auction_store import load_auctions, dataframe_columns
+from bazaar_database import BazaarDatabase, database_filename
+from auction_dtypes import compact_auctions, base_vocations
 
 # Plot settings
 voc_colors = dict(EK='#0173b2', RP='#de8f05', ED='#029e73', MS='#d55e00', N='#cc78bc', K='#0173b2', P='#de8f05',
@@ -31,11 +34,17 @@ color_dict = {'red':   ((0.0, 0.0, 0.0),   # no red at 0
 
 # Import scraped auction data and Tibia World data
 os.chdir('D:\\Programming\\Python\\TibiaAuctions')
-complete_auction_dataframe = pd.read_pickle('last_full_scrape.pkl')
-complete_auction_dataframe = complete_auction_dataframe.drop('Bestiary', axis=1)
-status_dataframe = complete_auction_dataframe[~complete_auction_dataframe.duplicated(subset='Id', keep=False)]
+if os.path.isfile(database_filename):
+    bazaar_database = BazaarDatabase(database_filename)
+    complete_auction_dataframe = bazaar_database.load('auctions', columns=[column for column in dataframe_columns if column != 'Bestiary'])
+    followup_df = bazaar_database.load('followup')
+else:
+    complete_auction_dataframe = load_auctions(columns=[column for column in dataframe_columns if column != 'Bestiary'])
+    followup_df = pd.read_pickle('character_followup.pkl')
 worlds_dataframe = pd.read_pickle('tibia_game_worlds.pkl')
-followup_df = pd.read_pickle('character_followup.pkl')
+# Categorical codes and compact integers: vocation and world filters below compare integer codes
+complete_auction_dataframe = compact_auctions(complete_auction_dataframe, worlds_dataframe)
+status_dataframe = complete_auction_dataframe[~complete_auction_dataframe.duplicated(subset='Id', keep=False)]
 
 # Divide dataframe: successful and failed auctions
 won_auctions = status_dataframe[status_dataframe.Type.eq("W")]
@@ -78,7 +87,7 @@ voc_keys = list((map(lambda k: k[0], vocations)))
 voc_columns = ['AvgLevel', 'AvgBid', 'Count']
 vocation_totals = pd.DataFrame(columns=voc_columns, index=voc_keys)
 for vocation in vocations:
-    vocation_dataframe = successful_auctions[successful_auctions.Vocation.isin(vocation)]
+    vocation_dataframe = successful_auctions[successful_auctions.BaseVocation.eq(base_vocations[vocation[0]])]
     voc_avg_level = vocation_dataframe['Level'].mean()
     voc_avg_bid = vocation_dataframe['Bid'].mean()
     voc_count = len(vocation_dataframe)
@@ -118,8 +127,8 @@ plt.show()
 # Scatter plot: bid values by level for each vocation
 fig, axs = plt.subplots(2, 2, sharey=True, sharex=True)
 for index, vocation in enumerate(vocations[:-1]):
-    vocation_dataframe = successful_auctions[successful_auctions.Vocation.isin(vocation)]
-    failed_dataframe = failed_auctions[failed_auctions.Vocation.isin(vocation)]
+    vocation_dataframe = successful_auctions[successful_auctions.BaseVocation.eq(base_vocations[vocation[0]])]
+    failed_dataframe = failed_auctions[failed_auctions.BaseVocation.eq(base_vocations[vocation[0]])]
     voc_color = voc_colors[vocation[0]]
     b = "0" + bin(index)[2:]
     bin_loc = b[-2:]
@@ -266,8 +275,8 @@ plt.show()
 start_time = timeit.default_timer()
 
 resold = followup_df[followup_df.NewId.notnull()]
-id_pairs_purchase = list(resold.Id)
-id_pairs_sale = list(resold.NewId)
+id_pairs_purchase = list(resold.Id.astype('int64'))
+id_pairs_sale = list(resold.NewId.astype('int64'))
 id_pairs_voc = list(resold.Vocation)
 id_pairs = [(voc, purch, sale) for voc,purch,sale in zip(id_pairs_voc, id_pairs_purchase, id_pairs_sale)]
 true_ids = id_pairs_sale + id_pairs_purchase
@@ -280,11 +289,11 @@ N_pairs = [pair for pair in id_pairs if pair[0] == 'N']
 
 resale_auctions = successful_auctions[successful_auctions.Id.isin(true_ids)]
 
-resale_EKs = resale_auctions[resale_auctions.Vocation.isin(['K','EK'])]
-resale_RPs = resale_auctions[resale_auctions.Vocation.isin(['P','RP'])]
-resale_EDs = resale_auctions[resale_auctions.Vocation.isin(['D','ED'])]
-resale_MSs = resale_auctions[resale_auctions.Vocation.isin(['S','MS'])]
-resale_Ns = resale_auctions[resale_auctions.Vocation.eq('N')]
+resale_EKs = resale_auctions[resale_auctions.BaseVocation.eq('K')]
+resale_RPs = resale_auctions[resale_auctions.BaseVocation.eq('P')]
+resale_EDs = resale_auctions[resale_auctions.BaseVocation.eq('D')]
+resale_MSs = resale_auctions[resale_auctions.BaseVocation.eq('S')]
+resale_Ns = resale_auctions[resale_auctions.BaseVocation.eq('N')]
 
 data_by_voc = [('EK', EK_pairs, resale_EKs),
                ('RP', RP_pairs, resale_RPs),
@@ -374,7 +383,7 @@ print(f'{elapsed_time:.2f} seconds elapsed. {skipped} auctions skipped.')
 
 
 # Knights: skill info
-EKs = successful_auctions[successful_auctions.Vocation.isin(vocations[0])]
+EKs = successful_auctions[successful_auctions.BaseVocation.eq('K')]
 EK_count = len(EKs)
 
 skill_value_dict = {'Axe':[0], 'Club':[0], 'Sword':[0], 'Fist':[0]}
@@ -465,7 +474,7 @@ plt.show()
 
 
 # Histogram: distance fighting skill
-RPs = successful_auctions[successful_auctions.Vocation.isin(vocations[1])]
+RPs = successful_auctions[successful_auctions.BaseVocation.eq('P')]
 RP_distance = RPs['Distance Fighting']
 max_distance = int(max(RP_distance))
 
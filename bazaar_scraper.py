@@ -1,360 +1,684 @@
 import requests
 import datetime
 import time
-from requests_html import HTML
-from requests_html import HTMLSession
 import pandas as pd
 import os
 import concurrent.futures
 import logging
 import pickle
+import argparse
+from urllib.parse import urlsplit
+from lxml import etree
+import http_client
+import rate_limiter
+from async_crawler import AsyncPageCrawler
+from fetch_pipeline import FetchParsePipeline, parse_pool, close_parse_pool
+from detail_parser import parse_detail_page, missing_sections
+from browser_pool import BrowserPool
+from auction_index import AuctionIndex
+from record_batch import RecordBatch
+from auction_store import AuctionStore, dataframe_columns
+from bazaar_database import BazaarDatabase, add_database_arguments
+from crawl_checkpoint import CrawlCheckpoint
+from detail_cache import DetailCache, cache_filename
+from crawl_watermark import CrawlWatermark, find_boundary_page, boundary_margin
+from page_cursor import PageCursor
+from history_parser import parse_history_page, parse_page_count
+from html_archive import add_archive_arguments
+from run_metrics import metrics, progress, add_metrics_arguments
 
 # Global variables:
 request_headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/70.0.3538.77 Safari/537.36'}
 #   Auction history url (main page)
-root_url = 'https://www.tibia.com/charactertrade/?subtopic=pastcharactertrades'
-#   Output dataframe columns: Name               [str]
-#                             Level              [int]
-#                             Vocation           [str]       'E', 'EK', 'P', 'RP', 'D', 'ED', 'S', 'MS', 'N'
-#                             World              [str]
-#                             Sex                [str]       'M': male | 'F': female
-#                             Bid                [int]
-#                             Type               [str]       'W': auction was won | 'M': auction without bids
-#                             Start              [datetime]  year, month, day, hour, minute
-#                             End                [datetime]  year, month, day, hour, minute
-#                             Status             [str]       website text: 'finished', 'currently processed', 'cancelled', 'will be transferred...'
-#                             Id                 [str]       auction identification (unique)
-#                             Link               [str]       url to specific auction
-#                             Page               [int]       'auction history' page number at which the auction was found
-#                             Axe Fighting       [int]
-#                             Club Fighting      [int]
-#                             Distance Fighting  [int]
-#                             Fishing            [int]
-#                             Fist Fighting      [int]
-#                             Magic Level        [int]
-#                             Shielding          [int]
-#                             Sword Fighting     [int]
-#                             Creation Date      [datetime]  year, month, day, hour, minute
-#                             Experience         [int]
-#                             Gold               [int]
-#                             Achievement Points [int]
-#                             Bestiary           [dict]      {'<creature_name_1:str>':<number_of_kills:int>, '<creature_name_2:str>':<number_of_kills:int> ...}
-dataframe_columns = ['Name', 'Level', 'Vocation', 'World', 'Sex', 'Bid', 'Type', 'Start', 'End', 'Status', 'Id',
-                     'Link', 'Page', 'Axe Fighting', 'Club Fighting', 'Distance Fighting', 'Fishing',
-                     'Fist Fighting', 'Magic Level', 'Shielding', 'Sword Fighting', 'Creation Date',
-                     'Experience', 'Gold', 'Achievement Points', 'Bestiary']
-# File to which the full dataframe will be written at the end of the run
+root_url = http_client.tibia_url + '/charactertrade/?subtopic=pastcharactertrades'
+tibia_host = urlsplit(root_url).hostname
+#   Output dataframe columns: dataframe_columns (auction_store)
+# Legacy file holding the full dataframe (migrated into the auction store on first run)
 last_scrape_filename = 'last_full_scrape.pkl'
+# Append-only auction store (partitioned by End date) to which each run adds its new auctions
+store_dirname = 'auction_store'
+# Crawl watermark (newest stored auction, oldest auction with a status that may change), kept in the store directory
+watermark_filename = 'watermark.json'
+# Status texts that no longer change
+final_status = ['finished', 'cancelled']
+# Record columns kept as page text while crawling, converted to datetime64 once the records become a dataframe
+text_date_columns = ['Creation Date']
 # File to which partial dataframes will be written as each page is scraped
 temp_scrape_filename = 'tmp_partial_scrape.pkl'
 # Initialize counters: skipped & scraped chars
 skipped_chars = 0
 scraped_chars = 0
-# Initialize counter for old auctions (finished more than 10 days ago)
-consecutive_expired = 0
 # Get current date
 today = datetime.datetime.today()
+# Headless browser pool, used for auction pages that need rendering
+browser_pool = None
+# Renders queued on the browser pool by prefetch_details, not picked up yet: {auction url: future}
+pending_renders = {}
+# Stored auctions plus auctions scraped during the run, and Id -> row position index
+auction_records = RecordBatch(columns=dataframe_columns, date_columns=text_date_columns)
+auction_index = AuctionIndex()
+# Crawl progress, written to the page directory (used to resume an interrupted run)
+checkpoint = None
+# Detail records collected by previous runs, kept in the store directory: only their Status is refreshed
+detail_cache = None
+# Detail page fetch/parse pipeline (asyncio crawl mode)
+detail_pipeline = None
+# Parsed detail pages of the auctions being scraped: {'<auction_id>': sections} (reused when a scrape is retried)
+parsed_details = {}
+# Detail pages of a history page fetched concurrently by a bounded thread pool (synchronous crawl mode)
+detail_workers = 8
+detail_executor = None
+# Attempts per auction, by error class: 'network' (connection errors, throttling, server errors), 'parse' (sections
+# missing after rendering), 'other' (unexpected errors) and 'missing' (auction page not found: never retried)
+detail_attempts = {'network': 3, 'parse': 2, 'other': 2, 'missing': 1}
+# Auctions that failed every attempt, tried once more at the end of the crawl: [(auction, page_number, error_class)]
+retry_queue = []
+# File to which the auctions recovered from the retry queue are written (in the page directory)
+retried_filename = 'retried_auctions.pkl'
+
+
+class DetailPageError(ConnectionError):
+    """Auction detail page not served (status_code: HTTP status, None on connection errors)"""
+
+    def __init__(self, auction_id, status_code):
+        super().__init__(f"Failed to access auction #{auction_id} (status {status_code})")
+        self.status_code = status_code
+
+
+def watermark_path(store_path, database_path=None):
+    """Crawl watermark file: in the store directory, or next to the database file with --database"""
+    if database_path:
+        return os.path.splitext(database_path)[0] + '_' + watermark_filename
+    return os.path.join(store_path, watermark_filename)
 
 
 def get_page_count():
     """ Get the total number of pages (as integer) from the main "Auction History" page: """
-    global max_page_hour
 
-    time.sleep(1)
-    main_r = requests.get(root_url, headers=request_headers)
+    try:
+        main_r = http_client.get(root_url, headers=request_headers)
+    except requests.RequestException:
+        return 0
     if main_r.status_code == 200:
-        main_r_html = HTML(html=main_r.text)
-        page_numbers = main_r_html.find(".PageLink")
+        max_page = parse_page_count(main_r.text)
         main_r.close()
-        max_page = int(list(page_numbers[-1].links)[0].split("page=")[-1])
-
-        max_page_hour = datetime.datetime.now().hour
-
         return max_page
     else:
         main_r.close()
         return 0
 
 
-def scrape_tibia_auctions():
-    """Scrape all bazaar data"""
-    global auction_dataframe, consecutive_expired
+def get_last_page(first_page, max_page, cutoff):
+    """Last page to be crawled: boundary page of the watermark cutoff plus a margin (max_page without cutoff)"""
+    if cutoff is None or max_page <= first_page:
+        return max_page
+    print(f"\nLocating the page of auctions ended on {cutoff:%b %d %Y, %H:%M}... ", end='', flush=True)
+    boundary_page = find_boundary_page(page_oldest_end, first_page, max_page, cutoff)
+    print(f"page {boundary_page}.", end='\n')
+    return min(boundary_page + boundary_margin, max_page)
+
+
+def page_oldest_end(page_number):
+    """End date of the oldest auction listed in an 'auction history' page (None if the page could not be read)"""
+    page_summaries = fetch_history_page(page_number)[1]
+    end_dates = [summary['End'] for summary in page_summaries or [] if summary is not None]
+    return min(end_dates) if end_dates else None
+
+
+def fetch_history_page(page_number):
+    """Fetch and parse an 'auction history' page: (status_code, page_summaries), status_code is None on connection errors"""
+    page_url = root_url + '&currentpage=' + str(page_number)
+    try:
+        page_req = http_client.get(page_url, headers=request_headers)
+    except requests.RequestException:
+        return None, None
+    page_summaries = None
+    if page_req.status_code == 200:
+        with metrics.timer('parse_seconds', page='history'):
+            page_summaries = parse_history_page(page_req.text)
+    page_req.close()
+    return page_req.status_code, page_summaries
+
+
+def scrape_tibia_auctions(first_page=1, cutoff=None):
+    """Scrape all bazaar data (only pages listing auctions that ended after cutoff, if given)"""
 
     max_page = get_page_count()
-    print(f"\nScraping a total of {max_page} pages:", end='\n')
+    last_page = get_last_page(first_page, max_page, cutoff)
+    print(f"\nScraping pages {first_page} to {last_page} (of {max_page}):", end='\n')
+    # Auctions finishing while crawling are tracked from the auctions repeated across pages
+    cursor = PageCursor(last_page, max_page)
 
     # Integer immediately before first page to be scraped (usually =0)
-    page_number = 0
-
-    # Loop through each 'auction history' page
-    while page_number <= max_page:
-        page_number += 1
-    #for page_number in range(1, max_page + 1):
-
-        page_url = root_url + '&currentpage=' + str(page_number)
-        time.sleep(1)
-        page_req = requests.get(page_url, headers=request_headers)
-
-        if page_req.status_code == 200:
-            page_html = HTML(html=page_req.text)
-            page_dataframe = get_page_data(page_html, page_number)
-            if not page_dataframe.empty:
-                auction_dataframe = auction_dataframe.append(page_dataframe)
-                pkl_fname = page_dir_name + "\\page_" + str(page_number) + ".pkl"
-                with open(pkl_fname, 'wb') as pkl_file:
-                    pickle.dump(page_dataframe, pkl_file)
+    page_number = first_page - 1
 
-        else:
-            error_code = page_req.status_code
-            error_description = requests.status_codes._codes[error_code][0]
-            print(f"\nFailed to access page {page_number} (error code {error_code}: {error_description}).")
+    # Loop through each 'auction history' page (pages are fetched in order: no auction can be missed)
+    try:
+        while page_number < cursor.last_page:
+            page_number += 1
+
+            status_code, page_summaries = fetch_history_page(page_number)
+            if status_code == 200 and page_summaries is not None:
+                scrape_page(cursor.advance(page_summaries), page_number)
+            elif status_code == 200:
+                print(f"\nFailed to parse page {page_number}.")
+            else:
+                print_page_error(page_number, status_code)
+
+        retry_queued_auctions()
+    finally:
+        close_detail_executor()
+        progress.finish()
+
+    print_crawl_end(cursor)
+    return auction_records
 
-        page_req.close()
 
-        if consecutive_expired > 200:
-            print(f'\nProcess interrupted on page {page_number}/{max_page}: older auctions already registered.')
-            break
+def scrape_tibia_auctions_async(max_in_flight=4, first_page=1, processes=None, cutoff=None):
+    """Scrape all bazaar data: pages fetched concurrently, parsed on a process pool, records merged on this thread"""
+    global detail_pipeline
 
-        current_hour = datetime.datetime.now().hour
-        if current_hour > max_page_hour:
-            if datetime.datetime.now().minute > 4:
-                print(f'\n\n*** Max page updated: from {max_page} to ', end='', flush=True)
-                max_page = get_page_count()
-                print(f'{max_page} ***', end='\n\n', flush=True)
+    max_page = get_page_count()
+    last_page = get_last_page(first_page, max_page, cutoff)
+    print(f"\nScraping pages {first_page} to {last_page} (of {max_page}, {max_in_flight} requests in flight, "
+          f"starting at {http_client.limiter.rate(root_url):.1f} requests/s):", end='\n')
+
+    # History pages and detail pages share the parser processes
+    parsers = parse_pool(processes)
+    crawler = AsyncPageCrawler(root_url, request_headers, max_in_flight=max_in_flight,
+                               parse=parse_history_page, executor=parsers)
+    detail_pipeline = FetchParsePipeline(parse_detail_page, headers=request_headers, fetchers=max_in_flight,
+                                         executor=parsers).start()
+    cursor = PageCursor(last_page, max_page)
+    crawler.start(first_page, last_page)
+    try:
+        for page_number, status_code, page_summaries, served in crawler.pages():
+
+            if status_code == 200 and page_summaries is not None:
+                if cursor.must_refetch(page_summaries, served):
+                    # Served before the previous page: auctions added in between would be missed
+                    print(f"\nPage {page_number} served out of order: fetching it again.")
+                    request_start = time.monotonic()
+                    status_code, refetched_summaries = fetch_history_page(page_number)
+                    if status_code == 200 and refetched_summaries is not None:
+                        page_summaries = refetched_summaries
+                        served = (request_start, time.monotonic())
+                scrape_page(cursor.advance(page_summaries, served), page_number)
+            elif status_code == 200:
+                print(f"\nFailed to parse page {page_number}.")
+            else:
+                print_page_error(page_number, status_code)
+
+            if cursor.last_page != crawler.last_page:
+                crawler.set_last_page(cursor.last_page)
+
+        retry_queued_auctions()
+    finally:
+        crawler.stop()
+        detail_pipeline.close()
+        detail_pipeline = None
+        close_parse_pool()
+        progress.finish()
+
+    print_crawl_end(cursor)
+    return auction_records
+
+
+def scrape_page(page_summaries, page_number):
+    """Store the new auctions of a parsed 'auction history' page"""
+
+    page_records = get_page_data(page_summaries, page_number)
+    metrics.inc('pages_total')
+    metrics.set('current_page', page_number)
+    for auction in page_summaries:
+        if auction is not None:
+            parsed_details.pop(auction['Id'], None)
+            pending_renders.pop(auction['Link'], None)
+    if page_records:
+        auction_records.extend(page_records)
+        auction_index.extend(record['Id'] for record in page_records)
+        # Plain records: the dataframe is built once, at the end of the crawl
+        pkl_fname = os.path.join(page_dir_name, "page_" + str(page_number) + ".pkl")
+        with open(pkl_fname, 'wb') as pkl_file:
+            pickle.dump(page_records, pkl_file)
+    if detail_cache is not None:
+        detail_cache.flush()
+    if checkpoint:
+        checkpoint.page_completed(page_number, dict(skipped_chars=skipped_chars, scraped_chars=scraped_chars))
+
+
+def print_page_error(page_number, error_code):
+    """Display failed page request on console"""
+    metrics.inc('page_errors_total', code=str(error_code) if error_code is not None else 'error')
+    if error_code is None:
+        print(f"\nFailed to access page {page_number} (connection error).")
+    else:
+        error_description = requests.status_codes._codes.get(error_code, ('unknown',))[0]
+        print(f"\nFailed to access page {page_number} (error code {error_code}: {error_description}).")
 
-    return auction_dataframe
 
+def print_crawl_end(cursor):
+    """Display the auctions added to the history while crawling and where the crawl stopped"""
+    if cursor.drift:
+        print(f'\n{cursor.drift:,} auctions finished while crawling (last page moved from '
+              f'{cursor.last_page - cursor.added_pages} to {cursor.last_page}).')
+    if cursor.last_page < cursor.max_page:
+        print(f'\nCrawl stopped on page {cursor.last_page}/{cursor.max_page}: older auctions already registered.')
 
-def get_page_data(page_html, page_number):
+
+def get_page_data(page_summaries, page_number):
     """Scrape every auction in a page"""
-    global auction_dataframe
 
-    page_df = pd.DataFrame(None)
-    auction_tables = page_html.find(".Auction")
+    page_records = []
+    auction_tables = page_summaries
 
-    # # Batch collect all auctions in page
-    # with concurrent.futures.ThreadPoolExecutor() as executor:
-    #     nth_page_data = executor.map(lambda auction: get_auction_data(auction, page_number), auction_tables)
-    #
-    # for auction_df in nth_page_data:
-    #     page_df = page_df.append(auction_df)
+    # Detail pages of the page's new auctions, fetched and parsed concurrently ahead of the loop
+    fetched_details = prefetch_details(auction_tables)
 
-    # Loop through each auction on the page
+    # Loop through each auction on the page (in page order: records, counters and checkpoint stay on this thread)
     for auction in auction_tables:
-        trying = True
-        first_error = True
-        while trying:
-            try:
-                nth_auction_data = get_auction_data(auction, page_number)
-                page_df = page_df.append(nth_auction_data)
-                trying = False
-            except:
-                if first_error:
-                    print('\n\nOperation failed! Trying again...\n')
-                    first_error = False
-
-    return page_df
-
-
-def get_auction_data(auction, page_number):
+        if auction is None:
+            metrics.inc('auctions_total', result='unreadable')
+            print(f'\nPage {page_number}: unreadable auction summary skipped.')
+            continue
+        nth_auction_data = scrape_auction(auction, page_number, fetched_details.pop(auction['Id'], None))
+        if nth_auction_data is not None:
+            page_records.append(nth_auction_data)
+
+    return page_records
+
+
+def prefetch_details(page_summaries):
+    """Fetch and parse the detail pages of a page's new auctions concurrently: {auction_id: (status, sections)}"""
+    # Through the fetch/parse pipeline in asyncio crawl mode, through a bounded thread pool otherwise
+    new_auctions = [auction for auction in page_summaries if auction is not None and auction['Id'] not in auction_index
+                    and auction['Id'] not in parsed_details
+                    and not (checkpoint and auction['Id'] in checkpoint.partial_records)
+                    and not (detail_cache is not None and auction['Id'] in detail_cache)]
+    if detail_pipeline is not None:
+        fetched_details = ((status_code, sections) for _, status_code, sections
+                           in detail_pipeline.map(auction['Link'] for auction in new_auctions))
+    else:
+        executor = get_detail_executor()
+        futures = [executor.submit(fetch_detail, auction['Link']) for auction in new_auctions]
+        fetched_details = (prefetched_detail(future) for future in futures)
+
+    prefetched = {}
+    for auction, fetched_detail in zip(new_auctions, fetched_details):
+        prefetched[auction['Id']] = fetched_detail
+        # Pages that need rendering are queued on the browser pool as soon as they are parsed: the page's renders run
+        # in parallel on the pool's tabs while its auctions are scraped in order
+        if fetched_detail is not None and fetched_detail[1] is not None and missing_sections(fetched_detail[1]):
+            submit_render(auction['Link'])
+    return prefetched
+
+
+def prefetched_detail(future):
+    """Result of a detail prefetch (None if it raised: scrape_auction then fetches the page again and classifies the error)"""
+    try:
+        return future.result()
+    except Exception:
+        return None
+
+
+def get_detail_executor():
+    """Thread pool fetching detail pages (created on first use)"""
+    global detail_executor
+
+    if detail_executor is None:
+        detail_executor = concurrent.futures.ThreadPoolExecutor(max_workers=detail_workers)
+    return detail_executor
+
+
+def close_detail_executor():
+    global detail_executor
+
+    if detail_executor is not None:
+        detail_executor.shutdown()
+        detail_executor = None
+
+
+def fetch_detail(char_url):
+    """Fetch and parse an auction detail page: (status_code, sections), status_code None on connection errors"""
+    try:
+        char_req = http_client.get(char_url, headers=request_headers)
+    except requests.RequestException:
+        return None, None
+    sections = None
+    if char_req.status_code == 200:
+        try:
+            with metrics.timer('parse_seconds', page='detail'):
+                sections = parse_detail_page(char_req.text)
+        except (ValueError, IndexError, KeyError, AttributeError, etree.LxmlError):
+            # Unreadable page (sections None): handled as a parse error
+            pass
+    char_req.close()
+    return char_req.status_code, sections
+
+
+def scrape_auction(auction, page_number, fetched_detail=None, last_try=False):
+    """get_auction_data with bounded retries by error class (auctions failing every attempt go to the retry queue)"""
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            return get_auction_data(auction, page_number, fetched_detail)
+        except Exception as error:
+            last_error = error
+            error_class = classify_error(error)
+            if attempt >= detail_attempts[error_class]:
+                break
+            metrics.inc('detail_retries_total', error_class=error_class)
+            print(f"\nAuction #{auction['Id']}: {error} ({error_class} error, attempt {attempt}): trying again...")
+            # Fetched again inline (a detail page parsed by a previous attempt is reused)
+            fetched_detail = None
+
+    if error_class == 'missing':
+        metrics.inc('auctions_total', result='missing')
+        print(f"\nAuction #{auction['Id']} not found: skipped.")
+    elif last_try:
+        metrics.inc('auctions_total', result='failed')
+        print(f"\nAuction #{auction['Id']}: {last_error} ({error_class} error): given up.")
+    else:
+        metrics.inc('auctions_queued_total', error_class=error_class)
+        print(f"\nAuction #{auction['Id']}: {last_error} ({error_class} error): queued for a last retry.")
+        retry_queue.append((auction, page_number, error_class))
+    return None
+
+
+def classify_error(error):
+    """Error class of a failed auction scrape: 'network', 'missing', 'parse' or 'other' (see detail_attempts)"""
+    if isinstance(error, DetailPageError):
+        return 'missing' if error.status_code == 404 else 'network'
+    if isinstance(error, (requests.RequestException, ConnectionError, TimeoutError)):
+        return 'network'
+    if isinstance(error, (ValueError, IndexError, KeyError, AttributeError, etree.LxmlError)):
+        return 'parse'
+    return 'other'
+
+
+def retry_queued_auctions():
+    """Try the auctions of the retry queue once more, after the crawl (recovered records are written to the page directory)"""
+    if not retry_queue:
+        return []
+    print(f"\nRetrying {len(retry_queue)} failed auctions...", end='\n')
+    queued_auctions = retry_queue[:]
+    retry_queue.clear()
+
+    retried_records = []
+    failed_ids = []
+    for auction, page_number, _ in queued_auctions:
+        if auction['Id'] in auction_index:
+            continue
+        record = scrape_auction(auction, page_number, last_try=True)
+        if record is not None:
+            retried_records.append(record)
+        else:
+            failed_ids.append(auction['Id'])
+        parsed_details.pop(auction['Id'], None)
+
+    if retried_records:
+        auction_records.extend(retried_records)
+        auction_index.extend(record['Id'] for record in retried_records)
+        with open(os.path.join(page_dir_name, retried_filename), 'wb') as pkl_file:
+            pickle.dump(retried_records, pkl_file)
+    if detail_cache is not None:
+        detail_cache.flush()
+    print(f"\n{len(retried_records)} auctions recovered, {len(failed_ids)} failed: {', '.join(failed_ids)}", end='\n')
+    return retried_records
+
+
+def get_auction_data(auction, page_number, fetched_detail=None):
     """Scrape all data from a single auction"""
-    global auction_dataframe, skipped_chars, scraped_chars, consecutive_expired
+    global skipped_chars, scraped_chars
 
     # Scrape auction summary data
     summary_dict = get_summary_data(auction, page_number)
-    id_match = auction_dataframe['Id'].eq(summary_dict['Id'])
-    matching_row = id_match.index[id_match==True].tolist()
+    matching_row = auction_index.get(summary_dict['Id'])
 
     # Decide whether or not to perform full scrape on the auction
-    if matching_row:
+    if matching_row is not None:
         skipped_chars += 1
-        # Update status
-        old_status = auction_dataframe.iloc[matching_row[0]].Status
+        # Update status (positional access: row labels are not unique until the end of the run)
+        old_status = auction_records.get_value(matching_row, 'Status')
         new_status = summary_dict['Status']
         if new_status != old_status:
-            auction_dataframe.at[matching_row[0], 'Status'] = new_status
-            print('status updated!', end='\n', flush=True)
-            consecutive_expired = 0
-        else:
-            # Skip auction if it's already been registered
-            print("skipped.", end='\n', flush=True)
+            auction_records.set_value(matching_row, 'Status', new_status)
+            if checkpoint:
+                checkpoint.status_updated(summary_dict['Id'], new_status)
+            metrics.inc('status_updates_total')
+        # Skip auction if it's already been registered
+        metrics.inc('auctions_total', result='skipped')
         return None
 
     else:
         # Scrape full auction data
-        print("scraping:", end='', flush=True)
-        auction_df = get_character_data(summary_dict)
-        print(" --- finished!", end='\n', flush=True)
+        if checkpoint and summary_dict['Id'] in checkpoint.partial_records:
+            # Detail record collected before the run was interrupted: only the status may have changed
+            auction_record = checkpoint.partial_records[summary_dict['Id']]
+            auction_record['Status'] = summary_dict['Status']
+            metrics.inc('auctions_total', result='restored')
+        elif detail_cache is not None and (cached_record := detail_cache.get(summary_dict['Id'])) is not None:
+            # Detail record collected by a previous run (e.g. auction dropped from the store): no detail page request
+            auction_record = cached_record
+            auction_record['Status'] = summary_dict['Status']
+            auction_record['Page'] = page_number
+            metrics.inc('auctions_total', result='cached')
+        else:
+            if checkpoint:
+                checkpoint.detail_started(summary_dict['Id'], page_number)
+            auction_record = get_character_data(summary_dict, fetched_detail)
+            if detail_cache is not None:
+                detail_cache.put(auction_record)
+            if checkpoint:
+                checkpoint.detail_finished(auction_record)
+            metrics.inc('auctions_total', result='scraped')
         scraped_chars += 1
-        consecutive_expired = 0
-        return auction_df
+        return auction_record
 
 
 def get_summary_data (auction, page_num):
-    """Scrape auction summary data from an 'auction history' page"""
-    global skipped_chars, scraped_chars, consecutive_expired
-
-    name = auction.find(".AuctionCharacterName")[0].text
-
-    # Print status message to console
-    clock = datetime.datetime.now().strftime("%H:%M:%S")
-    print(150 * " ", end='\r')
-    print(clock + f" [Skipped: {skipped_chars:>7,} | Scraped: {scraped_chars:>7,}] Page {page_num}: {name:<20}... ", end='', flush=True)
-
-    # Scrape auction header
-    header_table = auction.find(".AuctionHeader")[0]
-    char_link = list(header_table.find(".AuctionCharacterName")[0].links)[0]
-    auction_id = char_link.split("auctionid=")[-1].split("&")[0]
-    header_text = header_table.text
-    header_parts = header_text[header_text.find("\n") + 1:].split("|")
-    level = int(header_parts[0].split(":")[-1])
-    voc = ''.join([capital_letter for capital_letter in header_parts[1].split(":")[-1] if capital_letter.isupper()])
-    sex = header_parts[2].strip()[0]
-    world = header_parts[3].split(":")[-1].strip()
-
-    # Scrape auction table
-    auction_data = auction.find(".ShortAuctionData")[0].text.split("\n")
-    data = list(map(lambda date_str: date_str.replace(u"\xa0", " "), auction_data))
-    start = str_to_datetime(data[1])
-    end = str_to_datetime(data[3])
-    end_type = data[4][0]  # W: winning bid; M: minimum bid (failed auction)
-    bid = int(data[5].replace(",", ""))
-
-    auction_age = today - end
-    if auction_age.days > 10:
-        consecutive_expired += 1
-    else:
-        consecutive_expired = 0
+    """Collect auction summary data parsed from an 'auction history' page"""
 
-    # Scrape status box
-    bid_status = auction.find(".CurrentBid")[0].text.replace("\n", " ")
+    # Status line on console (redrawn at most once per second)
+    if progress.due():
+        clock = datetime.datetime.now().strftime("%H:%M:%S")
+        progress.update(clock + f" [Skipped: {skipped_chars:>7,} | Scraped: {scraped_chars:>7,} | "
+                                f"Updated: {metrics.total('status_updates_total'):>5,} | "
+                                f"Failed: {metrics.total('auctions_queued_total'):>4,}] "
+                                f"Page {page_num}: {auction['Name']:<20} "
+                                f"({http_client.limiter.rate(root_url):.1f} requests/s)")
 
     # Store auction summary data in a dictionary
-    auction_dict = dict(Name=name, Level=level, Vocation=voc, World=world, Sex=sex, Bid=bid, Type=end_type,
-                        Start=[start], End=[end], Status=bid_status, Id=auction_id, Link=char_link, Page=page_num)
+    auction_dict = dict(auction, Page=page_num)
 
     return auction_dict
 
 
-def get_character_data(summary_dict):
+def get_character_data(summary_dict, fetched_detail=None):
     """Scrape full auction data from the character's individual page"""
 
     char_url = summary_dict['Link']
 
-    with HTMLSession() as session:
-
-        char_req = session.get(char_url, headers=request_headers)
-
-        if char_req.status_code == 200:
-
-            print(" fetching html...", end='', flush=True)
-            char_html = char_req.html
-            print("done!", end='', flush=True)
-
-            print(" rendering...", end='', flush=True)
-            char_html.render(timeout=0)
-            print("done!", end='', flush=True)
-
-            # # Available information, unused thus far:
-            # item_data = html.find("#ItemSummary")[0]
-            # store_data = html.find("#StoreItemSummary")[0]
-            # mount_data = html.find("#Mounts")[0]
-            # outfit_data = html.find("#Outfits")[0]
-            # store_outfits_data = html.find("#StoreOutfits")[0]
-            # blessing_data = html.find("#Blessings")[0]
-            # imbuement_data = html.find("#Imbuements")[0]
-            # charm_data = html.find("#Charms")[0]
-            # area_data = html.find("#CompletedCyclopediaMapAreas")[0]
-            # quest_data = html.find("#CompletedQuestLines")[0]
-            # title_data = html.find("#Titles")[0]
-            # achievement_data = html.find("#Achievements")[0]
-
-            # Collect skills
-            general_data = char_html.find("#General")[0]
-            general_first_row = general_data.find(".InnerTableContainer > table > tbody > tr > td > table > tbody > tr")[0]
-            general_tables = general_first_row.find("table")
-            general_skills = general_tables[1].text.split("\n")
-            skill_names = general_skills[0::3]
-            skill_values = list((map(lambda skill: int(skill), general_skills[1::3])))
-            skill_dict = {}
-            for skill_name, skill_value in zip(skill_names, skill_values):
-                skill_dict[skill_name] = skill_value
-            # Available information, unused thus far: hitpoints, mana, capacity, speed, blessings, mounts, outfits, titles
-            # general_stats = general_tables[0].text.split("\n")
-            # stat_names = list((map (lambda stat: stat.replace(":", ""), general_stats[0::2])))
-            # stat_values = list((map (lambda value: int(value.split("/")[0].replace(",", "")), general_stats[1::2])))
-
-            # Collect bank data
-            general_second_row = general_data.find(".InnerTableContainer > table > tbody > tr")[1].text.split("\n")
-            bank_dict = {'Creation Date': str_to_datetime(general_second_row[1].replace("\xa0", " ")),
-                         'Experience': int(general_second_row[3].replace(",", "")),
-                         'Gold': int(general_second_row[5].replace(",", "")),
-                         'Achievement Points': int(general_second_row[7].replace(",", ""))}
-
-            # Collect bestiary
-            bestiary_data = char_html.find("#BestiaryProgress")[0]
-            bestiary_table = bestiary_data.find(".TableContent")[0]
-            bestiary_rows = bestiary_table.find("tr")[1:]
-            if len(bestiary_rows) > 0:
-                last_row = bestiary_rows[-1].text
-                if last_row.find("more entries)") >= 0:
-                    bestiary_rows = bestiary_rows[:-1]
-            bestiary_dict = {}
-            if len(bestiary_rows) > 0:
-                for bestiary_creature in bestiary_rows:
-                    creature_entry = bestiary_creature.text.split("\n")
-                    creature_name = creature_entry[-1]
-                    creature_count = int(creature_entry[1][:-1].replace(",", ""))
-                    bestiary_dict[creature_name] = creature_count
-
-            # Incorporate character data to dictionary and convert to dataframe
-            summary_dict.update(skill_dict)
-            summary_dict.update(bank_dict)
-            char_dataframe = pd.DataFrame(summary_dict)
-            char_dataframe.loc[0, 'Bestiary'] = [bestiary_dict]
-
-            print(" closing page...", end='', flush=True)
-            char_req.close()
-            print(" closed!", end='', flush=True)
-            #time.sleep(1)
-
-            return char_dataframe
+    if summary_dict['Id'] in parsed_details:
+        # Detail page already fetched and parsed by a failed attempt (only the missing parts are done again)
+        sections = parsed_details[summary_dict['Id']]
 
+    else:
+        # Detail page fetched and parsed ahead (or fetched now): (status_code, sections)
+        status_code, sections = fetched_detail if fetched_detail is not None else fetch_detail(char_url)
+        if status_code != 200:
+            raise DetailPageError(summary_dict['Id'], status_code)
+        if sections is None:
+            raise ValueError(f"Unreadable page for auction #{summary_dict['Id']}")
+    parsed_details[summary_dict['Id']] = sections
+
+    # # Available information, unused thus far:
+    # item_data = html.find("#ItemSummary")[0]
+    # store_data = html.find("#StoreItemSummary")[0]
+    # mount_data = html.find("#Mounts")[0]
+    # outfit_data = html.find("#Outfits")[0]
+    # store_outfits_data = html.find("#StoreOutfits")[0]
+    # blessing_data = html.find("#Blessings")[0]
+    # imbuement_data = html.find("#Imbuements")[0]
+    # charm_data = html.find("#Charms")[0]
+    # area_data = html.find("#CompletedCyclopediaMapAreas")[0]
+    # quest_data = html.find("#CompletedQuestLines")[0]
+    # title_data = html.find("#Titles")[0]
+    # achievement_data = html.find("#Achievements")[0]
+
+    # Render page (headless browser) only if some section is missing from the raw html
+    if missing_sections(sections):
+        metrics.inc('detail_renders_total')
+        with metrics.timer('render_seconds'):
+            sections = render_missing_sections(char_url, sections)
+        if missing_sections(sections):
+            raise ValueError(f"Sections {missing_sections(sections)} not found for auction #{summary_dict['Id']}")
+
+    # Collect skills
+    skill_dict = sections['Skills']
+
+    # Collect bank data
+    bank_dict = get_bank_data(sections['Bank'])
+
+    # Collect bestiary
+    bestiary_dict = sections['Bestiary']
+
+    # Incorporate character data to the auction record
+    summary_dict.update(skill_dict)
+    summary_dict.update(bank_dict)
+    summary_dict['Bestiary'] = bestiary_dict
+
+    return summary_dict
+
+
+def get_browser_pool():
+    """Headless browser pool (browsers are launched once per run, on the first page that needs rendering)"""
+    global browser_pool
+
+    if browser_pool is None:
+        browser_pool = BrowserPool(user_agent=request_headers['User-Agent'])
+    return browser_pool
+
+
+def submit_render(char_url):
+    """Queue an auction page on the browser pool ahead of its scrape (picked up by render_missing_sections)"""
+    if not http_client.offline and char_url not in pending_renders:
+        pending_renders[char_url] = get_browser_pool().submit(char_url)
+
+
+def render_missing_sections(char_url, sections):
+    """Render the auction page on a headless browser and parse the sections that were missing from the raw html"""
+    if http_client.offline:
+        # Offline re-parse: use the rendered page kept in the archive
+        rendered_text = http_client.archived_page(char_url, kind='rendered')[1]
+        if rendered_text is None:
+            return sections
+    else:
+        # Rendered ahead by prefetch_details, or now (e.g. a later attempt after a failed render)
+        future = pending_renders.pop(char_url, None)
+        if future is None:
+            rendered_text = get_browser_pool().render(char_url)
         else:
+            rendered_text = get_browser_pool().result(future)
+        http_client.archive_page(char_url, rendered_text, kind='rendered')
 
-            return None
+    rendered_sections = parse_detail_page(rendered_text)
+    for section in missing_sections(sections):
+        sections[section] = rendered_sections[section]
 
+    return sections
 
-def str_to_datetime(date_str):
-    """Converts string formatted as 'Aug 14, 2020 <dismissed_info>' to datetime object (2020, 8, 14)"""
-    date_list = date_str.replace(',', '').split(' ')
-    months = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
-    month = months.index(date_list[0]) + 1
-    day = int(date_list[1])
-    year = int(date_list[2])
-    (hour, minute) = list(map(int, date_list[3].split(':')[0:2]))
-    return datetime.datetime(year, month, day, hour, minute)
-    #return datetime.date(year, month, day)
+
+def get_bank_data(bank_texts):
+    """Convert the bank row texts to Experience, Gold and Achievement Points [int] (Creation Date is kept as text)"""
+    bank_dict = {'Creation Date': bank_texts['Creation Date'],
+                 'Experience': int(bank_texts['Experience'].replace(",", "")),
+                 'Gold': int(bank_texts['Gold'].replace(",", "")),
+                 'Achievement Points': int(bank_texts['Achievement Points'].replace(",", ""))}
+    return bank_dict
 
 
 if __name__ == "__main__":
 
+    # Command line options
+    parser = argparse.ArgumentParser(description='Tibia Auction Scraper')
+    parser.add_argument('--async', dest='async_crawl', action='store_true',
+                        help='fetch auction history pages concurrently (asyncio crawl mode)')
+    parser.add_argument('--in-flight', type=int, default=4,
+                        help='maximum number of simultaneous page requests in asyncio crawl mode')
+    parser.add_argument('--processes', type=int, default=None,
+                        help='number of parser processes in asyncio crawl mode (default: one per core, minus one)')
+    parser.add_argument('--rate', type=float, default=rate_limiter.initial_rate,
+                        help='initial number of requests per second to tibia.com (adjusted from server responses)')
+    parser.add_argument('--max-rate', type=float, default=rate_limiter.max_rate,
+                        help='maximum number of requests per second to tibia.com')
+    parser.add_argument('--browsers', type=int, default=1,
+                        help='number of headless browser processes used to render auction pages')
+    parser.add_argument('--tabs', type=int, default=4,
+                        help='number of tabs opened on each headless browser')
+    parser.add_argument('--page-uses', type=int, default=50,
+                        help='number of renders after which a browser tab is recycled')
+    parser.add_argument('--store', default=store_dirname,
+                        help='auction store directory')
+    parser.add_argument('--full-crawl', action='store_true',
+                        help='crawl every history page, ignoring the crawl watermark')
+    parser.add_argument('--no-detail-cache', action='store_true',
+                        help='fetch the detail page of every new auction, ignoring the detail records cached by previous runs')
+    add_archive_arguments(parser)
+    add_metrics_arguments(parser)
+    add_database_arguments(parser)
+    parser.add_argument('--resume', nargs='?', const='', default=None, metavar='PAGE_DIR',
+                        help="resume an interrupted run from its page directory (default: today's)")
+    args = parser.parse_args()
+    http_client.limiter.configure(tibia_host, rate=args.rate, highest_rate=args.max_rate)
+    metrics.export_path = args.metrics
+    if args.from_archive or args.archive:
+        http_client.use_archive(args.from_archive or args.archive, from_archive=args.from_archive is not None)
+    browser_pool = BrowserPool(browsers=args.browsers, tabs=args.tabs, max_page_uses=args.page_uses,
+                               user_agent=request_headers['User-Agent'])
+
     # Display status message on console
     print("\nRunning Tibia Auction Scraper!")
-    if os.path.isfile(last_scrape_filename):
-        print("\nRestoring dataframe values from file... ", end='', flush=True)
-        #auction_dataframe = pd.read_pickle(last_scrape_filename)
+    auction_store = AuctionStore(args.store)
+    database = BazaarDatabase(args.database) if args.database else None
+    watermark = CrawlWatermark(watermark_path(args.store, args.database))
+    if watermark.exists():
+        watermark.load()
+    if database is None and not auction_store.exists() and os.path.isfile(last_scrape_filename):
+        print(f"\nMigrating {last_scrape_filename} to auction store '{args.store}'... ", end='', flush=True)
         with open(last_scrape_filename, 'rb') as pkl_file:
-            auction_dataframe = pickle.load(pkl_file)
-        print(f"{len(auction_dataframe):,} characters loaded!", end ='\n')
+            auction_store.append(pickle.load(pkl_file))
+        print("done!", end='\n')
+    if database is not None:
+        # Only auctions that can be listed on the pages to be crawled are needed (End index)
+        window_start = None
+        if watermark.newest_end is not None and not args.full_crawl:
+            window_start = watermark.cutoff(today) - datetime.timedelta(days=1)
+        print("\nRestoring auction Ids and status from database... ", end='', flush=True)
+        stored_auctions = database.load('auctions', columns=['Id', 'Status', 'End'],
+                                        where='"End" >= ?' if window_start else None,
+                                        parameters=[window_start] if window_start else ())
+        print(f"{len(stored_auctions):,} characters loaded!", end ='\n')
+    elif auction_store.exists():
+        # Only Id and Status are needed to decide whether an auction must be scraped or updated (End: crawl watermark)
+        print("\nRestoring auction Ids and status from store... ", end='', flush=True)
+        stored_auctions = auction_store.load(columns=['Id', 'Status', 'End'])
+        print(f"{len(stored_auctions):,} characters loaded!", end ='\n')
     else:
         print("\nNo stored results were found.", end='\n')
-        auction_dataframe = pd.DataFrame(columns=dataframe_columns)
+        stored_auctions = pd.DataFrame(columns=['Id', 'Status', 'End'])
+    stored_status = stored_auctions['Status'].copy()
+    auction_index = AuctionIndex(stored_auctions)
+    auction_records = RecordBatch(stored_auctions, columns=dataframe_columns, date_columns=text_date_columns)
+    if not args.no_detail_cache:
+        detail_cache = DetailCache(os.path.join(args.store, cache_filename))
+        print(f"\nDetail cache: {len(detail_cache):,} auction records.")
 
     # Create page output directory
     now = datetime.datetime.now()
     date = '_'.join(map(str, [now.year, now.month, now.day]))
-    page_dir_name = date + '_pages'
+    page_dir_name = args.resume if args.resume else date + '_pages'
     try:
         os.mkdir(page_dir_name)
     except:
@@ -362,12 +686,67 @@ if __name__ == "__main__":
     else:
         print("\nCreated today's page directory.")
 
+    # Restore progress of an interrupted run: completed pages, status updates and collected detail records
+    checkpoint = CrawlCheckpoint(page_dir_name)
+    first_page = 1
+    if args.resume is not None and checkpoint.exists():
+        checkpoint.load()
+        page_records = checkpoint.page_records()
+        auction_records.extend(page_records)
+        auction_index.extend(record['Id'] for record in page_records)
+        for auction_id, status in checkpoint.status_updates.items():
+            if auction_id in auction_index:
+                auction_records.set_value(auction_index.get(auction_id), 'Status', status)
+        skipped_chars = checkpoint.counters.get('skipped_chars', 0)
+        scraped_chars = checkpoint.counters.get('scraped_chars', 0)
+        first_page = checkpoint.next_page()
+        print(f"\nResuming from page {first_page}: {len(page_records):,} scraped auctions restored, "
+              f"{len(checkpoint.partial_records)} detail records reused, "
+              f"{len(checkpoint.in_flight)} interrupted detail fetches to retry.")
+    else:
+        checkpoint.save()
+
+    # Crawl boundary: pages listing only auctions older than the watermark cutoff are not visited
+    if watermark.newest_end is None and not stored_auctions.empty:
+        watermark.update(stored_auctions, ~stored_auctions['Status'].isin(final_status))
+    cutoff = None if args.full_crawl else watermark.cutoff(today)
+    if cutoff is not None:
+        print(f"\nCrawl watermark: newest auction #{watermark.newest_id} ({watermark.newest_end:%b %d %Y, %H:%M}), "
+              f"crawling auctions ended since {cutoff:%b %d %Y, %H:%M}.")
+
     # Scrape bazaar data for every auction
-    auction_dataframe = scrape_tibia_auctions()
-    auction_dataframe = auction_dataframe[~auction_dataframe.duplicated(subset='Id', keep=False)]
+    if args.async_crawl:
+        auction_records = scrape_tibia_auctions_async(max_in_flight=args.in_flight, first_page=first_page,
+                                                      processes=args.processes, cutoff=cutoff)
+    else:
+        auction_records = scrape_tibia_auctions(first_page=first_page, cutoff=cutoff)
+    browser_pool.close()
+    http_client.close()
+    if detail_cache is not None:
+        detail_cache.close()
+    auction_dataframe = auction_records.records_to_dataframe(auction_records.records)
+    # An auction is scraped once per run: repeated Ids can only come from a resumed run (latest record kept)
+    auction_dataframe = auction_dataframe.drop_duplicates(subset='Id', keep='last')
     auction_dataframe = auction_dataframe.reset_index(drop=True)
 
-    # Write scraped data to external files
+    # Store new auctions (new partition files only) and status changes of previously stored auctions
+    status_changed = auction_records.dataframe['Status'].ne(stored_status) & auction_records.dataframe['Status'].notna()
+    if database is not None:
+        with database.transaction():
+            database.upsert('auctions', auction_dataframe)
+            database.update('auctions', auction_records.dataframe.loc[status_changed, ['Id', 'Status']])
+        print(f"\nDatabase updated: {len(auction_dataframe):,} new auctions, {status_changed.sum():,} status updates.")
+    else:
+        auction_store.append(auction_dataframe)
+        auction_store.patch_status(auction_records.dataframe[status_changed])
+        print(f"\nAuction store updated: {len(auction_dataframe):,} new auctions, {status_changed.sum():,} status updates.")
+
+    # Move the watermark forward (stored auctions plus this run's new auctions)
+    watermark_df = pd.concat([auction_records.dataframe[['Id', 'Status', 'End']],
+                              auction_dataframe[['Id', 'Status', 'End']]], ignore_index=True)
+    watermark.update(watermark_df, ~watermark_df['Status'].isin(final_status)).save()
+
+    # Write this run's new auctions to external files
     file_name = 'BAZAAR_' + date
     csv_name = file_name + '.csv'
     wo_best_name = file_name + '_noBestiary.csv'
@@ -377,9 +756,9 @@ if __name__ == "__main__":
     with open(wo_best_name, 'w') as csv_file:
         csv_file.write("sep=,\n")
     auction_dataframe.to_pickle(pkl_name)
-    auction_dataframe.to_pickle(last_scrape_filename)
     auction_dataframe.to_csv(csv_name, index=True, mode='a')
     wo_best_dataframe = auction_dataframe.drop('Bestiary', axis=1)
     wo_best_dataframe.to_csv(wo_best_name, index=True, mode='a')
 
+    metrics.export()
     print(f"\nDone! Results written to {csv_name} and {pkl_name} files.")
@@ -0,0 +1,219 @@
+import os
+import sys
+import io
+import json
+import time
+import platform
+import argparse
+import datetime
+import statistics
+import contextlib
+import subprocess
+import numpy as np
+import pandas as pd
+
+# Micro-benchmarks of the parsing and bookkeeping hot paths, on checked-in html fixtures and synthetic frames
+benchmark_dir = os.path.dirname(os.path.abspath(__file__))
+repo_dir = os.path.dirname(benchmark_dir)
+sys.path.insert(0, repo_dir)
+import synthetic_pages
+from tibia_dates import str_to_datetime, strings_to_datetime64
+from history_parser import parse_history_page
+from detail_parser import parse_detail_page
+from character_parser import parse_character_page
+import bazaar_scraper
+import update_auction_status
+import bazaar_followup_V3
+
+fixture_dir = os.path.join(benchmark_dir, 'fixtures')
+results_dir = os.path.join(benchmark_dir, 'results')
+# Fixed clock of the fixtures and synthetic frames
+fixture_time = datetime.datetime(2020, 10, 16, 12, 0)
+# Minimum measuring time of each repeat, in seconds
+min_repeat_time = 0.2
+repeats = 5
+# Slowdown (fraction of the baseline time per call) above which a benchmark is flagged as a regression
+regression_threshold = 0.10
+
+
+def write_fixtures():
+    """Regenerate the html fixtures from the synthetic page templates"""
+    os.makedirs(fixture_dir, exist_ok=True)
+    base_url = 'https://www.tibia.com'
+    summaries = [synthetic_pages.auction(number, fixture_time - datetime.timedelta(minutes=number))
+                 for number in range(synthetic_pages.auctions_per_page)]
+    pages = {'history_page.html': synthetic_pages.history_page(base_url, summaries, fixture_time, 4321),
+             'detail_page.html': synthetic_pages.detail_page(summaries[0]),
+             'character_page.html': synthetic_pages.character_page(summaries[0], fixture_time)}
+    for file_name, page in pages.items():
+        with open(os.path.join(fixture_dir, file_name), 'w', encoding='utf-8', newline='') as fixture_file:
+            fixture_file.write(page)
+
+
+def read_fixture(file_name):
+    with open(os.path.join(fixture_dir, file_name), 'r', encoding='utf-8') as fixture_file:
+        return fixture_file.read()
+
+
+def followup_frame(rows, seed=0):
+    """Synthetic follow-up dataframe (followup_columns): registered, renamed, deleted and recently checked characters"""
+    rng = np.random.default_rng(seed)
+    names = np.array([synthetic_pages.character_name(number) for number in range(rows)], dtype=object)
+    access_days = rng.integers(0, 30, rows)
+    renamed = rng.random(rows) < 0.05
+    deleted = rng.random(rows) < 0.02
+    return pd.DataFrame({'Id': (synthetic_pages.first_auction_id + np.arange(rows)).astype(str).astype(object),
+                         'Name': names,
+                         'World': rng.choice(synthetic_pages.worlds, rows).astype(object),
+                         'Sex': rng.choice(['M', 'F'], rows).astype(object),
+                         'Vocation': rng.choice(['EK', 'RP', 'ED', 'MS'], rows).astype(object),
+                         'Level': rng.integers(8, 900, rows),
+                         'AccessDate': [fixture_time - datetime.timedelta(days=int(days)) for days in access_days],
+                         'NewName': np.where(renamed, names + ' Renamed', None),
+                         'NewWorld': None, 'NewSex': None, 'NewVocation': None, 'NewLevel': None,
+                         'LastLogin': None, 'AccountStatus': None, 'NewId': None, 'Scheduled': None,
+                         'Deleted': np.where(deleted, True, None)})[list(bazaar_followup_V3.followup_columns)]
+
+
+def auctions_frame(rows, first_number):
+    """Synthetic won auctions (as loaded by the follow-up), numbered from first_number"""
+    summaries = [synthetic_pages.auction(number, fixture_time) for number in range(first_number, first_number + rows)]
+    auctions = pd.DataFrame(summaries)
+    auctions['Vocation'] = [''.join(word[0] for word in vocation.split()) for vocation in auctions['Vocation']]
+    auctions['Sex'] = auctions['Sex'].str[0]
+    return auctions
+
+
+def time_call(function):
+    """Seconds per call: best and median of the repeats, each one running for at least min_repeat_time"""
+    calls = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(calls):
+            function()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_repeat_time:
+            break
+        calls = max(calls * 2, int(calls * min_repeat_time / max(elapsed, 1e-9)))
+    samples = [elapsed / calls]
+    for _ in range(repeats - 1):
+        start = time.perf_counter()
+        for _ in range(calls):
+            function()
+        samples.append((time.perf_counter() - start) / calls)
+    return {'best': min(samples), 'median': statistics.median(samples), 'calls': calls}
+
+
+def benchmarks(sizes):
+    """(name, function) of every benchmark: html fixtures first, then synthetic frames of each size"""
+    history_text = read_fixture('history_page.html')
+    detail_text = read_fixture('detail_page.html')
+    character_text = read_fixture('character_page.html')
+    summaries = parse_history_page(history_text)
+    # Won auction: the full status path of get_auction_status
+    summary = next(auction for auction in summaries if auction['Type'] == 'W')
+    detail_sections = parse_detail_page(detail_text)
+
+    page_dates = [summary['End'].strftime('%b %d %Y, %H:%M CEST') for summary in summaries] * 2
+    cases = [('str_to_datetime', lambda: str_to_datetime('Aug 14 2020, 10:00 CEST')),
+             ('strings_to_datetime64[page]', lambda: strings_to_datetime64(page_dates)),
+             ('parse_history_page', lambda: parse_history_page(history_text)),
+             ('get_summary_data', lambda: bazaar_scraper.get_summary_data(summary, 1)),
+             ('parse_detail_page', lambda: parse_detail_page(detail_text)),
+             ('get_character_data', lambda: bazaar_scraper.get_character_data(dict(summary), (200, parse_detail_page(detail_text)))),
+             ('get_bank_data', lambda: bazaar_scraper.get_bank_data(detail_sections['Bank'])),
+             ('get_auction_status', lambda: update_auction_status.get_auction_status(summary)),
+             ('parse_character_page', lambda: parse_character_page(character_text)),
+             ('get_character_info', lambda: bazaar_followup_V3.get_character_info(summary['Name'], fetched_page=(200, parse_character_page(character_text))))]
+
+    for size in sizes:
+        followup_df = followup_frame(size)
+        new_auctions = auctions_frame(min(1000, size), size)
+        new_auction = new_auctions.iloc[0]
+        row = size // 2
+        cases += [(f'incorporate_auction[{size}]', lambda df=followup_df, auction=new_auction: bazaar_followup_V3.incorporate_auction(auction, df)),
+                  (f'update_row[{size}]', lambda df=followup_df, row=row: bazaar_followup_V3.update_row(df, row, NewName='Renamed', NewWorld='Antica', NewLevel=100, LastLogin=fixture_time, AccessDate=fixture_time)),
+                  (f'names_to_check[{size}]', lambda df=followup_df, auctions=new_auctions: bazaar_followup_V3.names_to_check(df, auctions))]
+    return cases
+
+
+def run(sizes, selected=None):
+    """Time every benchmark (console output of the benchmarked functions is muted)"""
+    bazaar_followup_V3.today = fixture_time
+    results = {}
+    for name, function in benchmarks(sizes):
+        if selected and not any(pattern in name for pattern in selected):
+            continue
+        print(f'{name:<32}', end='', flush=True)
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                results[name] = time_call(function)
+        except Exception as error:
+            results[name] = {'error': f'{type(error).__name__}: {error}'}
+            print(f"ERROR ({results[name]['error']})")
+            continue
+        print(f"{results[name]['best'] * 1e6:>14,.1f} us/call  ({results[name]['calls']:,} calls per repeat)")
+    return results
+
+
+def compare(results, baseline, threshold=regression_threshold):
+    """Benchmarks slower than the baseline by more than threshold: [(name, baseline_seconds, seconds, change)]"""
+    regressions = []
+    for name, result in results.items():
+        reference = baseline.get(name)
+        if not reference or 'best' not in reference or 'best' not in result:
+            continue
+        change = result['best'] / reference['best'] - 1
+        if change > threshold:
+            regressions.append((name, reference['best'], result['best'], change))
+    return regressions
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=repo_dir, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Micro-benchmarks of the parsing and bookkeeping hot paths')
+    parser.add_argument('--sizes', default='10000,100000,1000000', help='comma separated synthetic frame sizes')
+    parser.add_argument('--only', default=None, help='comma separated benchmark name filters')
+    parser.add_argument('--output', default=None, metavar='FILE',
+                        help='results file (default: benchmarks/results/<git revision>.json)')
+    parser.add_argument('--compare', default=None, metavar='BASELINE',
+                        help='results file of a previous run: slower benchmarks are flagged as regressions')
+    parser.add_argument('--threshold', type=float, default=regression_threshold,
+                        help='slowdown fraction above which a benchmark is flagged (default: 0.10)')
+    parser.add_argument('--write-fixtures', action='store_true', help='regenerate the html fixtures and exit')
+    args = parser.parse_args()
+
+    if args.write_fixtures:
+        write_fixtures()
+        print(f'Fixtures written to {fixture_dir}')
+        sys.exit(0)
+
+    sizes = [int(size) for size in args.sizes.split(',') if size]
+    revision = git_revision()
+    results = run(sizes, args.only.split(',') if args.only else None)
+
+    output = args.output if args.output else os.path.join(results_dir, revision + '.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as json_file:
+        json.dump({'revision': revision, 'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+                   'python': platform.python_version(), 'pandas': pd.__version__, 'sizes': sizes,
+                   'results': results}, json_file, indent=1)
+    print(f'\nResults written to {output}')
+
+    if args.compare:
+        with open(args.compare, 'r') as json_file:
+            baseline = json.load(json_file)
+        regressions = compare(results, baseline['results'], args.threshold)
+        print(f"\nCompared with {baseline['revision']} (threshold: +{args.threshold:.0%}):")
+        for name, reference, seconds, change in regressions:
+            print(f'\tREGRESSION {name:<32} {reference * 1e6:>12,.1f} -> {seconds * 1e6:>12,.1f} us/call ({change:+.0%})')
+        if not regressions:
+            print('\tno regressions.')
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,185 @@
+import os
+import sys
+import math
+import random
+import asyncio
+import argparse
+import datetime
+import collections
+from aiohttp import web
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import synthetic_pages
+from html_archive import HtmlArchive
+
+# Local stand-in for Tibia.com and TibiaRing: synthetic (or archived) pages served with configurable latency, error
+# rates and page drift. Point the scripts at it with:  TIBIA_URL=http://127.0.0.1:8800 TIBIARING_URL=http://127.0.0.1:8800
+live_tibia_url = 'https://www.tibia.com'
+live_tibiaring_url = 'http://www.tibiaring.com'
+
+
+class StandInServer:
+    """aiohttp application serving history, auction detail, character and TibiaRing pages"""
+
+    def __init__(self, pages=200, spacing=40, drift=0, latency=0.05, error_403=0, error_5xx=0, renamed=0.05,
+                 deleted=0.02, throttle=None, archive_path=None, seed=None):
+        # pages:     number of history pages at start-up (25 auctions each)
+        # spacing:   seconds between the End dates of two consecutive auctions
+        # drift:     new finished auctions per minute (pushes every auction down the history pages while crawling)
+        # latency:   median response time, in seconds (log-normal)
+        # error_403: fraction of requests answered with 403 Forbidden (throttling)
+        # error_5xx: fraction of requests answered with 503 Service Unavailable
+        # renamed:   fraction of characters that are only found through TibiaRing under a new name
+        # deleted:   fraction of deleted characters
+        # throttle:  requests per second (over the last second) above which every request is answered with 403
+        self.initial_count = pages * synthetic_pages.auctions_per_page
+        self.spacing = spacing
+        self.drift = drift
+        self.latency = latency
+        self.error_403 = error_403
+        self.error_5xx = error_5xx
+        self.renamed = renamed
+        self.deleted = deleted
+        self.throttle = throttle
+        self.recent_requests = collections.deque()
+        self.archive = HtmlArchive(archive_path) if archive_path else None
+        self.random = random.Random(seed)
+        self.start_time = datetime.datetime.now().replace(second=0, microsecond=0)
+        self.start_clock = None
+        self.served = 0
+
+    def application(self):
+        app = web.Application(middlewares=[self.conditions])
+        app.router.add_get('/charactertrade/', self.trade_handler)
+        app.router.add_get('/community/', self.character_handler)
+        app.router.add_get('/char.php', self.tibiaring_handler)
+        app.on_startup.append(self.on_startup)
+        return app
+
+    async def on_startup(self, app):
+        self.start_clock = asyncio.get_running_loop().time()
+
+    def auction_count(self):
+        """Number of finished auctions (grows with drift)"""
+        elapsed = asyncio.get_running_loop().time() - self.start_clock
+        return self.initial_count + int(self.drift * elapsed / 60)
+
+    def auction_end(self, number):
+        # The newest auction at start-up ends at start_time, later ones arrive at the drift rate
+        if number < self.initial_count:
+            return self.start_time - datetime.timedelta(seconds=(self.initial_count - 1 - number) * self.spacing)
+        return self.start_time + datetime.timedelta(seconds=(number - self.initial_count + 1) * 60 / self.drift)
+
+    def summary(self, number):
+        return synthetic_pages.auction(number, self.auction_end(number))
+
+    def fate(self, number):
+        """'deleted', 'renamed' or None, fixed for each character"""
+        roll = random.Random(f'fate-{number}').random()
+        if roll < self.deleted:
+            return 'deleted'
+        if roll < self.deleted + self.renamed:
+            return 'renamed'
+        return None
+
+    @web.middleware
+    async def conditions(self, request, handler):
+        # Response time and injected errors
+        self.served += 1
+        if self.throttle:
+            # Rate-based blocking, as done by Tibia.com
+            now = asyncio.get_running_loop().time()
+            self.recent_requests.append(now)
+            while self.recent_requests[0] < now - 1:
+                self.recent_requests.popleft()
+            if len(self.recent_requests) > self.throttle:
+                return web.Response(status=403, text='Forbidden')
+        if self.latency > 0:
+            await asyncio.sleep(self.latency * math.exp(self.random.gauss(0, 0.5)))
+        roll = self.random.random()
+        if roll < self.error_403:
+            return web.Response(status=403, text='Forbidden')
+        if roll < self.error_403 + self.error_5xx:
+            return web.Response(status=503, text='Service Unavailable')
+        if self.archive is not None:
+            return self.archived_response(request)
+        return await handler(request)
+
+    def archived_response(self, request):
+        # Recorded mode: serve the latest archived copy of the live url, with links rewritten to the stand-in
+        live_url = (live_tibiaring_url if request.path == '/char.php' else live_tibia_url) + request.path_qs
+        text = self.archive.get(live_url)
+        if text is None:
+            return web.Response(status=404, text='Not archived')
+        base_url = f'{request.scheme}://{request.host}'
+        text = text.replace(live_tibia_url, base_url).replace(live_tibiaring_url, base_url)
+        return web.Response(text=text, content_type='text/html')
+
+    async def trade_handler(self, request):
+        base_url = f'{request.scheme}://{request.host}'
+        now = datetime.datetime.now()
+        total = self.auction_count()
+        if request.query.get('page') == 'details':
+            number = int(request.query.get('auctionid', 0)) - synthetic_pages.first_auction_id
+            if not 0 <= number < total:
+                return web.Response(status=404, text='Auction not found')
+            return web.Response(text=synthetic_pages.detail_page(self.summary(number)), content_type='text/html')
+
+        page_count = math.ceil(total / synthetic_pages.auctions_per_page)
+        page_number = int(request.query.get('currentpage', 1))
+        newest = total - 1 - (page_number - 1) * synthetic_pages.auctions_per_page
+        numbers = range(newest, max(newest - synthetic_pages.auctions_per_page, -1), -1)
+        summaries = [self.summary(number) for number in numbers]
+        return web.Response(text=synthetic_pages.history_page(base_url, summaries, now, page_count),
+                            content_type='text/html')
+
+    async def character_handler(self, request):
+        name = request.query.get('name', '')
+        renamed = name.endswith(' Renamed')
+        number = synthetic_pages.auction_number(name[:-len(' Renamed')] if renamed else name)
+        if number is None or number >= self.auction_count():
+            return web.Response(text=synthetic_pages.missing_character_page(), content_type='text/html')
+        fate = self.fate(number)
+        if fate == 'deleted' or (fate == 'renamed') != renamed:
+            return web.Response(text=synthetic_pages.missing_character_page(), content_type='text/html')
+        deletion = datetime.datetime.now() + datetime.timedelta(days=30) if number % 97 == 0 else None
+        page = synthetic_pages.character_page(self.summary(number), datetime.datetime.now(), name=name, deletion=deletion)
+        return web.Response(text=page, content_type='text/html')
+
+    async def tibiaring_handler(self, request):
+        name = request.query.get('c', '')
+        number = synthetic_pages.auction_number(name)
+        fate = self.fate(number) if number is not None else None
+        if fate == 'deleted':
+            new_name = ''
+        elif fate == 'renamed':
+            new_name = name + ' Renamed'
+        else:
+            new_name = None
+        return web.Response(text=synthetic_pages.tibiaring_page(new_name), content_type='text/html')
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Local Tibia.com / TibiaRing stand-in server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8800)
+    parser.add_argument('--pages', type=int, default=200, help='number of history pages at start-up')
+    parser.add_argument('--spacing', type=float, default=40, help='seconds between the End dates of two auctions')
+    parser.add_argument('--drift', type=float, default=0, help='new finished auctions per minute')
+    parser.add_argument('--latency', type=float, default=0.05, help='median response time, in seconds')
+    parser.add_argument('--error-403', type=float, default=0, help='fraction of 403 responses')
+    parser.add_argument('--error-5xx', type=float, default=0, help='fraction of 503 responses')
+    parser.add_argument('--renamed', type=float, default=0.05, help='fraction of renamed characters')
+    parser.add_argument('--deleted', type=float, default=0.02, help='fraction of deleted characters')
+    parser.add_argument('--throttle', type=float, default=None, help='requests/s above which requests get 403')
+    parser.add_argument('--archive', default=None, metavar='ARCHIVE_DIR',
+                        help='serve pages recorded with --archive instead of synthetic pages')
+    parser.add_argument('--seed', type=int, default=None, help='seed of the latency and error draws')
+    args = parser.parse_args()
+
+    server = StandInServer(pages=args.pages, spacing=args.spacing, drift=args.drift, latency=args.latency,
+                           error_403=args.error_403, error_5xx=args.error_5xx, renamed=args.renamed,
+                           deleted=args.deleted, throttle=args.throttle, archive_path=args.archive, seed=args.seed)
+    print(f'Stand-in server on http://{args.host}:{args.port} ({server.initial_count:,} auctions)', flush=True)
+    web.run_app(server.application(), host=args.host, port=args.port, print=None)
@@ -0,0 +1,144 @@
+import random
+import datetime
+
+# Synthetic Tibia.com / TibiaRing pages, laid out like the real ones (only the parts read by the parsers)
+vocations = ['None', 'Knight', 'Elite Knight', 'Paladin', 'Royal Paladin', 'Druid', 'Elder Druid', 'Sorcerer', 'Master Sorcerer']
+worlds = ['Antica', 'Belobra', 'Celesta', 'Damora', 'Epoca', 'Gladera', 'Inabra', 'Menera', 'Pacera', 'Secura']
+skills = ['Axe Fighting', 'Club Fighting', 'Distance Fighting', 'Fishing', 'Fist Fighting', 'Magic Level', 'Shielding',
+          'Sword Fighting']
+creatures = ['Rat', 'Cave Rat', 'Troll', 'Orc', 'Minotaur', 'Dragon', 'Dragon Lord', 'Demon', 'Hydra', 'Giant Spider',
+             'Amazon', 'Valkyrie', 'Cyclops', 'Wasp', 'Bog Raider', 'Hero', 'Nightmare', 'Grim Reaper']
+months = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
+first_auction_id = 100000
+auctions_per_page = 25
+
+
+def tibia_date(date, seconds=False):
+    """Date as displayed on Tibia.com: 'Aug&#160;14&#160;2020,&#160;10:00&#160;CEST'"""
+    clock = date.strftime('%H:%M:%S' if seconds else '%H:%M')
+    return f'{months[date.month - 1]}&#160;{date.day:02d}&#160;{date.year},&#160;{clock}&#160;CEST'
+
+
+def character_name(auction_number):
+    """Unique character name of an auction (bijective base-26 letters, so it can be decoded)"""
+    letters = ''
+    number = auction_number + 1
+    while number > 0:
+        number, remainder = divmod(number - 1, 26)
+        letters = chr(ord('a') + remainder) + letters
+    return 'Bench ' + letters.capitalize()
+
+
+def auction_number(name):
+    """Auction number of a character name (None if the name was not generated by character_name)"""
+    if not name.startswith('Bench '):
+        return None
+    number = 0
+    for letter in name[len('Bench '):].lower():
+        if not 'a' <= letter <= 'z':
+            return None
+        number = number * 26 + ord(letter) - ord('a') + 1
+    return number - 1
+
+
+def auction(number, end):
+    """Summary of a synthetic auction: deterministic for a given auction number"""
+    rng = random.Random(number)
+    start = end - datetime.timedelta(days=rng.choice([1, 2, 3, 5, 7]))
+    return dict(Id=str(first_auction_id + number), Name=character_name(number), Level=rng.randint(8, 900),
+                Vocation=rng.choice(vocations), World=rng.choice(worlds), Sex=rng.choice(['Male', 'Female']),
+                Type=rng.choices(['W', 'M'], weights=[7, 3])[0], Bid=rng.randint(57, 250000), Start=start, End=end)
+
+
+def auction_status(summary, now):
+    """Status box text: auctions are processed during the day after they end"""
+    if summary['Type'] == 'M':
+        return 'finished'
+    if (now - summary['End']).days < 1:
+        return 'currently processed'
+    return 'cancelled' if int(summary['Id']) % 50 == 0 else 'finished'
+
+
+def history_page(base_url, summaries, now, page_count):
+    """'pastcharactertrades' page listing the given auction summaries"""
+    trade_url = base_url + '/charactertrade/?subtopic=pastcharactertrades'
+    blocks = []
+    for summary in summaries:
+        bid_label = 'Winning Bid:' if summary['Type'] == 'W' else 'Minimum Bid:'
+        blocks.append(
+            f'<div class="Auction">'
+            f'<div class="AuctionHeader"><div class="AuctionCharacterName">'
+            f'<a href="{trade_url}&page=details&auctionid={summary["Id"]}&source=overview">{summary["Name"]}</a></div>'
+            f'Level: {summary["Level"]} | Vocation: {summary["Vocation"]} | {summary["Sex"]} | '
+            f'World: <a href="{base_url}/community/?subtopic=worlds&world={summary["World"]}">{summary["World"]}</a><br></div>'
+            f'<table class="ShortAuctionData">'
+            f'<tr><td><div class="ShortAuctionDataLabel">Auction Start:</div>'
+            f'<div class="ShortAuctionDataValue">{tibia_date(summary["Start"])}</div></td></tr>'
+            f'<tr><td><div class="ShortAuctionDataLabel">Auction End:</div>'
+            f'<div class="ShortAuctionDataValue">{tibia_date(summary["End"])}</div></td></tr>'
+            f'<tr><td><div class="ShortAuctionDataBidRow"><div class="ShortAuctionDataLabel">{bid_label}</div>'
+            f'<div class="ShortAuctionDataValue"><b>{summary["Bid"]:,}</b></div></div></td></tr></table>'
+            f'<div class="CurrentBid"><div class="Container"><div class="AuctionInfo">{auction_status(summary, now)}'
+            f'</div></div></div></div>')
+    page_links = (f'<span class="PageLink"><a href="{trade_url}&currentpage=1">First Page</a></span>'
+                  f'<span class="PageLink"><a href="{trade_url}&currentpage={page_count}">Last Page</a></span>')
+    return f'<html><body><div class="TableContainer">{"".join(blocks)}</div>{page_links}</body></html>'
+
+
+def detail_page(summary):
+    """Auction detail page: skills, bank data and bestiary"""
+    rng = random.Random(summary['Id'])
+    skill_rows = ''.join(f'<tr><td class="LabelColumn"><b>{skill}</b></td><td class="LevelColumn">{rng.randint(10, 130)}</td>'
+                         f'<td class="PercentageColumn"><div class="PercentageString">{rng.random() * 100:.2f} %</div></td></tr>'
+                         for skill in skills)
+    creation = summary['Start'] - datetime.timedelta(days=rng.randint(30, 5000))
+    bestiary_rows = ''.join(f'<tr><td>{rng.randint(0, 4)}</td><td>{rng.randint(1, 50000):,}x</td><td>{creature}</td></tr>'
+                            for creature in rng.sample(creatures, rng.randint(0, len(creatures))))
+    return (f'<html><body>'
+            f'<div id="General"><div class="TableContainer"><div class="InnerTableContainer"><table style="width:100%;">'
+            f'<tr><td><table><tr>'
+            f'<td><table><tr><td class="LabelColumn"><b>Hit Points:</b></td><td>{rng.randint(185, 9000):,}</td></tr></table></td>'
+            f'<td><table>{skill_rows}</table></td>'
+            f'</tr></table></td></tr>'
+            f'<tr><td><table><tr>'
+            f'<td><span class="LabelV">Creation Date:</span><div>{tibia_date(creation)}</div></td>'
+            f'<td><span class="LabelV">Experience:</span><div>{rng.randint(0, 10 ** 10):,}</div></td>'
+            f'<td><span class="LabelV">Gold:</span><div>{rng.randint(0, 10 ** 7):,}</div></td>'
+            f'<td><span class="LabelV">Achievement Points:</span><div>{rng.randint(0, 1200)}</div></td>'
+            f'</tr></table></td></tr>'
+            f'</table></div></div></div>'
+            f'<div id="BestiaryProgress"><div class="TableContent"><table class="TableContent">'
+            f'<tr><td>Step</td><td>Kills</td><td>Name</td></tr>{bestiary_rows}'
+            f'</table></div></div>'
+            f'</body></html>')
+
+
+def character_page(summary, now, name=None, deletion=None):
+    """Tibia.com character page ('Character Information' table)"""
+    rng = random.Random(summary['Name'])
+    name = name if name else summary['Name']
+    if deletion is not None:
+        name += f', will be deleted at {tibia_date(deletion, seconds=True)}'
+    last_login = now - datetime.timedelta(minutes=rng.randint(1, 60 * 24 * 90))
+    rows = [('Name:', name + ' (traded)'), ('Sex:', summary['Sex'].lower()), ('Vocation:', summary['Vocation']),
+            ('Level:', str(summary['Level'] + rng.randint(0, 20))), ('World:', summary['World']),
+            ('Last Login:', tibia_date(last_login, seconds=True)),
+            ('Account&#160;Status:', rng.choice(['Premium Account', 'Free Account']))]
+    table_rows = ''.join(f'<tr><td>{label}</td><td>{value}</td></tr>' for label, value in rows)
+    return (f'<html><body><table><tr><td><b>Character Information</b></td></tr>{table_rows}</table>'
+            f'<table><tr><td>Account Information</td></tr></table></body></html>')
+
+
+def missing_character_page():
+    """Tibia.com character search page for a name that does not exist"""
+    return ('<html><body><table><tr><td><b>Could not find character</b></td></tr></table>'
+            '<table><tr><td>Search Character</td></tr></table></body></html>')
+
+
+def tibiaring_page(new_name):
+    """TibiaRing character page ('' for deleted characters)"""
+    if new_name is None:
+        return '<html><body><div class="Error">Character not found</div></body></html>'
+    if new_name == '':
+        return ''
+    return f'<html><body><div class="CSC">{new_name}</div></body></html>'
@@ -0,0 +1,184 @@
+import os
+import sys
+import io
+import json
+import time
+import socket
+import argparse
+import tempfile
+import contextlib
+import subprocess
+
+# End-to-end throughput of the scraper, the status updater and the follow-up against the local stand-in server
+benchmark_dir = os.path.dirname(os.path.abspath(__file__))
+repo_dir = os.path.dirname(benchmark_dir)
+sys.path.insert(0, repo_dir)
+module_names = ['scraper', 'scraper-async', 'updater', 'followup']
+
+
+def free_port():
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        return probe.getsockname()[1]
+
+
+def start_server(port, server_args):
+    """Launch the stand-in server on a separate process and wait until it accepts connections"""
+    server = subprocess.Popen([sys.executable, os.path.join(benchmark_dir, 'standin_server.py'), '--port', str(port)]
+                              + server_args, stdout=subprocess.DEVNULL)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return server
+        except OSError:
+            time.sleep(0.1)
+    server.kill()
+    raise RuntimeError('Stand-in server did not start')
+
+
+class LatencyRecorder:
+    """Collect (url, status_code, latency) of every request reported to the shared rate limiter"""
+
+    def __init__(self, limiter):
+        self.limiter = limiter
+        self.requests = []
+        self._record = limiter.record
+
+    def __enter__(self):
+        def record(url, status, latency, retry_after=None):
+            self.requests.append((url, status, latency))
+            self._record(url, status, latency, retry_after)
+        self.limiter.record = record
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.limiter.record = self._record
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def run_scraper(work_dir, use_async, processes=None):
+    """Full crawl of the stand-in history: (history pages, new auction records)"""
+    import bazaar_scraper
+    from record_batch import RecordBatch
+    from auction_index import AuctionIndex
+
+    bazaar_scraper.page_dir_name = work_dir
+    bazaar_scraper.auction_records = RecordBatch(columns=bazaar_scraper.dataframe_columns)
+    bazaar_scraper.auction_index = AuctionIndex()
+    bazaar_scraper.skipped_chars = bazaar_scraper.scraped_chars = 0
+    if use_async:
+        records = bazaar_scraper.scrape_tibia_auctions_async(first_page=1, processes=processes)
+    else:
+        records = bazaar_scraper.scrape_tibia_auctions(first_page=1)
+    return len(records.records), [record['Name'] for record in records.records]
+
+
+def run_updater():
+    import pandas as pd
+    import update_auction_status
+    status_df = update_auction_status.update_auction_status(pd.DataFrame(columns=update_auction_status.dataframe_columns))
+    return len(status_df)
+
+
+def run_followup(names):
+    import bazaar_followup_V3
+    from fetch_pipeline import FetchParsePipeline, close_parse_pool
+    from character_parser import parse_character_page
+    with FetchParsePipeline(parse_character_page, headers=bazaar_followup_V3.character_headers,
+                            fetchers=bazaar_followup_V3.character_fetchers) as character_pipeline:
+        collected = bazaar_followup_V3.collect_character_info(names, character_pipeline)
+    close_parse_pool()
+    return len(collected)
+
+
+def measure(module_name, run, limiter):
+    """Run a module with its console output muted and summarize throughput and request latency"""
+    with LatencyRecorder(limiter) as recorder, contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        items = run()
+        elapsed = time.perf_counter() - start
+    latencies = [latency for _, status, latency in recorder.requests]
+    history_pages = sum('currentpage=' in url for url, _, _ in recorder.requests)
+    errors = sum(status != 200 for _, status, _ in recorder.requests)
+    return {'module': module_name, 'seconds': round(elapsed, 3), 'requests': len(recorder.requests),
+            'errors': errors, 'history_pages': history_pages, 'items': items,
+            'requests_per_s': round(len(recorder.requests) / elapsed, 2),
+            'pages_per_s': round(history_pages / elapsed, 2), 'items_per_s': round(items / elapsed, 2),
+            'latency_p50': percentile(latencies, 0.5), 'latency_p95': percentile(latencies, 0.95),
+            'latency_p99': percentile(latencies, 0.99), 'latency_max': max(latencies) if latencies else None}
+
+
+def print_report(results):
+    print(f"\n{'module':<14}{'seconds':>9}{'requests':>10}{'errors':>8}{'pages/s':>9}{'items/s':>9}"
+          f"{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'max ms':>9}")
+    for result in results:
+        latencies = [result[key] * 1000 if result[key] is not None else float('nan')
+                     for key in ('latency_p50', 'latency_p95', 'latency_p99', 'latency_max')]
+        print(f"{result['module']:<14}{result['seconds']:>9.1f}{result['requests']:>10,}{result['errors']:>8,}"
+              f"{result['pages_per_s']:>9.1f}{result['items_per_s']:>9.1f}" + ''.join(f'{value:>9.0f}' for value in latencies))
+    print("\nitems: new auctions (scraper), auction status rows (updater), character lookups (followup)")
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='End-to-end throughput benchmark against the local stand-in server')
+    parser.add_argument('--modules', default=','.join(module_names), help='comma separated: ' + ', '.join(module_names))
+    parser.add_argument('--pages', type=int, default=40, help='number of history pages served')
+    parser.add_argument('--latency', type=float, default=0.05, help='median response time of the server, in seconds')
+    parser.add_argument('--error-403', type=float, default=0, help='fraction of 403 responses')
+    parser.add_argument('--error-5xx', type=float, default=0, help='fraction of 503 responses')
+    parser.add_argument('--throttle', type=float, default=None, help='server-side limit (requests/s) above which it answers 403')
+    parser.add_argument('--drift', type=float, default=0, help='new finished auctions per minute')
+    parser.add_argument('--rate', type=float, default=20, help='initial request rate (requests/s)')
+    parser.add_argument('--max-rate', type=float, default=200, help='maximum request rate (requests/s)')
+    parser.add_argument('--processes', type=int, default=None, help='parser processes (asyncio crawl mode)')
+    parser.add_argument('--names', type=int, default=500, help='number of character lookups (followup)')
+    parser.add_argument('--json', default=None, metavar='FILE', help='write the results to a JSON file')
+    args = parser.parse_args()
+
+    port = free_port()
+    server = start_server(port, ['--pages', str(args.pages), '--latency', str(args.latency),
+                                 '--error-403', str(args.error_403), '--error-5xx', str(args.error_5xx),
+                                 '--drift', str(args.drift)] + (['--throttle', str(args.throttle)] if args.throttle else []))
+    # Base urls are read when the modules are imported
+    os.environ['TIBIA_URL'] = os.environ['TIBIARING_URL'] = f'http://127.0.0.1:{port}'
+    import http_client
+    http_client.limiter.configure('127.0.0.1', rate=args.rate, highest_rate=args.max_rate)
+
+    results = []
+    scraped_names = []
+    try:
+        with tempfile.TemporaryDirectory() as work_dir:
+            for module_name in args.modules.split(','):
+                print(f'Running {module_name}...', flush=True)
+                if module_name in ('scraper', 'scraper-async'):
+                    def run():
+                        auction_count, names = run_scraper(work_dir, module_name == 'scraper-async', args.processes)
+                        scraped_names[:] = names
+                        return auction_count
+                elif module_name == 'updater':
+                    run = run_updater
+                elif module_name == 'followup':
+                    def run():
+                        import synthetic_pages
+                        names = scraped_names or [synthetic_pages.character_name(number) for number in range(args.names)]
+                        return run_followup(names[:args.names])
+                else:
+                    raise ValueError(f'Unknown module: {module_name}')
+                results.append(measure(module_name, run, http_client.limiter))
+    finally:
+        server.terminate()
+        server.wait()
+        http_client.close()
+
+    print_report(results)
+    if args.json:
+        with open(args.json, 'w') as json_file:
+            json.dump({'settings': vars(args), 'results': results}, json_file, indent=1)
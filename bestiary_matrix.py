@@ -0,0 +1,114 @@
+import sys
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+creature_library_filename = 'creature_library.pkl'
+_library_creatures = None
+
+
+def library_creatures(library_filename=creature_library_filename):
+    """Creature names from the creature library, in library order (column order of every bestiary matrix)"""
+    global _library_creatures
+
+    if _library_creatures is None:
+        creature_library = pd.read_pickle(library_filename)
+        _library_creatures = [sys.intern(name) for name in creature_library['Creature']]
+    return _library_creatures
+
+
+class BestiaryMatrix:
+    """Sparse auction x creature kill matrix (CSR): rows follow auction_ids, columns follow creatures"""
+
+    def __init__(self, matrix, auction_ids, creatures):
+        # matrix:      scipy.sparse.csr_matrix of kill counts, shape (len(auction_ids), len(creatures))
+        # auction_ids: numpy array of auction Ids (str)
+        # creatures:   list of interned creature names: creature library first, unknown creatures appended
+        self.matrix = matrix
+        self.auction_ids = np.asarray(auction_ids, dtype=object)
+        self.creatures = creatures
+        self._row_index = None
+
+    def __len__(self):
+        return len(self.auction_ids)
+
+    @classmethod
+    def from_dicts(cls, auction_ids, bestiary_dicts, creatures=None):
+        """Build the matrix from per-auction {creature_name: kills} dictionaries"""
+        creatures = list(creatures) if creatures is not None else list(library_creatures())
+        creature_ids = {name: creature_id for creature_id, name in enumerate(creatures)}
+
+        indptr = [0]
+        indices = []
+        kills = []
+        for bestiary_dict in bestiary_dicts:
+            if isinstance(bestiary_dict, dict):
+                for creature_name, creature_kills in bestiary_dict.items():
+                    creature_id = creature_ids.get(creature_name)
+                    if creature_id is None:
+                        creature_id = len(creatures)
+                        creature_ids[creature_name] = creature_id
+                        creatures.append(sys.intern(creature_name))
+                    indices.append(creature_id)
+                    kills.append(creature_kills)
+            indptr.append(len(indices))
+
+        matrix = sparse.csr_matrix((np.array(kills, dtype=np.int64), np.array(indices, dtype=np.int32),
+                                    np.array(indptr, dtype=np.int64)), shape=(len(indptr) - 1, len(creatures)))
+        return cls(matrix, list(auction_ids), creatures)
+
+    @classmethod
+    def concat(cls, matrices):
+        """Stack several matrices, aligning their creature columns"""
+        creatures = list(library_creatures())
+        creature_ids = {name: creature_id for creature_id, name in enumerate(creatures)}
+        aligned = []
+        auction_ids = []
+        for bestiary in matrices:
+            for name in bestiary.creatures:
+                if name not in creature_ids:
+                    creature_ids[name] = len(creatures)
+                    creatures.append(name)
+            column_map = np.array([creature_ids[name] for name in bestiary.creatures], dtype=np.int32)
+            coo = bestiary.matrix.tocoo()
+            aligned.append((coo.data, coo.row, column_map[coo.col], len(bestiary)))
+            auction_ids.extend(bestiary.auction_ids)
+
+        blocks = [sparse.csr_matrix((data, (row, col)), shape=(row_count, len(creatures)))
+                  for data, row, col, row_count in aligned]
+        matrix = sparse.vstack(blocks, format='csr') if blocks else sparse.csr_matrix((0, len(creatures)), dtype=np.int64)
+        return cls(matrix, auction_ids, creatures)
+
+    def save(self, filename):
+        """Write the matrix to a compressed .npz file"""
+        np.savez_compressed(filename, data=self.matrix.data, indices=self.matrix.indices, indptr=self.matrix.indptr,
+                            shape=np.array(self.matrix.shape), auction_ids=self.auction_ids.astype(str),
+                            creatures=np.array(self.creatures, dtype=str))
+
+    @classmethod
+    def load(cls, filename):
+        """Read a matrix written by save()"""
+        with np.load(filename) as npz:
+            matrix = sparse.csr_matrix((npz['data'], npz['indices'], npz['indptr']), shape=tuple(npz['shape']))
+            auction_ids = list(npz['auction_ids'])
+            creatures = [sys.intern(str(name)) for name in npz['creatures']]
+        return cls(matrix, [str(auction_id) for auction_id in auction_ids], creatures)
+
+    def select(self, auction_ids):
+        """Rows of the given auctions (auctions without a bestiary entry are left out; Ids may be str or int)"""
+        if self._row_index is None:
+            self._row_index = {auction_id: row for row, auction_id in enumerate(self.auction_ids)}
+        rows = [self._row_index[auction_id] for auction_id in map(str, auction_ids) if auction_id in self._row_index]
+        return BestiaryMatrix(self.matrix[rows], self.auction_ids[rows], self.creatures)
+
+    def kills(self):
+        """Total kills per creature (vectorized column sums), sorted in descending order"""
+        totals = np.asarray(self.matrix.sum(axis=0)).ravel()
+        return pd.Series(totals, index=self.creatures).sort_values(ascending=False)
+
+    def to_dicts(self):
+        """Per-auction {creature_name: kills} dictionaries, in row order"""
+        indptr = self.matrix.indptr
+        return [{self.creatures[col]: int(kills) for col, kills in zip(self.matrix.indices[indptr[row]:indptr[row + 1]],
+                                                                       self.matrix.data[indptr[row]:indptr[row + 1]])}
+                for row in range(len(self))]
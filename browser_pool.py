@@ -0,0 +1,169 @@
+import asyncio
+import threading
+import contextlib
+import concurrent.futures
+import pyppeteer
+
+
+class BrowserPool:
+    """Long-lived pool of headless browser tabs (N tabs across M browser processes) fed through a job queue"""
+
+    def __init__(self, browsers=1, tabs=4, max_page_uses=50, timeout=30, render_timeout=120, user_agent=None):
+        # browsers:       number of Chromium processes (a crashed or closed browser is relaunched by its next tab)
+        # tabs:           number of tabs (pages) opened on each browser
+        # max_page_uses:  number of renders after which a tab is closed and replaced by a fresh one (bounds memory)
+        # timeout:        navigation timeout, in seconds (0: no timeout)
+        # render_timeout: seconds render() waits for a result, time in the queue included (None: no timeout)
+        self.browsers = browsers
+        self.tabs = tabs
+        self.max_page_uses = max_page_uses
+        self.timeout = timeout
+        self.render_timeout = render_timeout
+        self.user_agent = user_agent
+
+        self._loop = None
+        self._queue = None
+        self._thread = None
+        self._ready = threading.Event()
+        self._start_lock = threading.Lock()
+        self._startup_error = None
+        self._shutdown = None
+        self._browsers = []
+        self._browser_locks = []
+
+    def start(self):
+        """Launch the browsers on a background event loop (done automatically on the first render)"""
+        with self._start_lock:
+            if self._thread:
+                return
+            self._thread = threading.Thread(target=asyncio.run, args=(self._run(),), daemon=True)
+            self._thread.start()
+        self._ready.wait()
+        if self._startup_error:
+            raise self._startup_error
+
+    def render(self, url):
+        """Render a page on the next available tab and return the resulting html (blocking, TimeoutError after render_timeout)"""
+        return self.result(self.submit(url))
+
+    def result(self, future):
+        """Wait for the html of a submitted page (TimeoutError after render_timeout)"""
+        try:
+            return future.result(timeout=self.render_timeout)
+        except concurrent.futures.TimeoutError:
+            # Not rendered yet: a tab that takes the job later skips it
+            future.cancel()
+            raise
+
+    def submit(self, url):
+        """Queue a page for rendering; returns a concurrent.futures.Future holding the rendered html"""
+        self.start()
+        future = concurrent.futures.Future()
+        self._loop.call_soon_threadsafe(self._queue.put_nowait, (url, future))
+        return future
+
+    def close(self):
+        """Close every tab and browser process"""
+        if self._thread and self._loop and not self._startup_error:
+            self._loop.call_soon_threadsafe(self._shutdown.set)
+            self._thread.join()
+        self._thread = None
+        self._ready.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    async def _run(self):
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue()
+        self._shutdown = asyncio.Event()
+        self._browsers = []
+        try:
+            for _ in range(self.browsers):
+                self._browsers.append(await self._launch())
+        except Exception as error:
+            self._startup_error = error
+            self._ready.set()
+            for browser in self._browsers:
+                await browser.close()
+            return
+        self._browser_locks = [asyncio.Lock() for _ in self._browsers]
+        self._ready.set()
+
+        workers = [asyncio.create_task(self._tab_worker(slot)) for slot in range(len(self._browsers))
+                   for _ in range(self.tabs)]
+        await self._shutdown.wait()
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+
+        # Fail jobs that were still waiting in the queue
+        while not self._queue.empty():
+            _, future = self._queue.get_nowait()
+            if future.set_running_or_notify_cancel():
+                future.set_exception(RuntimeError('Browser pool closed'))
+        for browser in self._browsers:
+            with contextlib.suppress(Exception):
+                await browser.close()
+
+    async def _launch(self):
+        # Signal handlers can only be installed by the main thread
+        return await pyppeteer.launch(headless=True, args=['--no-sandbox'], handleSIGINT=False, handleSIGTERM=False,
+                                      handleSIGHUP=False)
+
+    async def _open_tab(self, slot):
+        """New tab on the browser of a slot (the browser is relaunched if it crashed or was closed)"""
+        async with self._browser_locks[slot]:
+            try:
+                return await self._new_page(self._browsers[slot])
+            except Exception:
+                # Tabs of the same browser wait for the lock, then open their tab on the relaunched browser
+                with contextlib.suppress(Exception):
+                    await self._browsers[slot].close()
+                self._browsers[slot] = await self._launch()
+                return await self._new_page(self._browsers[slot])
+
+    async def _new_page(self, browser):
+        page = await browser.newPage()
+        if self.user_agent:
+            await page.setUserAgent(self.user_agent)
+        return page
+
+    async def _close_page(self, page):
+        with contextlib.suppress(Exception):
+            if not page.isClosed():
+                await page.close()
+
+    async def _tab_worker(self, slot):
+        # The tab is opened with its first job: a job failing to get a tab (browser down and relaunch failed) fails
+        # with that error, so every queued job is resolved and the worker keeps serving the queue
+        page = None
+        page_uses = 0
+        try:
+            while True:
+                url, future = await self._queue.get()
+                if not future.set_running_or_notify_cancel():
+                    continue
+                try:
+                    if page is None:
+                        page = await self._open_tab(slot)
+                    await page.goto(url, options={'timeout': int(self.timeout * 1000)})
+                    future.set_result(await page.content())
+                except Exception as error:
+                    future.set_exception(error)
+                    # Tab may be in an unusable state: replace it
+                    page_uses = self.max_page_uses
+                page_uses += 1
+
+                # Recycle tab
+                if page_uses >= self.max_page_uses:
+                    if page is not None:
+                        await self._close_page(page)
+                    page = None
+                    page_uses = 0
+        finally:
+            if page is not None:
+                await self._close_page(page)
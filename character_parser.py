@@ -0,0 +1,67 @@
+from lxml import etree
+from lxml import html as lxml_html
+from tibia_dates import strings_to_datetimes
+from detail_parser import text_chunks, class_test
+
+# Precompiled XPath expressions for the Tibia.com character page and the TibiaRing character page
+first_table_xpath = etree.XPath('(//table)[1]')
+tibiaring_name_xpath = etree.XPath(f'//*[{class_test.format("CSC")}]')
+
+
+def parse_character_page(page_text):
+    """Character info from a Tibia.com character page: [name, world, sex, vocation, level, login, status, del_date]"""
+    # Output is None when the page has no 'Character Information' table (character renamed or deleted).
+    # login and del_date are left as text, to be converted by batch (convert_character_dates)
+    root = lxml_html.fromstring(page_text)
+    first_table = first_table_xpath(root)
+    if not first_table:
+        return None
+    info = text_chunks(first_table[0])
+    if 'Character Information' not in info:
+        return None
+
+    # Collect character info
+    name = info[info.index('Name:') + 1].split(' (traded)')[0]
+
+    # Check if character is scheduled to be deleted
+    if name.find(', will be deleted') >= 0:
+        name_del = name
+        name = name_del.split(',')[0]
+        del_date = name_del.split('at ')[-1]
+    else:
+        del_date = None
+
+    # Process collected information
+    sex = info[info.index('Sex:') + 1][0].upper()
+    world = info[info.index('World:') + 1]
+    vocation = ''.join(list(map(lambda s: s[0], info[info.index('Vocation:') + 1].split())))
+    level = int(info[info.index('Level:') + 1])
+    last_login = info[info.index('Last Login:') + 1]
+    if last_login.find('never') >= 0:
+        login = None
+    else:
+        login = last_login
+    status = ''.join(list(map(lambda s: s[0], info[info.index('Account Status:') + 1].split())))
+
+    return [name, world, sex, vocation, level, login, status, del_date]
+
+
+def convert_character_dates(character_infos):
+    """Convert the login and del_date texts of a batch of character infos to datetime objects, in place"""
+    # Entries that are not character info lists (error codes, None, 'DELETED') and dates already converted are left as is
+    date_slots = [(info, position) for info in character_infos if isinstance(info, list)
+                  for position in (5, 7) if isinstance(info[position], str)]
+    dates = strings_to_datetimes([info[position] for info, position in date_slots])
+    for (info, position), date in zip(date_slots, dates):
+        info[position] = date
+    return character_infos
+
+
+def parse_tibiaring_alias(page_text):
+    """Current name of a character from its TibiaRing page (-1 for an empty page, None if no name is shown)"""
+    if len(page_text) == 0:
+        return -1
+    name_boxes = tibiaring_name_xpath(lxml_html.fromstring(page_text))
+    if not name_boxes:
+        return None
+    return ''.join(text_chunks(name_boxes[0]))
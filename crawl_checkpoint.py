@@ -0,0 +1,104 @@
+import os
+import json
+import pickle
+from file_storage import atomic_write
+
+manifest_filename = 'checkpoint.json'
+partial_filename = 'partial_page.pkl'
+
+
+class CrawlCheckpoint:
+    """Crawl progress manifest kept next to the per-page pickles, used to resume an interrupted scrape"""
+
+    def __init__(self, page_dir):
+        # Manifest: completed pages, Status updates of registered auctions, counters and detail fetches in flight.
+        # Detail records already collected on the page being scraped are kept in partial_page.pkl
+        self.page_dir = page_dir
+        self.completed_pages = []
+        self.status_updates = {}
+        self.counters = {}
+        self.in_flight = {}
+        self.partial_records = {}
+
+    def manifest_path(self):
+        return os.path.join(self.page_dir, manifest_filename)
+
+    def partial_path(self):
+        return os.path.join(self.page_dir, partial_filename)
+
+    def page_path(self, page_number):
+        return os.path.join(self.page_dir, "page_" + str(page_number) + ".pkl")
+
+    def exists(self):
+        """Check whether a checkpoint was written to the page directory"""
+        return os.path.isfile(self.manifest_path())
+
+    def load(self):
+        """Restore crawl progress from the page directory"""
+        with open(self.manifest_path(), 'r') as manifest_file:
+            manifest = json.load(manifest_file)
+        self.completed_pages = manifest['completed_pages']
+        self.status_updates = manifest['status_updates']
+        self.counters = manifest['counters']
+        self.in_flight = manifest['in_flight']
+        if os.path.isfile(self.partial_path()):
+            with open(self.partial_path(), 'rb') as pkl_file:
+                self.partial_records = pickle.load(pkl_file)
+        return self
+
+    def save(self):
+        manifest = {'completed_pages': self.completed_pages,
+                    'status_updates': self.status_updates,
+                    'counters': self.counters,
+                    'in_flight': self.in_flight}
+        with atomic_write(self.manifest_path()) as manifest_file:
+            json.dump(manifest, manifest_file)
+
+    def next_page(self):
+        """First page that has not been completed yet (a failed page is crawled again, with every page after it)"""
+        completed = set(self.completed_pages)
+        page_number = 1
+        while page_number in completed:
+            page_number += 1
+        return page_number
+
+    def page_records(self):
+        """Auction records stored in the pickles of every completed page, in page order"""
+        records = []
+        for page_number in sorted(self.completed_pages):
+            if os.path.isfile(self.page_path(page_number)):
+                with open(self.page_path(page_number), 'rb') as pkl_file:
+                    page_records = pickle.load(pkl_file)
+                # Page directories of earlier runs hold one dataframe per page
+                if hasattr(page_records, 'to_dict'):
+                    page_records = page_records.to_dict('records')
+                records.extend(page_records)
+        return records
+
+    def detail_started(self, auction_id, page_number):
+        """Register a detail page fetch about to start"""
+        self.in_flight[auction_id] = page_number
+        self.save()
+
+    def detail_finished(self, record):
+        """Keep a collected detail record until its page is completed"""
+        self.partial_records[record['Id']] = record
+        self.in_flight.pop(record['Id'], None)
+        with atomic_write(self.partial_path(), 'wb') as pkl_file:
+            pickle.dump(self.partial_records, pkl_file)
+        self.save()
+
+    def status_updated(self, auction_id, status):
+        """Register a Status update of an already registered auction"""
+        self.status_updates[auction_id] = status
+
+    def page_completed(self, page_number, counters):
+        """Register a completed page (its records have already been written to page_<n>.pkl)"""
+        if page_number not in self.completed_pages:
+            self.completed_pages.append(page_number)
+        self.counters = counters
+        self.in_flight = {}
+        self.partial_records = {}
+        if os.path.isfile(self.partial_path()):
+            os.remove(self.partial_path())
+        self.save()
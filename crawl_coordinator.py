@@ -0,0 +1,356 @@
+import os
+import sys
+import time
+import socket
+import argparse
+import datetime
+import subprocess
+import pandas as pd
+import http_client
+import rate_limiter
+import bazaar_scraper
+import work_queue
+from work_queue import WorkQueue, LeaseLost
+from page_cursor import PageCursor, auctions_per_page
+from auction_store import AuctionStore
+from record_batch import RecordBatch
+from bazaar_database import BazaarDatabase, add_database_arguments
+from crawl_watermark import CrawlWatermark
+from detail_cache import DetailCache, cache_filename
+from run_metrics import metrics, progress, add_metrics_arguments
+
+# Sharded crawl: 'init' splits the history pages into page units queued in a SQLite file, any number of 'worker'
+# processes (on this host or on others sharing the file) lease units from it, and 'merge' builds the full dataframe.
+# Page units yield one detail unit per new auction, so detail fetches are spread over every worker as well.
+
+# Default work queue file (one queue per crawl)
+queue_filename = 'crawl_queue.sqlite'
+# History pages per page unit
+shard_pages = 50
+# Detail units leased together (fetched concurrently, like the auctions of a history page)
+detail_batch = 25
+# Pages a page unit may crawl past its range to overlap the first page of the next unit
+max_overlap_pages = 20
+# Seconds an idle worker waits before polling the queue again
+poll_interval = 5.0
+
+
+def page_unit_key(first_page, last_page):
+    return f'pages:{first_page}-{last_page}'
+
+
+def init_queue(queue, first_page, last_page, max_page, pages_per_unit=shard_pages):
+    """Split pages first_page..last_page into page units: return the number of units queued"""
+    ranges = [(start, min(start + pages_per_unit - 1, last_page)) for start in range(first_page, last_page + 1, pages_per_unit)]
+    units = []
+    for number, (start, end) in enumerate(ranges):
+        next_unit = page_unit_key(*ranges[number + 1]) if number + 1 < len(ranges) else None
+        units.append(('pages', page_unit_key(start, end),
+                      dict(key=page_unit_key(start, end), first_page=start, last_page=end, max_page=max_page,
+                           next_unit=next_unit)))
+    return queue.add(units)
+
+
+def crawl_page_unit(queue, worker, unit_id, unit, stored_status):
+    """Crawl the history pages of a page unit: (result, detail units of the new auctions)"""
+    cursor = PageCursor(unit['last_page'], unit['max_page'])
+    new_units = []
+    status_updates = {}
+    first_ids = first_fetched = last_fetched = None
+    overlap_pages = 0
+
+    page_number = unit['first_page'] - 1
+    while page_number < cursor.last_page:
+        page_number += 1
+        status_code, page_summaries = bazaar_scraper.fetch_history_page(page_number)
+        last_fetched = time.time()
+        if status_code != 200 or page_summaries is None:
+            bazaar_scraper.print_page_error(page_number, status_code)
+            raise ConnectionError(f'Failed to access page {page_number} (status {status_code})')
+        metrics.inc('pages_total')
+        metrics.set('current_page', page_number)
+        if first_ids is None:
+            first_ids = {summary['Id'] for summary in page_summaries if summary is not None}
+            first_fetched = last_fetched
+            queue.set_marker('first_ids:' + unit['key'], first_ids)
+
+        for summary in cursor.advance(page_summaries):
+            if summary is None:
+                metrics.inc('auctions_total', result='unreadable')
+            elif summary['Id'] in stored_status:
+                metrics.inc('auctions_total', result='skipped')
+                if summary['Status'] != stored_status[summary['Id']]:
+                    status_updates[summary['Id']] = summary['Status']
+            else:
+                new_units.append(('details', summary['Id'], (summary, page_number)))
+        queue.renew(worker, [unit_id])
+
+        if page_number == cursor.last_page and overlap_pages < max_overlap_pages \
+                and must_extend(queue, unit, cursor, page_summaries, last_fetched):
+            cursor.last_page += 1
+            cursor.max_page = max(cursor.max_page, cursor.last_page)
+            overlap_pages += 1
+
+    result = dict(first_page=unit['first_page'], last_page=page_number, ids=cursor.seen_ids, first_ids=first_ids,
+                  first_fetched=first_fetched, last_fetched=last_fetched, drift=cursor.drift,
+                  status_updates=status_updates)
+    return result, new_units
+
+
+def must_extend(queue, unit, cursor, page_summaries, fetched_at):
+    """Check whether a page unit must crawl one more page past its range"""
+    # Auctions finishing while crawling push auctions across unit boundaries. A unit crawled after the next one
+    # started may miss auctions pushed past its last page in between: it keeps crawling until it overlaps the first
+    # page of the next unit (recorded by the worker of that unit as a marker). The unit ending the history keeps
+    # crawling until the last page, which is the first one that is not full
+    if not unit['next_unit']:
+        return unit['last_page'] >= unit['max_page'] and len(page_summaries) >= auctions_per_page
+    marker = queue.get_marker('first_ids:' + unit['next_unit'])
+    return marker is not None and marker[1] < fetched_at and not marker[0] & cursor.seen_ids
+
+
+def scrape_detail_units(queue, worker, units):
+    """Scrape the auctions of a batch of detail units (auctions failing every attempt go back to the queue)"""
+    summaries = [dict(summary) for _, _, (summary, _) in units]
+    fetched_details = bazaar_scraper.prefetch_details(summaries)
+    queue.renew(worker, [unit_id for unit_id, _, _ in units])
+
+    finished = []
+    for (unit_id, _, (_, page_number)), summary in zip(units, summaries):
+        record = bazaar_scraper.scrape_auction(summary, page_number, fetched_details.pop(summary['Id'], None))
+        bazaar_scraper.parsed_details.pop(summary['Id'], None)
+        bazaar_scraper.pending_renders.pop(summary['Link'], None)
+        queued = [entry for entry in bazaar_scraper.retry_queue if entry[0]['Id'] == summary['Id']]
+        if queued:
+            # Tried again later, possibly by a worker with a different connection
+            for entry in queued:
+                bazaar_scraper.retry_queue.remove(entry)
+            queue.release(worker, [unit_id])
+        else:
+            # record None: auction page not found
+            finished.append((unit_id, record))
+    if bazaar_scraper.detail_cache is not None:
+        bazaar_scraper.detail_cache.flush()
+
+    for unit_id, record in finished:
+        queue.complete(worker, unit_id, record)
+
+
+def run_worker(queue, worker, stored_status):
+    """Lease and process units until none is left (page units first: they produce the detail units)"""
+    held = []
+    try:
+        while True:
+            held = queue.lease(worker, kind='pages')
+            if held:
+                unit_id, _, unit = held[0]
+                try:
+                    result, new_units = crawl_page_unit(queue, worker, unit_id, unit, stored_status)
+                except LeaseLost as error:
+                    print(f'\n{error}: abandoned.')
+                except (ConnectionError, ValueError) as error:
+                    print(f"\nPages {unit['first_page']}-{unit['last_page']}: {error}: back to the queue.")
+                    queue.release(worker, [unit_id])
+                else:
+                    queue.complete(worker, unit_id, result, new_units)
+                held = []
+                continue
+
+            held = queue.lease(worker, kind='details', limit=detail_batch)
+            if held:
+                try:
+                    scrape_detail_units(queue, worker, held)
+                except LeaseLost as error:
+                    print(f'\n{error}: batch abandoned.')
+                held = []
+                continue
+
+            if queue.outstanding() == 0:
+                break
+            # Units leased by other workers may still yield detail units (or come back after a lease expires)
+            time.sleep(poll_interval)
+    finally:
+        # Interrupted: the units in progress go back to the queue at once (without counting as an attempt)
+        queue.release(worker, [unit_id for unit_id, _, _ in held], failed=False)
+        progress.finish()
+
+
+def print_queue_status(queue):
+    counts = queue.counts()
+    for kind in ('pages', 'details'):
+        states = {state: count for (unit_kind, state), count in counts.items() if unit_kind == kind}
+        print(f"\t{kind:<8} " + ' | '.join(f"{state}: {states.get(state, 0):,}"
+                                          for state in ('pending', 'leased', 'done', 'failed')))
+
+
+def check_boundaries(page_results):
+    """Unit boundaries across which auctions may have been missed: [(last_page, next_first_page)]"""
+    # Covered if both units share an auction, or if the next unit started after this one ended
+    page_results = sorted(page_results, key=lambda result: result['first_page'])
+    return [(result['last_page'], next_result['first_page']) for result, next_result in zip(page_results, page_results[1:])
+            if not result['ids'] & next_result['first_ids'] and next_result['first_fetched'] < result['last_fetched']]
+
+
+def merge_results(queue, store_path, output, database=None):
+    """Full dataframe of stored auctions plus the auctions collected by the workers (the store is updated if it exists)"""
+    page_results = [result for _, _, _, result, _ in queue.results('pages')]
+    records = [result for _, _, _, result, _ in queue.results('details') if result is not None]
+    status_updates = {}
+    for result in page_results:
+        status_updates.update(result['status_updates'])
+
+    unverified = check_boundaries(page_results)
+    if unverified:
+        boundaries = ', '.join(f'{last_page}/{first_page}' for last_page, first_page in unverified)
+        print(f"\nWARNING: auctions may be missing between pages {boundaries}.")
+
+    # Creation dates are converted here, in a single pass over every collected auction
+    new_auctions = RecordBatch(columns=bazaar_scraper.dataframe_columns,
+                               date_columns=bazaar_scraper.text_date_columns).records_to_dataframe(records)
+    new_auctions = new_auctions.drop_duplicates(subset='Id', keep='last').reset_index(drop=True)
+    auction_store = AuctionStore(store_path)
+    if database is not None:
+        # Upserted into the database: stored auctions keep their record, only their Status is updated
+        known_ids = set(database.lookup('auctions', 'Id', new_auctions['Id'], columns=['Id'])['Id'])
+        new_auctions = new_auctions[~new_auctions['Id'].isin(known_ids)].reset_index(drop=True)
+        status_df = pd.DataFrame({'Id': list(status_updates), 'Status': list(status_updates.values())})
+        with database.transaction():
+            database.upsert('auctions', new_auctions)
+            database.update('auctions', status_df)
+        print(f"\nDatabase updated: {len(new_auctions):,} new auctions, {len(status_df):,} status updates.")
+        full_dataframe = database.load('auctions')
+
+        watermark = CrawlWatermark(bazaar_scraper.watermark_path(store_path, database.path))
+        watermark.update(full_dataframe, ~full_dataframe['Status'].isin(bazaar_scraper.final_status)).save()
+    elif auction_store.exists():
+        stored_auctions = auction_store.load(columns=bazaar_scraper.dataframe_columns)
+        new_auctions = new_auctions[~new_auctions['Id'].isin(stored_auctions['Id'])].reset_index(drop=True)
+        status_changed = stored_auctions['Id'].map(status_updates)
+        status_changed = status_changed.notna() & status_changed.ne(stored_auctions['Status'])
+        stored_auctions.loc[status_changed, 'Status'] = stored_auctions.loc[status_changed, 'Id'].map(status_updates)
+        auction_store.append(new_auctions)
+        auction_store.patch_status(stored_auctions[status_changed])
+        print(f"\nAuction store updated: {len(new_auctions):,} new auctions, {status_changed.sum():,} status updates.")
+        full_dataframe = pd.concat([stored_auctions, new_auctions], ignore_index=True)
+
+        watermark = CrawlWatermark(bazaar_scraper.watermark_path(store_path))
+        watermark.update(full_dataframe, ~full_dataframe['Status'].isin(bazaar_scraper.final_status)).save()
+    else:
+        full_dataframe = new_auctions
+
+    full_dataframe.to_pickle(output)
+    print(f"\n{len(full_dataframe):,} auctions ({len(new_auctions):,} new) written to {output}.")
+    return full_dataframe
+
+
+def stored_auction_status(store_path, database=None):
+    """Status of every stored auction: {'<auction_id>': '<status>'}"""
+    if database is not None:
+        stored_auctions = database.load('auctions', columns=['Id', 'Status'])
+        return dict(zip(stored_auctions['Id'], stored_auctions['Status']))
+    auction_store = AuctionStore(store_path)
+    if not auction_store.exists():
+        return {}
+    stored_auctions = auction_store.load(columns=['Id', 'Status'])
+    return dict(zip(stored_auctions['Id'], stored_auctions['Status']))
+
+
+def start_worker_processes(count, metrics_path):
+    """Launch count-1 more workers with the same options (each one writes its own metrics file)"""
+    worker_processes = []
+    for number in range(1, count):
+        worker_args = sys.argv + ['--processes', '1']
+        if metrics_path:
+            root, extension = os.path.splitext(metrics_path)
+            worker_args += ['--metrics', f'{root}-{number}{extension}']
+        worker_processes.append(subprocess.Popen([sys.executable] + worker_args))
+    return worker_processes
+
+
+if __name__ == "__main__":
+
+    # Command line options
+    parser = argparse.ArgumentParser(description='Sharded Tibia auction crawl: work queue coordinator, workers and merge')
+    parser.add_argument('--queue', default=queue_filename, help='work queue file (shared by every worker)')
+    parser.add_argument('--store', default=bazaar_scraper.store_dirname, help='auction store directory')
+    add_database_arguments(parser)
+    commands = parser.add_subparsers(dest='command', required=True)
+    init_parser = commands.add_parser('init', help='queue the history pages to be crawled')
+    init_parser.add_argument('--shard-pages', type=int, default=shard_pages, help='history pages per page unit')
+    init_parser.add_argument('--first-page', type=int, default=1)
+    init_parser.add_argument('--last-page', type=int, default=None,
+                             help='last page to be crawled (default: from the crawl watermark, or every page)')
+    init_parser.add_argument('--full-crawl', action='store_true', help='crawl every history page, ignoring the crawl watermark')
+    worker_parser = commands.add_parser('worker', help='lease and process units until the queue is empty')
+    worker_parser.add_argument('--processes', type=int, default=1, help='number of worker processes started on this host')
+    worker_parser.add_argument('--rate', type=float, default=rate_limiter.initial_rate,
+                               help='initial number of requests per second to tibia.com, per worker')
+    worker_parser.add_argument('--max-rate', type=float, default=rate_limiter.max_rate,
+                               help='maximum number of requests per second to tibia.com, per worker')
+    worker_parser.add_argument('--lease', type=float, default=work_queue.lease_seconds,
+                               help='seconds without news from a worker after which its units go to other workers')
+    worker_parser.add_argument('--no-detail-cache', action='store_true',
+                               help='fetch the detail page of every new auction, ignoring the cached detail records')
+    add_metrics_arguments(worker_parser)
+    commands.add_parser('status', help='display the number of units by state')
+    merge_parser = commands.add_parser('merge', help='merge the collected auctions into the full dataframe')
+    merge_parser.add_argument('--output', default=bazaar_scraper.last_scrape_filename, help='full dataframe pickle')
+    merge_parser.add_argument('--allow-incomplete', action='store_true', help='merge while units are still outstanding')
+    args = parser.parse_args()
+
+    queue = WorkQueue(args.queue)
+    database = BazaarDatabase(args.database) if args.database else None
+
+    if args.command == 'init':
+        if queue.counts():
+            sys.exit(f"Queue {args.queue} already holds units: use a new queue file for each crawl.")
+        max_page = bazaar_scraper.get_page_count()
+        if max_page == 0:
+            sys.exit("Failed to get the number of history pages.")
+        last_page = args.last_page
+        if last_page is None:
+            watermark = CrawlWatermark(bazaar_scraper.watermark_path(args.store, args.database))
+            cutoff = None
+            if not args.full_crawl and watermark.exists():
+                cutoff = watermark.load().cutoff(datetime.datetime.today())
+            last_page = bazaar_scraper.get_last_page(args.first_page, max_page, cutoff)
+        unit_count = init_queue(queue, args.first_page, min(last_page, max_page), max_page, args.shard_pages)
+        print(f"\nQueued pages {args.first_page} to {min(last_page, max_page)} (of {max_page}) in {unit_count} page units.")
+
+    elif args.command == 'worker':
+        worker_processes = start_worker_processes(args.processes, args.metrics) if args.processes > 1 else []
+        worker = f'{socket.gethostname()}:{os.getpid()}'
+        queue.lease_seconds = args.lease
+        http_client.limiter.configure(bazaar_scraper.tibia_host, rate=args.rate, highest_rate=args.max_rate)
+        metrics.export_path = args.metrics
+        if not args.no_detail_cache:
+            bazaar_scraper.detail_cache = DetailCache(os.path.join(args.store, cache_filename))
+        print(f"\nWorker {worker} started.")
+        try:
+            run_worker(queue, worker, stored_auction_status(args.store, database))
+        finally:
+            if bazaar_scraper.browser_pool is not None:
+                bazaar_scraper.browser_pool.close()
+            bazaar_scraper.close_detail_executor()
+            if bazaar_scraper.detail_cache is not None:
+                bazaar_scraper.detail_cache.close()
+            http_client.close()
+            for worker_process in worker_processes:
+                worker_process.wait()
+        metrics.export()
+        print(f"\nWorker {worker} done: no units left.")
+
+    elif args.command == 'status':
+        print(f"\nWork queue {args.queue}:")
+        print_queue_status(queue)
+        for unit_id, kind, key in queue.failed():
+            print(f"\tFAILED {kind} unit {key}")
+
+    elif args.command == 'merge':
+        print(f"\nWork queue {args.queue}:")
+        print_queue_status(queue)
+        if queue.outstanding() and not args.allow_incomplete:
+            sys.exit("Units are still outstanding: wait for the workers (or use --allow-incomplete).")
+        merge_results(queue, args.store, args.output, database)
+
+    queue.close()
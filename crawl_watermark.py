@@ -0,0 +1,86 @@
+import os
+import json
+import datetime
+import pandas as pd
+from file_storage import atomic_write
+
+# Auctions ended more than this many days ago are considered final (their status is no longer checked)
+status_window_days = 10
+# Extra pages crawled past the boundary page (auctions keep being pushed down the history while crawling)
+boundary_margin = 1
+
+
+class CrawlWatermark:
+    """Persisted crawl boundary: newest stored auction and oldest auction whose status can still change"""
+
+    def __init__(self, path):
+        # newest_end:    End date of the newest stored auction (newest_id: its Id)
+        # mutable_since: End date of the oldest stored auction whose status may still change (None: every status is final)
+        self.path = path
+        self.newest_end = None
+        self.newest_id = None
+        self.mutable_since = None
+
+    def exists(self):
+        """Check whether a watermark was written"""
+        return os.path.isfile(self.path)
+
+    def load(self):
+        with open(self.path, 'r') as watermark_file:
+            watermark = json.load(watermark_file)
+        self.newest_end = from_isoformat(watermark['newest_end'])
+        self.newest_id = watermark['newest_id']
+        self.mutable_since = from_isoformat(watermark['mutable_since'])
+        return self
+
+    def save(self):
+        watermark = {'newest_end': to_isoformat(self.newest_end),
+                     'newest_id': self.newest_id,
+                     'mutable_since': to_isoformat(self.mutable_since)}
+        with atomic_write(self.path) as watermark_file:
+            json.dump(watermark, watermark_file, indent=1)
+
+    def update(self, dataframe, mutable):
+        """Set the watermark from every stored auction ('Id' and 'End' columns) and a boolean mask of mutable rows"""
+        end_dates = pd.to_datetime(dataframe['End'], errors='coerce')
+        if end_dates.notna().any():
+            newest_row = end_dates.idxmax()
+            self.newest_end = end_dates[newest_row].to_pydatetime()
+            self.newest_id = str(dataframe.at[newest_row, 'Id'])
+        mutable_dates = end_dates[pd.Series(mutable, index=dataframe.index).fillna(False).astype(bool)].dropna()
+        self.mutable_since = mutable_dates.min().to_pydatetime() if not mutable_dates.empty else None
+        return self
+
+    def cutoff(self, now, window_days=status_window_days):
+        """End date below which no page needs to be crawled (None: no watermark, crawl every page)"""
+        if self.newest_end is None:
+            return None
+        # Auctions still within the status window are crawled again, older ones only if they are new
+        window_start = now - datetime.timedelta(days=window_days)
+        if self.mutable_since is None:
+            return self.newest_end
+        return min(self.newest_end, max(self.mutable_since, window_start))
+
+
+def find_boundary_page(page_oldest_end, first_page, last_page, cutoff):
+    """Binary search for the first page holding auctions that ended before cutoff (history pages go newest first)"""
+    # page_oldest_end(page_number): End date of the oldest auction on the page (None if the page could not be read,
+    # in which case the boundary is assumed to lie further down)
+    low = first_page
+    high = last_page
+    while low < high:
+        middle = (low + high) // 2
+        oldest_end = page_oldest_end(middle)
+        if oldest_end is not None and oldest_end < cutoff:
+            high = middle
+        else:
+            low = middle + 1
+    return low
+
+
+def to_isoformat(date):
+    return date.isoformat() if date is not None else None
+
+
+def from_isoformat(text):
+    return datetime.datetime.fromisoformat(text) if text is not None else None
@@ -0,0 +1,71 @@
+import os
+import pickle
+import sqlite3
+import threading
+import zstandard
+from file_storage import busy_timeout
+
+# Default cache file (kept in the auction store directory by the scraper)
+cache_filename = 'detail_cache.sqlite'
+# zstd compression level of the cached records
+compression_level = 3
+
+
+class DetailCache:
+    """Persistent cache of collected auction detail records, keyed by auction Id (detail pages never change once listed)"""
+
+    def __init__(self, path=cache_filename):
+        # Table:   details (id TEXT PRIMARY KEY, record BLOB)   zstd-compressed pickle of the auction record
+        # New records are kept in memory and written by flush() (once per history page) in a single short transaction,
+        # so a crash loses at most one page of records and other processes are never locked out for long
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, timeout=busy_timeout, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS details (id TEXT PRIMARY KEY, record BLOB)')
+        self.compressor = zstandard.ZstdCompressor(level=compression_level)
+        self.pending = {}
+
+    def __len__(self):
+        with self.lock:
+            return self.connection.execute('SELECT COUNT(*) FROM details').fetchone()[0] + len(self.pending)
+
+    def __contains__(self, auction_id):
+        with self.lock:
+            if auction_id in self.pending:
+                return True
+            return self.connection.execute('SELECT 1 FROM details WHERE id = ?', (auction_id,)).fetchone() is not None
+
+    def get(self, auction_id):
+        """Cached detail record of an auction (a new copy on every call), None if it was never collected"""
+        with self.lock:
+            blob = self.pending.get(auction_id)
+            if blob is None:
+                row = self.connection.execute('SELECT record FROM details WHERE id = ?', (auction_id,)).fetchone()
+                blob = row[0] if row else None
+        if blob is None:
+            return None
+        # Decompressor objects are not thread-safe: one per read
+        return pickle.loads(zstandard.ZstdDecompressor().decompress(blob))
+
+    def put(self, record):
+        """Cache a collected detail record (committed on the next flush)"""
+        with self.lock:
+            self.pending[record['Id']] = self.compressor.compress(pickle.dumps(record, protocol=pickle.HIGHEST_PROTOCOL))
+
+    def flush(self):
+        """Write the records cached since the last flush"""
+        with self.lock:
+            if self.pending:
+                self.connection.executemany('INSERT OR REPLACE INTO details VALUES (?, ?)', self.pending.items())
+                self.connection.commit()
+                self.pending = {}
+
+    def close(self):
+        self.flush()
+        with self.lock:
+            self.connection.close()
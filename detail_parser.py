@@ -0,0 +1,104 @@
+from lxml import etree
+from lxml import html as lxml_html
+
+# XPath test matching elements with a given class (one of several space-separated classes), shared by every page parser
+class_test = 'contains(concat(" ", normalize-space(@class), " "), " {} ")'
+
+# Precompiled XPath expressions for the auction detail page sections. Raw (unrendered) html usually lacks the <tbody>
+# elements that the browser inserts, so every row lookup accepts both forms.
+general_xpath = etree.XPath('//*[@id="General"]')
+bestiary_xpath = etree.XPath('//*[@id="BestiaryProgress"]')
+inner_rows_xpath = etree.XPath(f'.//*[{class_test.format("InnerTableContainer")}]/table/tr | '
+                               f'.//*[{class_test.format("InnerTableContainer")}]/table/tbody/tr')
+nested_rows_xpath = etree.XPath('./td/table/tr | ./td/table/tbody/tr')
+tables_xpath = etree.XPath('.//table')
+rows_xpath = etree.XPath('./tr | ./tbody/tr')
+descendant_rows_xpath = etree.XPath('.//tr')
+table_content_xpath = etree.XPath(f'.//*[{class_test.format("TableContent")}]')
+
+# Labels of the bank row, as displayed on the auction page
+bank_labels = {'Creation Date:': 'Creation Date',
+               'Experience:': 'Experience',
+               'Gold:': 'Gold',
+               'Achievement Points:': 'Achievement Points'}
+
+
+def parse_detail_page(page_text):
+    """Parse skills, bank data and bestiary from the raw html of an auction detail page (no rendering required)"""
+    # Output: {'Skills': dict, 'Bank': dict, 'Bestiary': dict}; sections missing from the html are set to None
+    root = lxml_html.fromstring(page_text)
+    sections = {'Skills': None, 'Bank': None, 'Bestiary': None}
+
+    general_data = general_xpath(root)
+    if general_data:
+        inner_rows = inner_rows_xpath(general_data[0])
+        if inner_rows:
+            sections['Skills'] = parse_skills(inner_rows[0])
+        if len(inner_rows) > 1:
+            sections['Bank'] = parse_bank(inner_rows[1])
+
+    bestiary_data = bestiary_xpath(root)
+    if bestiary_data:
+        sections['Bestiary'] = parse_bestiary(bestiary_data[0])
+
+    return sections
+
+
+def missing_sections(sections):
+    """List the sections that could not be parsed"""
+    return [section for section, value in sections.items() if value is None]
+
+
+def text_chunks(element):
+    """Non-empty text fragments of an element, in document order"""
+    chunks = (chunk.replace('\xa0', ' ').strip() for chunk in element.itertext())
+    return [chunk for chunk in chunks if chunk]
+
+
+def parse_skills(general_first_row):
+    """Skill table (second table of the first 'General' row): {'<skill_name>': <skill_level:int>}"""
+    nested_rows = nested_rows_xpath(general_first_row)
+    if not nested_rows:
+        return None
+    general_tables = tables_xpath(nested_rows[0])
+    if len(general_tables) < 2:
+        return None
+
+    skill_dict = {}
+    for skill_row in rows_xpath(general_tables[1]):
+        skill_entry = text_chunks(skill_row)
+        if len(skill_entry) >= 2:
+            skill_dict[skill_entry[0]] = int(skill_entry[1])
+    return skill_dict if skill_dict else None
+
+
+def parse_bank(general_second_row):
+    """Bank row: {'Creation Date': <str>, 'Experience': <str>, 'Gold': <str>, 'Achievement Points': <str>}"""
+    chunks = text_chunks(general_second_row)
+    bank_dict = {}
+    for label, value in zip(chunks[:-1], chunks[1:]):
+        if label in bank_labels:
+            bank_dict[bank_labels[label]] = value
+    return bank_dict if len(bank_dict) == len(bank_labels) else None
+
+
+def parse_bestiary(bestiary_data):
+    """Bestiary table: {'<creature_name>': <number_of_kills:int>}"""
+    bestiary_tables = table_content_xpath(bestiary_data)
+    if not bestiary_tables:
+        return None
+
+    bestiary_rows = [text_chunks(row) for row in descendant_rows_xpath(bestiary_tables[0])][1:]
+    if len(bestiary_rows) > 0:
+        last_row = ' '.join(bestiary_rows[-1])
+        if last_row.find("more entries)") >= 0:
+            bestiary_rows = bestiary_rows[:-1]
+
+    bestiary_dict = {}
+    for creature_entry in bestiary_rows:
+        if len(creature_entry) < 2:
+            continue
+        creature_name = creature_entry[-1]
+        creature_count = int(''.join(digit for digit in creature_entry[1] if digit.isdigit()))
+        bestiary_dict[creature_name] = creature_count
+    return bestiary_dict
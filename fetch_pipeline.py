@@ -0,0 +1,146 @@
+import os
+import queue
+import asyncio
+import threading
+import concurrent.futures
+import http_client
+
+_parse_pool = None
+
+
+def parse_pool(processes=None):
+    """Process pool shared by every parsing stage (created on first use)"""
+    global _parse_pool
+
+    if _parse_pool is None:
+        _parse_pool = concurrent.futures.ProcessPoolExecutor(max_workers=processes if processes else default_processes())
+    return _parse_pool
+
+
+def default_processes():
+    """One parser process per core, leaving a core for the fetch loop and the writer"""
+    return max(1, (os.cpu_count() or 2) - 1)
+
+
+def close_parse_pool():
+    """Shut down the shared process pool"""
+    global _parse_pool
+
+    if _parse_pool is not None:
+        _parse_pool.shutdown()
+        _parse_pool = None
+
+
+class FetchParsePipeline:
+    """Staged pipeline: asyncio fetchers -> bounded queue of raw html -> process pool parsers -> ordered results"""
+
+    def __init__(self, parse_function, headers=None, fetchers=8, queue_size=32, executor=None):
+        # parse_function: module-level (picklable) function html_text -> parsed data, run in the process pool
+        # fetchers:       maximum number of simultaneous requests (request starts are paced by http_client.limiter)
+        # queue_size:     maximum number of fetched pages waiting for a parser (bounds memory use)
+        # executor:       process pool running the parsers (default: shared pool)
+        self.parse_function = parse_function
+        self.headers = headers
+        self.fetchers = fetchers
+        self.queue_size = queue_size
+        self.executor = executor
+        self._loop = None
+        self._session = None
+        self._thread = None
+        self._ready = threading.Event()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def start(self):
+        """Start the event loop of the fetch stage on a background thread"""
+        if self.executor is None:
+            self.executor = parse_pool()
+        self._thread = threading.Thread(target=self._run_loop, daemon=True)
+        self._thread.start()
+        self._ready.wait()
+        return self
+
+    def close(self):
+        """Close the connections and stop the background thread (the process pool is left running)"""
+        if self._loop is None:
+            return
+        if self._session is not None:
+            asyncio.run_coroutine_threadsafe(self._session.close(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop = None
+
+    def map(self, urls):
+        """Yield (url, status_code, parsed_data) for every url, in input order, as soon as each one is parsed"""
+        # status_code is None for connection errors; parsed_data is None for failed requests and unparsable pages
+        urls = list(urls)
+        results = queue.Queue()
+        future = asyncio.run_coroutine_threadsafe(self._process(urls, results), self._loop)
+        parsed_pages = {}
+        try:
+            for index in range(len(urls)):
+                while index not in parsed_pages:
+                    result = results.get()
+                    if isinstance(result, BaseException):
+                        raise result
+                    parsed_pages[result[0]] = result[1:]
+                yield (urls[index],) + parsed_pages.pop(index)
+        finally:
+            # Consumer stopped early: cancel pending fetches
+            future.cancel()
+
+    def _run_loop(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        self._session = self._loop.run_until_complete(self._open_session())
+        self._ready.set()
+        self._loop.run_forever()
+        self._loop.close()
+
+    async def _open_session(self):
+        return http_client.async_session(headers=self.headers, limit_per_host=self.fetchers)
+
+    async def _process(self, urls, results):
+        raw_pages = asyncio.Queue(self.queue_size)
+        url_iterator = iter(enumerate(urls))
+
+        async def fetch_stage():
+            for index, url in url_iterator:
+                status, text = await self._fetch(url)
+                await raw_pages.put((index, status, text))
+
+        async def parse_stage():
+            loop = asyncio.get_running_loop()
+            while True:
+                page = await raw_pages.get()
+                if page is None:
+                    return
+                index, status, text = page
+                parsed = None
+                if text is not None:
+                    try:
+                        parsed = await loop.run_in_executor(self.executor, self.parse_function, text)
+                    except Exception:
+                        parsed = None
+                results.put((index, status, parsed))
+
+        parser_count = max(1, getattr(self.executor, '_max_workers', 1))
+        fetch_tasks = [asyncio.create_task(fetch_stage()) for _ in range(min(self.fetchers, len(urls)))]
+        parse_tasks = [asyncio.create_task(parse_stage()) for _ in range(parser_count)]
+        try:
+            await asyncio.gather(*fetch_tasks)
+            for _ in parse_tasks:
+                await raw_pages.put(None)
+            await asyncio.gather(*parse_tasks)
+        except asyncio.CancelledError:
+            for task in fetch_tasks + parse_tasks:
+                task.cancel()
+        except Exception as error:
+            results.put(error)
+
+    async def _fetch(self, url):
+        return await http_client.async_get(self._session, url)
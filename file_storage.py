@@ -0,0 +1,21 @@
+import os
+import contextlib
+
+# Seconds an SQLite connection waits for another process to release the database lock (database, work queue and
+# detail cache are shared by concurrent processes)
+busy_timeout = 60
+
+
+@contextlib.contextmanager
+def atomic_write(path, mode='w'):
+    """Open a temporary file next to path, renamed over it once written: readers never see a half-written file and
+    a crash while writing leaves the previous file intact"""
+    temp_path = path + '.tmp'
+    try:
+        with open(temp_path, mode) as temp_file:
+            yield temp_file
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(temp_path)
+        raise
+    os.replace(temp_path, path)
@@ -0,0 +1,75 @@
+from lxml import etree
+from lxml import html as lxml_html
+from tibia_dates import strings_to_datetimes
+from detail_parser import text_chunks, class_test
+
+# Precompiled XPath expressions for the 'auction history' page (one pass over the page, a few lookups per auction)
+auctions_xpath = etree.XPath(f'//*[{class_test.format("Auction")}]')
+header_xpath = etree.XPath(f'.//*[{class_test.format("AuctionHeader")}]')
+name_xpath = etree.XPath(f'.//*[{class_test.format("AuctionCharacterName")}]')
+link_xpath = etree.XPath('.//a/@href')
+auction_data_xpath = etree.XPath(f'.//*[{class_test.format("ShortAuctionData")}]')
+current_bid_xpath = etree.XPath(f'.//*[{class_test.format("CurrentBid")}]')
+page_link_xpath = etree.XPath(f'//*[{class_test.format("PageLink")}]')
+
+
+def parse_history_page(page_text):
+    """Parse the summary of every auction listed in an 'auction history' page (None for unreadable auctions)"""
+    # Output: list of summaries, None if the page itself cannot be parsed (empty or garbage body)
+    try:
+        root = lxml_html.fromstring(page_text)
+    except etree.LxmlError:
+        return None
+    page_summaries = []
+    for auction in auctions_xpath(root):
+        try:
+            page_summaries.append(parse_auction_summary(auction))
+        except (IndexError, ValueError, StopIteration):
+            page_summaries.append(None)
+
+    # Start and End dates of every auction in the page, converted in a single pass
+    summaries = [summary for summary in page_summaries if summary is not None]
+    dates = strings_to_datetimes([summary['Start'] for summary in summaries] + [summary['End'] for summary in summaries])
+    for summary, start, end in zip(summaries, dates[:len(summaries)], dates[len(summaries):]):
+        summary['Start'] = start
+        summary['End'] = end
+    return [summary if summary is None or (summary['Start'] and summary['End']) else None for summary in page_summaries]
+
+
+def parse_page_count(page_text):
+    """Total number of pages, read from the last page link of an 'auction history' page (0 if unreadable)"""
+    try:
+        root = lxml_html.fromstring(page_text)
+        page_links = page_link_xpath(root)
+        return int(link_xpath(page_links[-1])[0].split("page=")[-1])
+    except (etree.LxmlError, IndexError, ValueError):
+        return 0
+
+
+def parse_auction_summary(auction):
+    """Auction summary record: Name, Level, Vocation, World, Sex, Bid, Type, Start, End, Status, Id, Link (dates as text)"""
+
+    # Auction header: character name and link, then 'Level: <n> | Vocation: <voc> | <Sex> | World: <world>'
+    header_table = header_xpath(auction)[0]
+    name_box = name_xpath(header_table)[0]
+    name = ''.join(text_chunks(name_box))
+    char_link = next(link for link in link_xpath(name_box) if 'auctionid=' in link)
+    auction_id = char_link.split("auctionid=")[-1].split("&")[0]
+    header_parts = ' '.join(text_chunks(header_table)[1:]).split("|")
+    level = int(header_parts[0].split(":")[-1])
+    voc = ''.join([capital_letter for capital_letter in header_parts[1].split(":")[-1] if capital_letter.isupper()])
+    sex = header_parts[2].strip()[0]
+    world = header_parts[3].split(":")[-1].strip()
+
+    # Auction table: 'Auction Start:', <start>, 'Auction End:', <end>, 'Winning Bid:' | 'Minimum Bid:', <bid>
+    data = text_chunks(auction_data_xpath(auction)[0])
+    start = data[1]
+    end = data[3]
+    end_type = data[4][0]  # W: winning bid; M: minimum bid (failed auction)
+    bid = int(data[5].replace(",", ""))
+
+    # Status box
+    bid_status = ' '.join(text_chunks(current_bid_xpath(auction)[0]))
+
+    return dict(Name=name, Level=level, Vocation=voc, World=world, Sex=sex, Bid=bid, Type=end_type,
+                Start=start, End=end, Status=bid_status, Id=auction_id, Link=char_link)
@@ -0,0 +1,119 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+import zstandard
+
+# Default archive directory
+archive_dirname = 'html_archive'
+index_filename = 'index.sqlite'
+# zstd compression level (each page is a separate frame, so any page can be read without decompressing a segment)
+compression_level = 6
+# A new segment file is started once the current one reaches this size, in bytes
+segment_size = 256 * 1024 * 1024
+
+
+class HtmlArchive:
+    """Compressed content-addressed archive of fetched html pages, indexed by url and fetch time"""
+
+    def __init__(self, path=archive_dirname):
+        # Layout:  <path>/index.sqlite             blobs (sha256 -> segment, offset, length) and fetches (url, time, kind, sha256)
+        #          <path>/segment-<n>.zst          append-only zstd frames, one per distinct page content
+        # kind:    'raw' for http responses, 'rendered' for pages rendered on the headless browser
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(os.path.join(path, index_filename), check_same_thread=False)
+        self.connection.executescript('''
+            CREATE TABLE IF NOT EXISTS blobs (hash TEXT PRIMARY KEY, segment INTEGER, offset INTEGER, length INTEGER);
+            CREATE TABLE IF NOT EXISTS fetches (url TEXT, fetched_at REAL, kind TEXT, hash TEXT);
+            CREATE INDEX IF NOT EXISTS fetches_url ON fetches (url, kind, fetched_at);
+        ''')
+        self.compressor = zstandard.ZstdCompressor(level=compression_level)
+        last_segment = self.connection.execute('SELECT MAX(segment) FROM blobs').fetchone()[0]
+        self.segment = last_segment if last_segment is not None else 0
+        self.segment_file = None
+
+    def __len__(self):
+        with self.lock:
+            return self.connection.execute('SELECT COUNT(*) FROM fetches').fetchone()[0]
+
+    def segment_path(self, segment):
+        return os.path.join(self.path, f'segment-{segment:06d}.zst')
+
+    def put(self, url, text, kind='raw', fetched_at=None):
+        """Archive a fetched page (identical contents are stored once) and return its content hash"""
+        content = text.encode('utf-8')
+        content_hash = hashlib.sha256(content).hexdigest()
+        fetched_at = fetched_at if fetched_at is not None else time.time()
+        with self.lock:
+            known = self.connection.execute('SELECT 1 FROM blobs WHERE hash = ?', (content_hash,)).fetchone()
+            if known is None:
+                frame = self.compressor.compress(content)
+                segment_file = self.open_segment()
+                offset = segment_file.tell()
+                segment_file.write(frame)
+                segment_file.flush()
+                self.connection.execute('INSERT INTO blobs VALUES (?, ?, ?, ?)',
+                                        (content_hash, self.segment, offset, len(frame)))
+            self.connection.execute('INSERT INTO fetches VALUES (?, ?, ?, ?)', (url, fetched_at, kind, content_hash))
+            self.connection.commit()
+        return content_hash
+
+    def open_segment(self):
+        # Current segment file, rolled over once it reaches segment_size
+        if self.segment_file is None:
+            self.segment_file = open(self.segment_path(self.segment), 'ab')
+        if self.segment_file.tell() >= segment_size:
+            self.segment_file.close()
+            self.segment += 1
+            self.segment_file = open(self.segment_path(self.segment), 'ab')
+        return self.segment_file
+
+    def get(self, url, kind='raw', before=None):
+        """Latest archived contents of an url (optionally fetched before a given time), None if never archived"""
+        query = 'SELECT hash FROM fetches WHERE url = ? AND kind = ?'
+        parameters = [url, kind]
+        if before is not None:
+            query += ' AND fetched_at < ?'
+            parameters.append(before)
+        with self.lock:
+            row = self.connection.execute(query + ' ORDER BY fetched_at DESC LIMIT 1', parameters).fetchone()
+        return self.read(row[0]) if row else None
+
+    def read(self, content_hash):
+        """Page contents from their hash"""
+        with self.lock:
+            segment, offset, length = self.connection.execute(
+                'SELECT segment, offset, length FROM blobs WHERE hash = ?', (content_hash,)).fetchone()
+            if self.segment_file is not None and segment == self.segment:
+                self.segment_file.flush()
+        with open(self.segment_path(segment), 'rb') as segment_file:
+            segment_file.seek(offset)
+            frame = segment_file.read(length)
+        # Decompressor objects are not thread-safe: one per read
+        return zstandard.ZstdDecompressor().decompress(frame).decode('utf-8')
+
+    def fetches(self, url_prefix='', kind='raw'):
+        """(url, fetched_at, hash) of every archived fetch of urls starting with a prefix, in fetch order"""
+        with self.lock:
+            return self.connection.execute('SELECT url, fetched_at, hash FROM fetches WHERE url >= ? AND url < ? '
+                                           'AND kind = ? ORDER BY fetched_at',
+                                           (url_prefix, url_prefix + '\uffff', kind)).fetchall()
+
+    def close(self):
+        """Close the current segment and the index"""
+        with self.lock:
+            if self.segment_file is not None:
+                self.segment_file.close()
+                self.segment_file = None
+            self.connection.close()
+
+
+def add_archive_arguments(parser):
+    """Add the --archive and --from-archive command line options to an argparse parser"""
+    parser.add_argument('--archive', nargs='?', const=archive_dirname, default=None, metavar='ARCHIVE_DIR',
+                        help='keep every fetched page in a compressed html archive')
+    parser.add_argument('--from-archive', nargs='?', const=archive_dirname, default=None, metavar='ARCHIVE_DIR',
+                        help='parse archived pages instead of fetching them (offline, no request reaches the network)')
@@ -0,0 +1,180 @@
+import os
+import time
+import asyncio
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import aiohttp
+from urllib.parse import urlsplit
+from rate_limiter import RateLimiter, retry_after_seconds, throttle_status_codes, error_status_codes
+from html_archive import HtmlArchive
+from run_metrics import metrics
+
+# Base urls of Tibia.com and TibiaRing (point them at a local stand-in server through TIBIA_URL / TIBIARING_URL)
+tibia_url = os.environ.get('TIBIA_URL', 'https://www.tibia.com').rstrip('/')
+tibiaring_url = os.environ.get('TIBIARING_URL', 'http://www.tibiaring.com').rstrip('/')
+# Default request headers (compressed transfer encoding is requested explicitly)
+default_headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/70.0.3538.77 Safari/537.36',
+                   'Accept-Encoding': 'gzip, deflate',
+                   'Connection': 'keep-alive'}
+# Connect and read timeouts, in seconds
+connect_timeout = 5
+read_timeout = 30
+# Maximum number of open (keep-alive) connections per host
+connections_per_host = 32
+# Bounded retries: connection errors, throttled responses and transient server errors (the statuses the rate limiter
+# backs off on)
+max_retries = 3
+retry_backoff = 0.5
+retry_status_codes = throttle_status_codes + error_status_codes
+# Adaptive per-host request budget shared by every fetcher (page crawl, detail pages, status updater, follow-up)
+limiter = RateLimiter()
+# Raw html archive: every successful response is archived when set (see use_archive)
+archive = None
+# Offline mode: responses are served from the archive, no request reaches the network
+offline = False
+
+_session = None
+
+
+def get_session():
+    """Shared requests session with keep-alive connection pooling and bounded retries (created on first use)"""
+    global _session
+
+    if _session is None:
+        # Connection errors only: throttled and failed responses are retried by get(), through the rate limiter
+        retry = Retry(total=max_retries, backoff_factor=retry_backoff, status_forcelist=(),
+                      allowed_methods=['GET', 'HEAD'], raise_on_status=False)
+        # pool_block: threads wait for a free connection instead of opening extra ones beyond the per-host limit
+        adapter = HTTPAdapter(pool_connections=8, pool_maxsize=connections_per_host, max_retries=retry, pool_block=True)
+        _session = requests.Session()
+        _session.headers.update(default_headers)
+        _session.mount('https://', adapter)
+        _session.mount('http://', adapter)
+
+    return _session
+
+
+def get(url, headers=None, timeout=None):
+    """Rate limited GET request through the shared session (raises requests.RequestException once retries are exhausted)"""
+    if offline:
+        return ArchivedResponse(url, archive.get(url))
+    if timeout is None:
+        timeout = (connect_timeout, read_timeout)
+    for attempt in range(max_retries + 1):
+        limiter.acquire(url)
+        request_start = time.monotonic()
+        try:
+            response = get_session().get(url, headers=headers, timeout=timeout)
+        except requests.RequestException:
+            record_request(url, None, time.monotonic() - request_start)
+            raise
+        record_request(url, response.status_code, time.monotonic() - request_start,
+                       retry_after_seconds(response.headers.get('Retry-After')))
+        if response.status_code not in retry_status_codes or attempt == max_retries:
+            if response.status_code == 200:
+                archive_page(url, response.text)
+            return response
+        response.close()
+
+
+async def async_get(session, url):
+    """Rate limited GET request through an aiohttp session: (status_code, html_text), status_code None on connection errors"""
+    status, text, _, _ = await async_get_timed(session, url)
+    return status, text
+
+
+async def async_get_timed(session, url):
+    """async_get, also returning when the last attempt was sent and answered: (status_code, html_text, start, end)"""
+    # start and end are time.monotonic() values: the server produced the page somewhere in between
+    if offline:
+        now = time.monotonic()
+        return archived_page(url) + (now, now)
+    status = None
+    text = None
+    # Bounded retries on connection errors and transient server errors (backoff is up to the rate limiter)
+    for attempt in range(max_retries + 1):
+        await limiter.acquire_async(url)
+        request_start = time.monotonic()
+        retry_after = None
+        try:
+            async with session.get(url) as response:
+                status = response.status
+                retry_after = retry_after_seconds(response.headers.get('Retry-After'))
+                text = await response.text() if status == 200 else None
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            status = None
+            text = None
+        request_end = time.monotonic()
+        record_request(url, status, request_end - request_start, retry_after)
+        if status is not None and status not in retry_status_codes:
+            break
+    archive_page(url, text)
+    return status, text, request_start, request_end
+
+
+def record_request(url, status, latency, retry_after=None):
+    """Report a response (status None on connection errors) to the rate limiter and to the run metrics"""
+    limiter.record(url, status, latency, retry_after)
+    host = urlsplit(url).hostname
+    metrics.inc('http_requests_total', host=host, code=str(status) if status is not None else 'error')
+    metrics.observe('http_request_seconds', latency, host=host)
+
+
+def close():
+    """Close every pooled connection (and the archive)"""
+    global _session, archive
+
+    if _session is not None:
+        _session.close()
+        _session = None
+    if archive is not None:
+        archive.close()
+        archive = None
+
+
+def use_archive(path, from_archive=False):
+    """Archive every fetched page to path, or serve every request from it (from_archive: offline re-parse mode)"""
+    global archive, offline
+
+    archive = HtmlArchive(path)
+    offline = from_archive
+    return archive
+
+
+def archive_page(url, text, kind='raw'):
+    """Archive a successfully fetched (or rendered) page, if archiving is enabled"""
+    if archive is not None and not offline and text is not None:
+        archive.put(url, text, kind=kind)
+
+
+def archived_page(url, kind='raw'):
+    """(status_code, html_text) of an archived page: 404 if the url was never archived"""
+    text = archive.get(url, kind=kind)
+    return (200 if text is not None else 404), text
+
+
+class ArchivedResponse:
+    """Minimal stand-in for requests.Response, built from an archived page (offline mode)"""
+
+    def __init__(self, url, text):
+        self.url = url
+        self.text = text
+        self.status_code = 200 if text is not None else 404
+        self.reason = 'OK' if text is not None else 'Not Archived'
+        self.headers = {}
+
+    def close(self):
+        pass
+
+
+def async_session(headers=None, limit_per_host=None):
+    """aiohttp session with keep-alive connection pooling, per-host connection limit and timeouts"""
+    # Must be called from a running event loop
+    session_headers = dict(default_headers)
+    if headers:
+        session_headers.update(headers)
+    connector = aiohttp.TCPConnector(limit_per_host=limit_per_host if limit_per_host else connections_per_host,
+                                     keepalive_timeout=60)
+    timeout = aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout)
+    return aiohttp.ClientSession(headers=session_headers, connector=connector, timeout=timeout)
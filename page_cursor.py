@@ -0,0 +1,47 @@
+import math
+
+# Auctions listed on each 'auction history' page
+auctions_per_page = 25
+
+
+class PageCursor:
+    """Crawl position in the auction history, corrected for the auctions that finish while crawling"""
+
+    def __init__(self, last_page, max_page):
+        # Newly finished auctions are listed first and push every other auction down the history: an auction seen at
+        # the bottom of a page shows up again at the top of the next one. The number of such repeats is the drift
+        # (auctions added since the crawl started), by which the last page to be crawled is moved down.
+        # seen_ids:       Ids listed on every page processed so far
+        # previous_end:   time at which the response to the previous page was received (time.monotonic)
+        # added_pages:    pages by which last_page and max_page were moved
+        self.last_page = last_page
+        self.max_page = max_page
+        self.drift = 0
+        self.added_pages = 0
+        self.seen_ids = set()
+        self.previous_end = None
+
+    def must_refetch(self, page_summaries, served):
+        """Check whether a page possibly served before the previous one could have missed auctions (fetch it again)"""
+        # served: (start, end) interval in which the server produced the page (None: pages fetched in order).
+        # If the page was requested before the previous page was answered, the server may have produced it first:
+        # auctions added in between are then invisible to both pages, and without any repeated auction the gap
+        # can't be measured. A repeated auction proves the page was produced after the previous one.
+        if served is None or self.previous_end is None or served[0] >= self.previous_end:
+            return False
+        return not any(summary['Id'] in self.seen_ids for summary in page_summaries if summary is not None)
+
+    def advance(self, page_summaries, served=None):
+        """Register a fetched page and return the summaries not listed on previous pages"""
+        new_summaries = [summary for summary in page_summaries if summary is None or summary['Id'] not in self.seen_ids]
+        repeated = len(page_summaries) - len(new_summaries)
+        if repeated:
+            # Move the last pages by as many pages as the drift grew
+            added_pages = math.ceil((self.drift + repeated) / auctions_per_page) - math.ceil(self.drift / auctions_per_page)
+            self.drift += repeated
+            self.last_page += added_pages
+            self.max_page += added_pages
+            self.added_pages += added_pages
+        self.seen_ids.update(summary['Id'] for summary in page_summaries if summary is not None)
+        self.previous_end = served[1] if served is not None else None
+        return new_summaries
@@ -1,27 +1,201 @@
 import os
-import pandas as pd
+import hashlib
+from file_storage import atomic_write
 
-home_dir = 'D:\\Programming\\Python\\TibiaAuctions'
+# Datasets of an analysis session, loaded on first access (import quick_load as ql; ql.sa ...):
+#   adf     every auction (compact dtypes, no Bestiary)     sa  successful auctions     fa  failed auctions
+#   fu      character follow-up                             cl  creature library        worlds  game worlds
+#   ast     auction status record                           bestiary  auction x creature kill matrix
+# pandas, pyarrow and the dataset modules are only imported by the loaders: importing this module takes milliseconds
+# and a session only pays for the datasets it touches
 
-os.chdir(home_dir)
+# Data directory (BAZAAR_HOME overrides it; the current directory if it does not exist)
+home_dir = os.environ.get('BAZAAR_HOME', 'D:\\Programming\\Python\\TibiaAuctions')
+if not os.path.isdir(home_dir):
+    home_dir = os.getcwd()
+# Columnar cache (uncompressed Feather files, memory-mapped on read), in the data directory
+cache_dirname = 'quick_load_cache'
+# Version of the dataset builders, part of every cache signature (bump it to invalidate the cache)
+cache_version = '1'
+signature_key = b'quick_load_signature'
 
-adf = pd.read_pickle('last_full_scrape.pkl')
-nb = adf.drop('Bestiary', axis=1)
+store_dirname = 'auction_store'
+legacy_filename = 'last_full_scrape.pkl'
+database_filename = 'bazaar.sqlite'
+followup_filename = 'character_followup.pkl'
+status_filename = 'auction_status_record.pkl'
+creatures_filename = 'creature_library.pkl'
+worlds_filename = 'tibia_game_worlds.pkl'
 
-won_auctions = nb[adf.Type.eq("W")]
-sa = won_auctions[won_auctions.Status.ne("cancelled")]
 
-fa = pd.DataFrame()
-failed_auctions = nb[nb.Type.eq("M")]
-also_failed = won_auctions[won_auctions.Status.eq("cancelled")]
-fa = fa.append(failed_auctions)
-fa = fa.append(also_failed)
+def data_path(filename):
+    return os.path.join(home_dir, filename)
 
 
-fu = pd.read_pickle('character_followup.pkl')
+def database_sources():
+    """Database file (and its write-ahead log), empty if there is no database"""
+    if not os.path.isfile(data_path(database_filename)):
+        return []
+    return [data_path(database_filename), data_path(database_filename + '-wal')]
 
-cl = pd.read_pickle('creature_library.pkl')
 
-worlds = pd.read_pickle('tibia_game_worlds.pkl')
+def source_signature(sources):
+    """Hash of the size and modification time of every source file (a missing file counts as well)"""
+    signature = hashlib.sha1(cache_version.encode())
+    for path in sources:
+        try:
+            stat = os.stat(path)
+            signature.update(f'{path}|{stat.st_size}|{stat.st_mtime_ns}\n'.encode())
+        except FileNotFoundError:
+            signature.update(f'{path}|missing\n'.encode())
+    return signature.hexdigest().encode()
 
-ast = pd.read_pickle('auction_status_record.pkl')
\ No newline at end of file
+
+def cached_frame(name, sources, build):
+    """Dataframe from the cache if its sources have not changed since it was cached (else built and cached)"""
+    import pyarrow as pa
+    import pyarrow.feather as feather
+
+    cache_path = os.path.join(home_dir, cache_dirname, name + '.feather')
+    signature = source_signature(sources)
+    if os.path.isfile(cache_path):
+        with pa.memory_map(cache_path) as cache_file:
+            reader = pa.ipc.open_file(cache_file)
+            if (reader.schema.metadata or {}).get(signature_key) == signature:
+                return reader.read_all().to_pandas()
+
+    dataframe = build()
+    try:
+        table = pa.Table.from_pandas(dataframe)
+    except (pa.ArrowInvalid, pa.ArrowTypeError) as error:
+        print(f'{name}: not cached ({error})')
+        return dataframe
+    table = table.replace_schema_metadata({**(table.schema.metadata or {}), signature_key: signature})
+    # Another session never reads a half-written file
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    with atomic_write(cache_path, 'wb') as cache_file:
+        feather.write_feather(table, cache_file, compression='uncompressed')
+    # Same dtypes as the next sessions, which read the cached table
+    return table.to_pandas()
+
+
+def database_table(table, columns=None):
+    from bazaar_database import BazaarDatabase
+
+    bazaar_database = BazaarDatabase(data_path(database_filename))
+    try:
+        return bazaar_database.load(table, columns=columns)
+    finally:
+        bazaar_database.close()
+
+
+def load_adf():
+    if database_sources():
+        sources = database_sources()
+    elif os.path.isdir(data_path(store_dirname)):
+        # Partition and patch files are never rewritten: a new append or patch always rewrites the manifest
+        sources = [os.path.join(data_path(store_dirname), 'manifest.json')]
+    else:
+        sources = [data_path(legacy_filename)]
+    return cached_frame('adf', sources + [data_path(worlds_filename)], build_adf)
+
+
+def build_adf():
+    from auction_store import load_auctions, dataframe_columns
+    from auction_dtypes import compact_auctions
+
+    columns = [column for column in dataframe_columns if column != 'Bestiary']
+    if database_sources():
+        auctions = database_table('auctions', columns)
+    elif os.path.isdir(data_path(store_dirname)):
+        auctions = load_auctions(columns=columns, path=data_path(store_dirname))
+    else:
+        auctions = read_pickle(legacy_filename)[columns]
+    return compact_auctions(auctions, dataset('worlds'))
+
+
+def load_sa():
+    adf = dataset('adf')
+    won_auctions = adf[adf.Type.eq('W')]
+    return won_auctions[won_auctions.Status.ne('cancelled')]
+
+
+def load_fa():
+    import pandas as pd
+
+    adf = dataset('adf')
+    return pd.concat([adf[adf.Type.eq('M')], adf[adf.Type.eq('W') & adf.Status.eq('cancelled')]])
+
+
+def load_fu():
+    if database_sources():
+        return cached_frame('fu', database_sources(), lambda: database_table('followup'))
+    return cached_frame('fu', [data_path(followup_filename)], lambda: read_pickle(followup_filename))
+
+
+def load_ast():
+    if database_sources():
+        return cached_frame('ast', database_sources(), lambda: database_table('status'))
+    return cached_frame('ast', [data_path(status_filename)], lambda: read_pickle(status_filename))
+
+
+def load_cl():
+    return cached_frame('cl', [data_path(creatures_filename)], lambda: read_pickle(creatures_filename))
+
+
+def load_worlds():
+    return cached_frame('worlds', [data_path(worlds_filename)], lambda: read_pickle(worlds_filename))
+
+
+def load_bestiary():
+    # Not cached: built from the database's Bestiary column (JSON), else read from the store's sparse matrices
+    # (or the legacy pickle)
+    from auction_store import load_bestiary
+    from bestiary_matrix import BestiaryMatrix, library_creatures
+
+    # Matrix columns follow the creature library of the data directory (read once, then kept by bestiary_matrix)
+    library_creatures(data_path(creatures_filename))
+    if database_sources():
+        auctions = database_table('auctions', ['Id', 'Bestiary'])
+        return BestiaryMatrix.from_dicts(auctions['Id'], auctions['Bestiary'])
+    return load_bestiary(path=data_path(store_dirname))
+
+
+def read_pickle(filename):
+    import pandas as pd
+
+    return pd.read_pickle(data_path(filename))
+
+
+# Lazily loaded datasets: {attribute: loader}
+loaders = {'adf': load_adf, 'sa': load_sa, 'fa': load_fa, 'fu': load_fu, 'cl': load_cl, 'worlds': load_worlds,
+           'ast': load_ast, 'bestiary': load_bestiary}
+# 'from quick_load import *' loads every dataset (from the cache, when up to date)
+__all__ = list(loaders)
+
+
+def dataset(name):
+    """Dataset by attribute name (loaded on the first call, then kept in the module namespace)"""
+    namespace = globals()
+    if name not in namespace:
+        namespace[name] = loaders[name]()
+    return namespace[name]
+
+
+def __getattr__(name):
+    # Only called for attributes not in the module namespace, i.e. datasets not loaded yet
+    if name in loaders:
+        return dataset(name)
+    if name == 'nb':
+        return dataset('adf')
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
+def __dir__():
+    return sorted(set(globals()) | set(loaders))
+
+
+def unload(*names):
+    """Drop loaded datasets (all of them by default): the next access loads them again, if changed from their sources"""
+    for name in names or loaders:
+        globals().pop(name, None)
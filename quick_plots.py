@@ -2,22 +2,24 @@ from matplotlib import pyplot as plt
 import pandas as pd
 import datetime
 import math
+from bestiary_matrix import BestiaryMatrix
+from auction_dtypes import vocation_filter
 
 
 def f_knights(df):
-    return auction_filter(df, column='Vocation', values=['EK', 'K'])
+    return vocation_filter(df, 'K')
 
 
 def f_paladins(df):
-    return auction_filter(df, column='Vocation', values=['RP', 'P'])
+    return vocation_filter(df, 'P')
 
 
 def f_druids(df):
-    return auction_filter(df, column='Vocation', values=['ED', 'D'])
+    return vocation_filter(df, 'D')
 
 
 def f_sorcerers(df):
-    return auction_filter(df, column='Vocation', values=['MS', 'S'])
+    return vocation_filter(df, 'S')
 
 
 def auction_filter(df, column, values):
@@ -43,7 +45,7 @@ def plot_vocation_split(adf, plot_title=None, ax=None):
     voc_count = []
     for voc in vocations:
         voc_names.append(voc[0])
-        voc_count.append(len(adf[adf.Vocation.isin(voc)]))
+        voc_count.append(len(vocation_filter(adf, voc[0])))
 
     subtitle = f'\n({len(adf):,} auctions)'
     plt_title = (plot_title if plot_title else '') + subtitle
@@ -168,7 +170,7 @@ def plot_vocation_progress(auctions):
     for voc in vocations:
         color = next(plot_color)
 
-        voc_dfs = [day_df[day_df.Vocation.isin(voc)] for day_df in [g[1] for g in gbe]]
+        voc_dfs = [vocation_filter(day_df, voc[0]) for day_df in [g[1] for g in gbe]]
         daily_means = [df[['Bid', 'Level']].mean() for df in voc_dfs]
         bids = [pair[0] for pair in daily_means]
         levels = [pair[1] for pair in daily_means]
@@ -209,7 +211,7 @@ def plot_vocation_prices(auctions, selected_vocations=None):
     for voc in vocations:
         color = next(plot_color)
 
-        voc_dfs = [day_df[day_df.Vocation.isin(voc)] for day_df in [g[1] for g in gbe]]
+        voc_dfs = [vocation_filter(day_df, voc[0]) for day_df in [g[1] for g in gbe]]
         daily_means = [df[['Bid', 'Level']].mean() for df in voc_dfs]
         bids = [pair[0] for pair in daily_means]
         # levels = [pair[1] for pair in daily_means]
@@ -298,22 +300,17 @@ def auction_pie_plot(slices, labels, absolute=False, plot_title=None):
     plt.show()
 
 
-def plot_top_bestiary(auctions, top=3, plot_title=False):
+def plot_top_bestiary(auctions, top=3, plot_title=False, bestiary=None):
 
-    bestiary = {}
-    best_entries = list(auctions.Bestiary)
-
-    for nth_bestiary in best_entries:
-        for creature in nth_bestiary.keys():
-            if creature in bestiary.keys():
-                bestiary[creature] = bestiary[creature] + nth_bestiary[creature]
-            else:
-                bestiary[creature] = nth_bestiary[creature]
-
-    total_kills = sum(list(bestiary.values()))
-    sorted_bestiary = {creature: bestiary[creature] for creature in sorted(bestiary, key=lambda creature_name: bestiary[creature_name], reverse=True)}
+    # Kill totals per creature: column sums of the sparse auction x creature matrix
+    if bestiary is None:
+        bestiary = BestiaryMatrix.from_dicts(auctions.Id, auctions.Bestiary)
+    else:
+        bestiary = bestiary.select(auctions.Id)
+    sorted_bestiary = bestiary.kills()
 
-    top_kills = {creature: sorted_bestiary[creature] for creature in list(sorted_bestiary.keys())[0:top]}
+    total_kills = int(sorted_bestiary.sum())
+    top_kills = {creature: int(kills) for creature, kills in sorted_bestiary.iloc[0:top].items()}
     total_top_kills = sum(list(top_kills.values()))
 
     other_kills = total_kills - total_top_kills
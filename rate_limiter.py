@@ -0,0 +1,122 @@
+import time
+import asyncio
+import threading
+from urllib.parse import urlsplit
+
+# AIMD parameters: requests per second allowed on each host
+initial_rate = 1.0
+min_rate = 0.1
+max_rate = 10.0
+# Maximum number of requests that can start back to back after an idle period
+burst = 2
+# Additive increase, per request/second, after each fast successful response
+increase_step = 0.05
+# Multiplicative decrease after a throttled (403, 429) or failed (5xx, connection error) response
+decrease_factor = 0.5
+# Responses slower than this (seconds) count as a congestion signal (mild decrease)
+slow_latency = 5.0
+slow_decrease_factor = 0.9
+# Pause after a throttled response when the server gives no 'Retry-After' header (seconds)
+throttle_pause = 5.0
+# Responses that signal we're being rate limited / the server is struggling
+throttle_status_codes = (403, 429)
+error_status_codes = (500, 502, 503, 504)
+
+
+class HostBudget:
+    """Token bucket of a single host, with a request rate adjusted from observed responses (AIMD)"""
+
+    def __init__(self, rate=initial_rate, lowest_rate=min_rate, highest_rate=max_rate, burst_size=burst):
+        self.rate = rate
+        self.lowest_rate = lowest_rate
+        self.highest_rate = highest_rate
+        self.burst_size = burst_size
+        self.tokens = burst_size
+        self.updated = time.monotonic()
+        self.paused_until = 0
+        self.last_decrease = 0
+        self.throttled = 0
+        self.lock = threading.Lock()
+
+    def reserve(self):
+        """Take a token and return the number of seconds to wait before starting the request"""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst_size, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            # Tokens may go negative: each caller waits for its own reserved slot
+            self.tokens -= 1
+            return max(-self.tokens / self.rate, self.paused_until - now, 0)
+
+    def feedback(self, status, latency, retry_after=None):
+        """Adjust the request rate from a response status code (None: connection error) and latency"""
+        with self.lock:
+            now = time.monotonic()
+            if status in throttle_status_codes or status in error_status_codes or status is None:
+                if status in throttle_status_codes:
+                    self.throttled += 1
+                    self.paused_until = max(self.paused_until, now + (retry_after if retry_after else throttle_pause))
+                    self.tokens = min(self.tokens, 0)
+                # Several requests in flight see the same burst of errors: decrease at most once per interval
+                if now - self.last_decrease > 1 / self.rate:
+                    self.rate = max(self.lowest_rate, self.rate * decrease_factor)
+                    self.last_decrease = now
+            elif latency > slow_latency:
+                if now - self.last_decrease > 1 / self.rate:
+                    self.rate = max(self.lowest_rate, self.rate * slow_decrease_factor)
+                    self.last_decrease = now
+            else:
+                self.rate = min(self.highest_rate, self.rate + increase_step)
+
+
+class RateLimiter:
+    """Per-host adaptive rate limiter shared by every fetcher (threads and asyncio tasks)"""
+
+    def __init__(self):
+        self.budgets = {}
+        self.host_settings = {}
+        self.lock = threading.Lock()
+
+    def configure(self, host, rate=None, lowest_rate=None, highest_rate=None, burst_size=None):
+        """Set the request budget of a host ('www.tibia.com', 'www.tibiaring.com' ...)"""
+        settings = dict(rate=rate, lowest_rate=lowest_rate, highest_rate=highest_rate, burst_size=burst_size)
+        settings = {key: value for key, value in settings.items() if value is not None}
+        with self.lock:
+            self.host_settings[host] = settings
+            self.budgets.pop(host, None)
+
+    def budget(self, url):
+        """Token bucket of the host of an url (created on first use)"""
+        host = urlsplit(url).hostname
+        with self.lock:
+            if host not in self.budgets:
+                self.budgets[host] = HostBudget(**self.host_settings.get(host, {}))
+            return self.budgets[host]
+
+    def acquire(self, url):
+        """Block until a request to the url's host may start"""
+        wait = self.budget(url).reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self, url):
+        """Wait (without blocking the event loop) until a request to the url's host may start"""
+        wait = self.budget(url).reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def record(self, url, status, latency, retry_after=None):
+        """Report the outcome of a request: status code (None for connection errors) and latency in seconds"""
+        self.budget(url).feedback(status, latency, retry_after)
+
+    def rate(self, url):
+        """Current request rate (requests per second) of the url's host"""
+        return self.budget(url).rate
+
+
+def retry_after_seconds(header_value):
+    """Seconds to wait from a 'Retry-After' header (None if missing or given as a date)"""
+    try:
+        return max(float(header_value), 0)
+    except (TypeError, ValueError):
+        return None
@@ -0,0 +1,58 @@
+import pandas as pd
+from tibia_dates import strings_to_datetime64
+
+
+class RecordBatch:
+    """Existing dataframe plus new rows kept as plain records, merged into a single dataframe once per checkpoint"""
+
+    def __init__(self, dataframe=None, columns=None, date_columns=()):
+        # Row positions cover the stored dataframe first, then the pending records (matching AuctionIndex positions)
+        self.columns = list(columns) if columns is not None else list(dataframe.columns)
+        # Columns kept as date strings in the records, converted in a single pass when records become a dataframe
+        self.date_columns = list(date_columns)
+        self.dataframe = dataframe if dataframe is not None else pd.DataFrame(columns=self.columns)
+        self.records = []
+
+    def __len__(self):
+        return len(self.dataframe) + len(self.records)
+
+    def append(self, record):
+        """Add a new row ({column: value} dictionary)"""
+        self.records.append(record)
+
+    def extend(self, records):
+        """Add several new rows"""
+        self.records.extend(records)
+
+    def get_value(self, position, column):
+        """Value of a column at a given row position"""
+        stored_rows = len(self.dataframe)
+        if position < stored_rows:
+            return self.dataframe.iat[position, self.dataframe.columns.get_loc(column)]
+        return self.records[position - stored_rows].get(column)
+
+    def set_value(self, position, column, value):
+        """Set the value of a column at a given row position"""
+        stored_rows = len(self.dataframe)
+        if position < stored_rows:
+            self.dataframe.iat[position, self.dataframe.columns.get_loc(column)] = value
+        else:
+            self.records[position - stored_rows][column] = value
+
+    def records_to_dataframe(self, records):
+        """Convert a list of records to a dataframe with the batch columns (date columns as datetime64)"""
+        dataframe = pd.DataFrame.from_records(records, columns=self.columns)
+        for column in self.date_columns:
+            dataframe[column] = strings_to_datetime64(dataframe[column].tolist())
+        return dataframe
+
+    def to_dataframe(self):
+        """Merge the pending records into the stored dataframe (single copy) and return it"""
+        if self.records:
+            new_rows = self.records_to_dataframe(self.records)
+            if self.dataframe.empty:
+                self.dataframe = new_rows
+            else:
+                self.dataframe = pd.concat([self.dataframe, new_rows], ignore_index=True)
+            self.records = []
+        return self.dataframe
@@ -0,0 +1,189 @@
+import sys
+import json
+import time
+import bisect
+import threading
+import contextlib
+from file_storage import atomic_write
+
+# Prefix of every exported metric name
+metric_prefix = 'tibia_bazaar_'
+# Upper bounds of the latency histogram buckets, in seconds
+latency_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+# Minimum interval between two redraws of the progress line, and between two writes of the metrics file, in seconds
+progress_interval = 1.0
+export_interval = 15.0
+
+
+class Histogram:
+    """Latency histogram with fixed buckets (cumulative counts are computed on export)"""
+
+    def __init__(self, buckets=latency_buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative_counts(self):
+        """[(upper_bound, cumulative_count)], the last bound being '+Inf'"""
+        cumulative = []
+        total = 0
+        for bound, count in zip(list(self.buckets) + ['+Inf'], self.counts):
+            total += count
+            cumulative.append((bound, total))
+        return cumulative
+
+
+class Metrics:
+    """Counters, gauges and latency histograms of a run (thread-safe), exported as a Prometheus textfile or JSON"""
+
+    def __init__(self):
+        # Series are keyed by (name, ((label, value), ...)); export_path: file written by export() and maybe_export()
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self.start_time = time.time()
+        self.export_path = None
+        self.last_export = time.monotonic()
+
+    def inc(self, name, value=1, **labels):
+        """Add to a counter"""
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        """Set a gauge"""
+        with self.lock:
+            self.gauges[(name, tuple(sorted(labels.items())))] = value
+
+    def observe(self, name, seconds, **labels):
+        """Record a duration in a latency histogram"""
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(seconds)
+
+    @contextlib.contextmanager
+    def timer(self, name, **labels):
+        """Record the duration of a block in a latency histogram"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def total(self, name, **labels):
+        """Sum of a counter over every series matching the given labels"""
+        with self.lock:
+            return sum(value for (series_name, series_labels), value in self.counters.items()
+                       if series_name == name and all(item in series_labels for item in labels.items()))
+
+    def snapshot(self):
+        """Every series as a JSON-serializable dictionary"""
+        with self.lock:
+            return {'start_time': self.start_time,
+                    'elapsed': round(time.time() - self.start_time, 3),
+                    'counters': [dict(name=name, labels=dict(labels), value=value)
+                                 for (name, labels), value in sorted(self.counters.items())],
+                    'gauges': [dict(name=name, labels=dict(labels), value=value)
+                               for (name, labels), value in sorted(self.gauges.items())],
+                    'histograms': [dict(name=name, labels=dict(labels), count=histogram.count,
+                                        sum=round(histogram.sum, 6), buckets=histogram.cumulative_counts())
+                                   for (name, labels), histogram in sorted(self.histograms.items())]}
+
+    def to_prometheus(self):
+        """Every series in the Prometheus text exposition format"""
+        lines = []
+        with self.lock:
+            for series, kind in ((self.counters, 'counter'), (self.gauges, 'gauge')):
+                for name in sorted({name for name, _ in series}):
+                    lines.append(f'# TYPE {metric_prefix}{name} {kind}')
+                    lines += [f'{metric_prefix}{name}{label_text(labels)} {value}'
+                              for (series_name, labels), value in sorted(series.items()) if series_name == name]
+            for name in sorted({name for name, _ in self.histograms}):
+                lines.append(f'# TYPE {metric_prefix}{name} histogram')
+                for (series_name, labels), histogram in sorted(self.histograms.items()):
+                    if series_name != name:
+                        continue
+                    for bound, count in histogram.cumulative_counts():
+                        lines.append(f'{metric_prefix}{name}_bucket{label_text(labels + (("le", bound),))} {count}')
+                    lines.append(f'{metric_prefix}{name}_sum{label_text(labels)} {histogram.sum:.6f}')
+                    lines.append(f'{metric_prefix}{name}_count{label_text(labels)} {histogram.count}')
+        lines.append(f'# TYPE {metric_prefix}run_elapsed_seconds gauge')
+        lines.append(f'{metric_prefix}run_elapsed_seconds {time.time() - self.start_time:.3f}')
+        return '\n'.join(lines) + '\n'
+
+    def export(self, path=None):
+        """Write every series to path (default: export_path): JSON for '.json' files, Prometheus textfile otherwise"""
+        path = path if path else self.export_path
+        if not path:
+            return
+        # The textfile collector never reads a half-written file
+        with atomic_write(path) as metrics_file:
+            if path.endswith('.json'):
+                json.dump(self.snapshot(), metrics_file, indent=1)
+            else:
+                metrics_file.write(self.to_prometheus())
+        self.last_export = time.monotonic()
+
+    def maybe_export(self):
+        """Export, at most once per export_interval"""
+        if self.export_path and time.monotonic() - self.last_export >= export_interval:
+            self.export()
+
+
+class ProgressDisplay:
+    """Single console status line, redrawn at most once per interval (the metrics file is refreshed along with it)"""
+
+    def __init__(self, interval=progress_interval):
+        self.interval = interval
+        self.last_draw = 0.0
+        self.line_length = 0
+
+    def due(self):
+        """Check whether the line may be redrawn (lets hot loops skip formatting the status text)"""
+        return time.monotonic() - self.last_draw >= self.interval
+
+    def update(self, text, force=False):
+        if not force and not self.due():
+            return
+        self.last_draw = time.monotonic()
+        sys.stdout.write('\r' + text.ljust(self.line_length))
+        sys.stdout.flush()
+        self.line_length = len(text)
+        metrics.maybe_export()
+
+    def finish(self):
+        """End the status line (later output starts on a new line)"""
+        if self.line_length:
+            sys.stdout.write('\n')
+            sys.stdout.flush()
+        self.line_length = 0
+        self.last_draw = 0.0
+
+
+def label_text(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{label}="{value}"' for label, value in labels) + '}'
+
+
+def add_metrics_arguments(parser):
+    """Command line option shared by the scraper, the status updater and the follow-up"""
+    parser.add_argument('--metrics', default=None, metavar='FILE',
+                        help='write run metrics to FILE every 15 seconds and at the end of the run '
+                             '(JSON if FILE ends with .json, Prometheus textfile format otherwise)')
+
+
+# Run metrics and progress line shared by every module
+metrics = Metrics()
+progress = ProgressDisplay()
@@ -0,0 +1,87 @@
+import datetime
+import numpy as np
+
+# Month lookup table ('Jan' -> 1 ...)
+months = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
+month_numbers = {month: number for number, month in enumerate(months, start=1)}
+# Month names packed as integers (3 code points), sorted for a vectorized lookup
+_month_keys = np.array([(ord(month[0]) << 16) | (ord(month[1]) << 8) | ord(month[2]) for month in months])
+_month_order = np.argsort(_month_keys)
+_sorted_month_keys = _month_keys[_month_order]
+# Fixed-format date: 'Aug 14 2020, 10:00 CEST' (day zero-padded, seconds and time zone optional)
+_fixed_width = len('Aug 14 2020, 10:00')
+# Below this batch size, dates are converted one by one (the vectorized pass has a fixed setup cost)
+vector_threshold = 32
+
+
+def str_to_datetime(date_str):
+    """Converts string formatted as 'Aug 14, 2020 <dismissed_info>' to datetime object (2020, 8, 14)"""
+    date_list = date_str.replace(',', '').split(' ')
+    month = month_numbers[date_list[0]]
+    day = int(date_list[1])
+    year = int(date_list[2])
+    (hour, minute) = list(map(int, date_list[3].split(':')[0:2]))
+    return datetime.datetime(year, month, day, hour, minute)
+    #return datetime.date(year, month, day)
+
+
+def strings_to_datetime64(date_strings):
+    """Convert a batch of date strings ('Aug 14 2020, 10:00 CEST', '\\xa0' separators allowed) to a datetime64[ns] array"""
+    # Missing or unreadable dates are NaT, datetime values are kept (e.g. records restored from a converted dataframe). Fixed-format dates are parsed in a single vectorized pass over the code
+    # points of every string; anything else (e.g. unpadded days) falls back to str_to_datetime
+    date_count = len(date_strings)
+    output = np.full(date_count, np.datetime64('NaT'), dtype='datetime64[ns]')
+    if date_count == 0:
+        return output
+    texts = np.array([text if isinstance(text, str) else '' for text in date_strings], dtype=f'U{_fixed_width}')
+    chars = texts.view(np.uint32).reshape(date_count, _fixed_width)
+    # '\xa0' cleanup in the same pass
+    chars = np.where(chars == 0xA0, 0x20, chars)
+
+    digits = chars.astype(np.int64) - ord('0')
+    digit_columns = [4, 5, 7, 8, 9, 10, 13, 14, 16, 17]
+    month_keys = (chars[:, 0].astype(np.int64) << 16) | (chars[:, 1].astype(np.int64) << 8) | chars[:, 2]
+    month_positions = np.searchsorted(_sorted_month_keys, month_keys).clip(0, len(months) - 1)
+    fixed_format = ((_sorted_month_keys[month_positions] == month_keys)
+                    & ((digits[:, digit_columns] >= 0) & (digits[:, digit_columns] <= 9)).all(axis=1)
+                    & (chars[:, 3] == 0x20) & (chars[:, 6] == 0x20) & (chars[:, 11] == ord(','))
+                    & (chars[:, 12] == 0x20) & (chars[:, 15] == ord(':')))
+
+    month = _month_order[month_positions] + 1
+    day = digits[:, 4] * 10 + digits[:, 5]
+    year = digits[:, 7] * 1000 + digits[:, 8] * 100 + digits[:, 9] * 10 + digits[:, 10]
+    hour = digits[:, 13] * 10 + digits[:, 14]
+    minute = digits[:, 16] * 10 + digits[:, 17]
+    # Days are checked against the length of their month (e.g. 'Feb 30' is unreadable, as for str_to_datetime)
+    month_starts = ((year - 1970) * 12 + month - 1).astype('datetime64[M]')
+    month_days = ((month_starts + 1).astype('datetime64[D]') - month_starts.astype('datetime64[D]')).astype(np.int64)
+    fixed_format &= (day >= 1) & (day <= month_days) & (hour <= 23) & (minute <= 59)
+
+    rows = np.flatnonzero(fixed_format)
+    output[rows] = (month_starts[rows].astype('datetime64[D]') + (day[rows] - 1).astype('timedelta64[D]')
+                    + (hour[rows] * 60 + minute[rows]).astype('timedelta64[m]'))
+
+    # Other formats: one by one
+    for row in np.flatnonzero(~fixed_format):
+        text = date_strings[row]
+        date = text if isinstance(text, datetime.datetime) else text_to_datetime(text)
+        if date is not None:
+            output[row] = np.datetime64(date, 'ns')
+    return output
+
+
+def strings_to_datetimes(date_strings):
+    """Convert a batch of date strings to datetime objects (None for missing or unreadable dates)"""
+    if len(date_strings) < vector_threshold:
+        return [text_to_datetime(text) for text in date_strings]
+    return strings_to_datetime64(date_strings).astype('datetime64[us]').tolist()
+
+
+def text_to_datetime(text):
+    """str_to_datetime for raw page text ('\\xa0' separators), None for missing or unreadable dates"""
+    if not isinstance(text, str) or not text:
+        return None
+    try:
+        return str_to_datetime(text.replace('\xa0', ' '))
+    except (KeyError, ValueError, IndexError):
+        return None
@@ -1,112 +1,130 @@
 import requests
 import datetime
-from requests_html import HTML
 import pandas as pd
 import os
 import concurrent.futures
 import logging
 import pickle
-from bazaar_scraper import str_to_datetime, get_page_count
+import argparse
+from bazaar_scraper import get_page_count, get_last_page
+from history_parser import parse_history_page
 import pytz
+import http_client
+from auction_index import AuctionIndex
+from record_batch import RecordBatch
+from html_archive import add_archive_arguments
+from crawl_watermark import CrawlWatermark
+from bazaar_database import BazaarDatabase, add_database_arguments
+from run_metrics import metrics, add_metrics_arguments
 
 # Global variables:
 request_headers = {
     'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/70.0.3538.77 Safari/537.36'}
 #   Auction history url (main page)
-root_url = 'https://www.tibia.com/charactertrade/?subtopic=pastcharactertrades'
+root_url = http_client.tibia_url + '/charactertrade/?subtopic=pastcharactertrades'
 # Server save hour (CET)
 SS_HOUR = 10
+# Age (days) after which the status of an auction is recorded as 'Final' and no longer followed
+FINAL_AGE = 8
 
 dataframe_columns = ['Id', 'Name', 'End', 'Day0', 'Day1', 'Day2', 'Day3', 'Day4', 'Day5', 'Day6', 'Day7', 'Final']
 # File to which the full dataframe will be written at the end of the run
 status_record_filename = 'auction_status_record.pkl'
+# Crawl watermark: newest followed auction and oldest auction without a 'Final' status
+watermark_filename = 'auction_status_watermark.json'
 
 
-def update_auction_status(status_df):
-    """Update auction status"""
+def update_auction_status(status_df, cutoff=None):
+    """Update auction status (only pages listing auctions that ended after cutoff, if given)"""
 
     max_page = get_page_count()
-    print(f"\nTotal number of pages: {max_page:,}", end='\n')
+    last_page = get_last_page(1, max_page, cutoff)
+    print(f"\nTotal number of pages: {max_page:,} ({last_page:,} to be crawled)", end='\n')
+
+    # New rows are collected as records and merged once at the end of the run; Id -> row position index
+    status_records = RecordBatch(status_df, columns=dataframe_columns)
+    status_index = AuctionIndex(status_df)
 
     # Integer immediately before first page to be scraped (usually =0)
     page_number = 0
 
     # Loop through each 'auction history' page
-    while page_number <= max_page:
+    while page_number < last_page:
         page_number += 1
 
         page_url = root_url + '&currentpage=' + str(page_number)
-        page_req = requests.get(page_url, headers=request_headers)
-
-        if page_req.status_code == 200:
-            page_html = HTML(html=page_req.text)
-            status_df, auction_count, min_age, max_age = update_auctions_in_page(status_df, page_html)
+        try:
+            page_req = http_client.get(page_url, headers=request_headers)
+        except requests.RequestException:
+            print(f"\nFailed to access page {page_number} (connection error).")
+            continue
+
+        page_summaries = parse_history_page(page_req.text) if page_req.status_code == 200 else None
+        if page_summaries is not None:
+            status_records, auction_count, min_age, max_age = update_auctions_in_page(status_records, page_summaries, status_index)
+            metrics.inc('pages_total')
+            metrics.inc('status_rows_total', auction_count)
             print(f'\nPage {page_number:,}: {auction_count} auctions updated ({min_age}-{max_age} days old).', end='', flush=True)
 
+        elif page_req.status_code == 200:
+            print(f"\nFailed to parse page {page_number}.")
+
         else:
-            min_age = -1
             error_code = page_req.status_code
             error_description = requests.status_codes._codes[error_code][0]
             print(f"\nFailed to access page {page_number} (error code {error_code}: {error_description}).")
 
         page_req.close()
 
-        if min_age > 8:
-            print(f'\nProcess interrupted on page {page_number}/{max_page}: older auctions already finalized.')
-            break
+    if last_page < max_page:
+        print(f'\nCrawl stopped on page {last_page}/{max_page}: older auctions already finalized.')
+    return status_records.to_dataframe()
 
-    return status_df
 
-
-def update_auctions_in_page(status_dataframe, page_html):
+def update_auctions_in_page(status_records, page_summaries, status_index=None):
     """Scrape basic info on every auction in a page"""
 
-    auction_tables = page_html.find(".Auction")
+    if status_index is None:
+        status_index = AuctionIndex(status_records.dataframe)
+        status_index.extend(record['Id'] for record in status_records.records)
+    auction_tables = [summary for summary in page_summaries if summary is not None]
 
     # Loop through each auction on the page
     max_age = 0
     min_age = 100
     valid_count = 0
-    for auction_html in auction_tables:
+    for auction_summary in auction_tables:
 
-        summary_dict, age, status, column = get_auction_status(auction_html)
+        summary_dict, age, status, column = get_auction_status(auction_summary)
 
         if isinstance(summary_dict, dict):
             valid_count += 1
 
-            if len(status_dataframe) > 0:
-                id_match = status_dataframe['Id'].eq(summary_dict['Id'])
-                matching_row = id_match.index[id_match == True].tolist()
-            else:
-                matching_row = None
+            matching_row = status_index.get(summary_dict['Id'])
 
-            if matching_row:
-                status_dataframe.at[matching_row[0], column] = status
+            if matching_row is not None:
+                status_records.set_value(matching_row, column, status)
             else:
-                new_row = pd.DataFrame(summary_dict, index=[0])
-                new_row.at[0, column] = status
-                status_dataframe = status_dataframe.append(new_row)
+                summary_dict[column] = status
+                status_records.append(summary_dict)
+                status_index.append(summary_dict['Id'])
 
             max_age = max(max_age, age)
             min_age = min(min_age, age)
 
-    return status_dataframe, valid_count, min_age, max_age
+    return status_records, valid_count, min_age, max_age
 
 
-def get_auction_status(auction_html):
-    """Scrape auction summary data from an 'auction history' page"""
+def get_auction_status(auction_summary):
+    """Collect auction status data from a summary parsed from an 'auction history' page"""
 
-    auction_data = auction_html.find(".ShortAuctionData")[0].text.split("\n")
-    data = list(map(lambda date_str: date_str.replace(u"\xa0", " "), auction_data))
-    end_type = data[4][0]  # W: winning bid; M: minimum bid (failed auction)
+    end_type = auction_summary['Type']  # W: winning bid; M: minimum bid (failed auction)
 
     if end_type == 'W':
 
-        name = auction_html.find(".AuctionCharacterName")[0].text
-        header_table = auction_html.find(".AuctionHeader")[0]
-        char_link = list(header_table.find(".AuctionCharacterName")[0].links)[0]
-        auction_id = char_link.split("auctionid=")[-1].split("&")[0]
-        end = str_to_datetime(data[3])
+        name = auction_summary['Name']
+        auction_id = auction_summary['Id']
+        end = auction_summary['End']
 
         today = datetime.datetime.now(pytz.timezone('CET')).replace(tzinfo=None)
         current_hour = today.hour
@@ -115,12 +133,12 @@ def get_auction_status(auction_html):
         tomorrow = tomorrow.replace(minute=59, second=59, microsecond=0)
         auction_age = (tomorrow - end).days
 
-        if auction_age > 7:
+        if auction_age >= FINAL_AGE:
             column = 'Final'
         else:
             column = 'Day' + str(auction_age)
 
-        bid_status = auction_html.find(".CurrentBid")[0].text.replace("\n", " ")
+        bid_status = auction_summary['Status']
         auction_dict = dict(Id=auction_id, Name=name, End=end, Day0=None,
                             Day1=None, Day2=None, Day3=None, Day4=None, Day5=None, Day6=None, Day7=None, Final=None)
         return auction_dict, auction_age, bid_status, column
@@ -131,9 +149,31 @@ def get_auction_status(auction_html):
 
 if __name__ == "__main__":
 
+    # Command line options
+    parser = argparse.ArgumentParser(description='Tibia Auction Status Updater')
+    add_archive_arguments(parser)
+    add_metrics_arguments(parser)
+    add_database_arguments(parser)
+    args = parser.parse_args()
+    metrics.export_path = args.metrics
+    if args.from_archive or args.archive:
+        http_client.use_archive(args.from_archive or args.archive, from_archive=args.from_archive is not None)
+
     # Display status message on console
     print("\nRunning Tibia Auction Status Updater!")
-    if os.path.isfile(status_record_filename):
+    database = BazaarDatabase(args.database) if args.database else None
+    watermark = CrawlWatermark(watermark_filename)
+    if watermark.exists():
+        watermark.load()
+    now = datetime.datetime.now(pytz.timezone('CET')).replace(tzinfo=None)
+    oldest_followed = now - datetime.timedelta(days=FINAL_AGE + 1)
+    if database is not None:
+        # Only auctions still followed (no 'Final' status) or that can be listed on the pages to be crawled
+        print("\nRestoring followed auctions from database... ", end='', flush=True)
+        status_dataframe = database.load('status', where='"Final" IS NULL OR "End" >= ?',
+                                         parameters=[oldest_followed - datetime.timedelta(days=1)])
+        print(f"{len(status_dataframe):,} characters loaded!", end='\n')
+    elif os.path.isfile(status_record_filename):
         print("\nRestoring dataframe values from file... ", end='', flush=True)
         with open(status_record_filename, 'rb') as pkl_file:
             status_dataframe = pickle.load(pkl_file)
@@ -142,12 +182,24 @@ if __name__ == "__main__":
         print("\nNo stored results were found.", end='\n')
         status_dataframe = pd.DataFrame(columns=dataframe_columns)
 
+    # Crawl boundary: auctions older than FINAL_AGE days are never crawled, nor are finalized or known auctions
+    if watermark.newest_end is None and not status_dataframe.empty:
+        watermark.update(status_dataframe, status_dataframe['Final'].isna())
+    cutoff = watermark.cutoff(now, window_days=FINAL_AGE + 1)
+    cutoff = max(cutoff, oldest_followed) if cutoff is not None else oldest_followed
+
     # Scrape bazaar data for every auction
-    status_dataframe = update_auction_status(status_dataframe)
+    status_dataframe = update_auction_status(status_dataframe, cutoff)
+    http_client.close()
     status_dataframe = status_dataframe.sort_values(['End','Id']).reset_index(drop=True)
+    watermark.update(status_dataframe, status_dataframe['Final'].isna()).save()
 
-    # Write scraped data to external files
-    status_dataframe.to_pickle(status_record_filename)
+    # Write scraped data to external files (with --database: the followed auctions only)
+    if database is not None:
+        database.upsert('status', status_dataframe, keep_existing=True)
+        database.close()
+    else:
+        status_dataframe.to_pickle(status_record_filename)
 
     now = datetime.datetime.now()
     date = '_'.join(map(str, [now.year, now.month, now.day]))
@@ -160,4 +212,5 @@ if __name__ == "__main__":
     status_dataframe.to_pickle(pkl_name)
     status_dataframe.to_csv(csv_name, index=True, mode='a')
 
+    metrics.export()
     print(f"\nDone! Results written to {csv_name} and {pkl_name} files.")
@@ -0,0 +1,151 @@
+import time
+import pickle
+import contextlib
+import sqlite3
+import zstandard
+from file_storage import busy_timeout
+
+# Seconds a leased unit stays assigned to its worker without a renewal (then it is handed to another worker)
+lease_seconds = 300
+# Leases per unit before it is marked as failed
+max_attempts = 5
+
+
+class LeaseLost(Exception):
+    """Work unit leased to another worker after its lease expired"""
+
+
+class WorkQueue:
+    """Work units leased to worker processes (on this host or others) from a shared SQLite file"""
+
+    def __init__(self, path, lease_seconds=lease_seconds, max_attempts=max_attempts):
+        # Table units:   one row per unit; key is unique (a unit added twice is only queued once)
+        #                state: 'pending' -> 'leased' (worker, lease_expires) -> 'done' (result) | 'failed'
+        # Table markers: small values shared between workers ({name: value})
+        # Payloads, results and markers are zstd-compressed pickles
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.connection = sqlite3.connect(path, timeout=busy_timeout, isolation_level=None)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.executescript('''
+            CREATE TABLE IF NOT EXISTS units (id INTEGER PRIMARY KEY, kind TEXT, key TEXT UNIQUE, payload BLOB,
+                                              state TEXT, worker TEXT, lease_expires REAL, attempts INTEGER,
+                                              result BLOB, finished_at REAL);
+            CREATE INDEX IF NOT EXISTS units_state ON units (state, kind, id);
+            CREATE TABLE IF NOT EXISTS markers (name TEXT PRIMARY KEY, value BLOB, recorded_at REAL);
+        ''')
+        self.compressor = zstandard.ZstdCompressor()
+
+    def pack(self, value):
+        return self.compressor.compress(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+
+    def unpack(self, blob):
+        return pickle.loads(zstandard.ZstdDecompressor().decompress(blob)) if blob is not None else None
+
+    def add(self, units):
+        """Queue new units ([(kind, key, payload)]): return the number of units added (known keys are ignored)"""
+        with self.transaction():
+            return self.insert_units(units)
+
+    def insert_units(self, units):
+        added = 0
+        for kind, key, payload in units:
+            cursor = self.connection.execute('INSERT OR IGNORE INTO units (kind, key, payload, state, attempts) '
+                                             "VALUES (?, ?, ?, 'pending', 0)", (kind, key, self.pack(payload)))
+            added += cursor.rowcount
+        return added
+
+    def lease(self, worker, kind=None, limit=1):
+        """Lease up to limit pending units (of a kind, if given): [(unit_id, kind, payload)]"""
+        now = time.time()
+        with self.transaction():
+            # Units of dead or stalled workers go back to the queue (or fail after max_attempts leases)
+            self.connection.execute("UPDATE units SET state = CASE WHEN attempts < ? THEN 'pending' ELSE 'failed' END, "
+                                    "worker = NULL WHERE state = 'leased' AND lease_expires < ?",
+                                    (self.max_attempts, now))
+            query = "SELECT id, kind, payload FROM units WHERE state = 'pending'"
+            parameters = []
+            if kind is not None:
+                query += ' AND kind = ?'
+                parameters.append(kind)
+            rows = self.connection.execute(query + ' ORDER BY id LIMIT ?', parameters + [limit]).fetchall()
+            self.connection.executemany("UPDATE units SET state = 'leased', worker = ?, lease_expires = ?, "
+                                        'attempts = attempts + 1 WHERE id = ?',
+                                        [(worker, now + self.lease_seconds, unit_id) for unit_id, _, _ in rows])
+        return [(unit_id, unit_kind, self.unpack(payload)) for unit_id, unit_kind, payload in rows]
+
+    def renew(self, worker, unit_ids):
+        """Extend the leases of a worker's units (LeaseLost if any of them was handed to another worker)"""
+        with self.transaction():
+            for unit_id in unit_ids:
+                cursor = self.connection.execute("UPDATE units SET lease_expires = ? WHERE id = ? AND worker = ? "
+                                                 "AND state = 'leased'", (time.time() + self.lease_seconds, unit_id, worker))
+                if cursor.rowcount == 0:
+                    raise LeaseLost(f'Unit {unit_id} is no longer leased to {worker}')
+
+    def complete(self, worker, unit_id, result=None, new_units=()):
+        """Store the result of a leased unit and queue the units it produced, atomically (False if the lease was lost)"""
+        with self.transaction():
+            cursor = self.connection.execute("UPDATE units SET state = 'done', result = ?, finished_at = ?, "
+                                             "lease_expires = NULL WHERE id = ? AND worker = ? AND state = 'leased'",
+                                             (self.pack(result), time.time(), unit_id, worker))
+            if cursor.rowcount == 0:
+                return False
+            self.insert_units(new_units)
+        return True
+
+    def release(self, worker, unit_ids, failed=True):
+        """Give leased units back to the queue (failed: the lease counts as an attempt)"""
+        with self.transaction():
+            for unit_id in unit_ids:
+                if failed:
+                    self.connection.execute("UPDATE units SET state = CASE WHEN attempts < ? THEN 'pending' "
+                                            "ELSE 'failed' END, worker = NULL WHERE id = ? AND worker = ? "
+                                            "AND state = 'leased'", (self.max_attempts, unit_id, worker))
+                else:
+                    self.connection.execute("UPDATE units SET state = 'pending', worker = NULL, attempts = attempts - 1 "
+                                            "WHERE id = ? AND worker = ? AND state = 'leased'", (unit_id, worker))
+
+    def counts(self):
+        """Number of units by kind and state: {(kind, state): count}"""
+        rows = self.connection.execute('SELECT kind, state, COUNT(*) FROM units GROUP BY kind, state').fetchall()
+        return {(kind, state): count for kind, state, count in rows}
+
+    def outstanding(self):
+        """Number of units pending or leased"""
+        return self.connection.execute("SELECT COUNT(*) FROM units WHERE state IN ('pending', 'leased')").fetchone()[0]
+
+    def results(self, kind):
+        """(unit_id, key, payload, result, finished_at) of every finished unit of a kind, in queue order"""
+        rows = self.connection.execute("SELECT id, key, payload, result, finished_at FROM units WHERE kind = ? "
+                                       "AND state = 'done' ORDER BY id", (kind,)).fetchall()
+        return [(unit_id, key, self.unpack(payload), self.unpack(result), finished_at)
+                for unit_id, key, payload, result, finished_at in rows]
+
+    def failed(self):
+        """(unit_id, kind, key) of the units that failed every attempt"""
+        return self.connection.execute("SELECT id, kind, key FROM units WHERE state = 'failed' ORDER BY id").fetchall()
+
+    def set_marker(self, name, value):
+        with self.transaction():
+            self.connection.execute('INSERT OR REPLACE INTO markers VALUES (?, ?, ?)', (name, self.pack(value), time.time()))
+
+    def get_marker(self, name):
+        """(value, recorded_at) of a marker, None if it was never set"""
+        row = self.connection.execute('SELECT value, recorded_at FROM markers WHERE name = ?', (name,)).fetchone()
+        return (self.unpack(row[0]), row[1]) if row else None
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """Write transaction taking the database lock up front (BEGIN IMMEDIATE): no unit is ever leased twice"""
+        self.connection.execute('BEGIN IMMEDIATE')
+        try:
+            yield self.connection
+        except BaseException:
+            self.connection.execute('ROLLBACK')
+            raise
+        self.connection.execute('COMMIT')
+
+    def close(self):
+        self.connection.close()